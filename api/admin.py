@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import (Patient, Medecin, Consultation, Medicament, Facturation,
-                     RendezVous, Ordonnance, OrdonnanceMedicament)
+                     RendezVous, Ordonnance, OrdonnanceMedicament, Paiement, PlageHoraire,
+                     RequeteLente)
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
@@ -44,6 +45,12 @@ class MedecinAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('date_ajout',)
 
+@admin.register(PlageHoraire)
+class PlageHoraireAdmin(admin.ModelAdmin):
+    list_display = ('medecin', 'jour_semaine', 'heure_debut', 'heure_fin', 'duree_creneau')
+    list_filter = ('jour_semaine', 'medecin__specialite')
+    search_fields = ('medecin__nom', 'medecin__prenom')
+
 @admin.register(RendezVous)
 class RendezVousAdmin(admin.ModelAdmin):
     list_display = ('patient', 'medecin', 'date_heure', 'statut')
@@ -109,3 +116,49 @@ class FacturationAdmin(admin.ModelAdmin):
             'fields': ('description', 'notes')
         }),
     )
+
+@admin.register(Paiement)
+class PaiementAdmin(admin.ModelAdmin):
+    list_display = ('id', 'facture', 'montant', 'utilisateur', 'date_paiement')
+    list_filter = ('date_paiement',)
+    search_fields = ('facture__patient__nom', 'facture__patient__prenom')
+    readonly_fields = ('facture', 'montant', 'utilisateur', 'date_paiement')
+
+    # Journal en ajout seul : les paiements sont enregistrés par l'API
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(RequeteLente)
+class RequeteLenteAdmin(admin.ModelAdmin):
+    list_display = ('empreinte_courte', 'extrait', 'nombre', 'duree_totale_ms', 'duree_moyenne', 'duree_max_ms',
+                    'vue', 'date_derniere')
+    list_filter = ('base',)
+    search_fields = ('sql', 'vue')
+    ordering = ('-duree_totale_ms',)
+    readonly_fields = ('empreinte', 'sql', 'parametres', 'base', 'vue', 'pile', 'plan', 'nombre',
+                       'duree_totale_ms', 'duree_max_ms', 'date_premiere', 'date_derniere')
+
+    @admin.display(description='empreinte')
+    def empreinte_courte(self, obj):
+        return obj.empreinte[:12]
+
+    @admin.display(description='requête')
+    def extrait(self, obj):
+        return obj.sql[:120]
+
+    @admin.display(description='durée moyenne (ms)')
+    def duree_moyenne(self, obj):
+        return round(obj.duree_moyenne_ms, 1)
+
+    # Rapport alimenté par api/slowqueries.py ; la suppression remet une empreinte à zéro
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
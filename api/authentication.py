@@ -0,0 +1,114 @@
+"""Authentification JWT sans lecture de ``auth_user`` à chaque requête.
+
+L'utilisateur désigné par la claim ``user_id`` du jeton est gardé par chaque worker pendant
+``AUTH_USER_CACHE_SECONDS`` : les requêtes suivantes du même utilisateur ne lisent plus la base. Le
+jeton ne porte ni ``is_active`` ni les permissions, la première requête de la période charge donc la
+ligne avec les contrôles de simplejwt.
+
+Une écriture sur l'utilisateur (désactivation, mot de passe), ses groupes ou ses permissions le
+retire aussitôt du cache de ce processus (api/signals.py) et incrémente au commit la version de la
+table ``auth_user`` (api/versioning.py), en base donc partagée par tous les workers. Chaque worker
+relit cette version au plus toutes les ``AUTH_USER_CHECK_SECONDS`` et vide son cache si elle a
+changé : un utilisateur désactivé ailleurs est refusé au plus ``AUTH_USER_CHECK_SECONDS`` après le
+commit, quel que soit CACHES.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import versioning
+
+# str(user_id) -> (time.time() du chargement, utilisateur) ; la claim du jeton est une chaîne, la clé
+# primaire reçue par forget() un entier
+_users = {}
+_lock = threading.Lock()
+
+
+class _State:
+    def __init__(self):
+        # Version de auth_user vue à la dernière vérification, time.monotonic() de celle-ci
+        self.version = None
+        self.checked = None
+
+
+_state = _State()
+
+
+def check_version():
+    """Vide le cache du processus si un worker a modifié un utilisateur (au plus toutes les AUTH_USER_CHECK_SECONDS)"""
+    now = time.monotonic()
+    if _state.checked is not None and now - _state.checked < settings.AUTH_USER_CHECK_SECONDS:
+        return
+    table = versioning.table_of(get_user_model())
+    version = versioning.read([table])[table][0]
+    with _lock:
+        if version != _state.version:
+            _users.clear()
+            _state.version = version
+        _state.checked = now
+
+
+def cached_user(user_id):
+    """Copie de l'utilisateur gardé par ce processus, ou None s'il est absent, expiré ou modifié depuis"""
+    check_version()
+    entry = _users.get(str(user_id))
+    if entry is None:
+        return None
+    loaded_at, user = entry
+    if time.time() - loaded_at >= settings.AUTH_USER_CACHE_SECONDS:
+        return None
+    return copy.copy(user)
+
+
+def remember(user_id, user, loaded_at):
+    if settings.AUTH_USER_CACHE_SECONDS > 0:
+        with _lock:
+            _users[str(user_id)] = (loaded_at, user)
+
+
+def reset():
+    """Oublie les utilisateurs et la version vue : la prochaine requête relit les deux"""
+    global _state
+    with _lock:
+        _users.clear()
+    _state = _State()
+
+
+def forget(user_id=None):
+    """Retire un utilisateur (tous si None) du cache de ce processus et le signale aux autres au commit"""
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(str(user_id), None)
+    if settings.AUTH_USER_CACHE_SECONDS > 0:
+        versioning.changed(get_user_model())
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication dont l'utilisateur est servi par le cache du processus"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        user = cached_user(user_id)
+        if user is None:
+            # Heure prise avant la lecture : une modification pendant le chargement invalide l'entrée
+            loaded_at = time.time()
+            user = super().get_user(validated_token)
+            remember(user_id, user, loaded_at)
+        elif api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
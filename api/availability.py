@@ -0,0 +1,162 @@
+"""Recherche des créneaux libres des médecins.
+
+Les plages horaires hebdomadaires (PlageHoraire) sont découpées en créneaux ; un créneau est pris
+s'il chevauche un rendez-vous non annulé. Les plages de tous les médecins sont gardées en mémoire
+et rechargées quand la version de leur table change (api/versioning.py). Les rendez-vous sont lus
+jour par jour, une requête par jour pour tous les médecins candidats, et rangés par médecin en
+listes triées de minutes interrogées par bisect.
+
+Les créneaux de chaque médecin sont produits paresseusement, dans l'ordre, et fusionnés par
+heapq.merge : chercher les N premiers créneaux libres parmi des milliers de médecins ne génère que
+les créneaux et ne lit que les jours nécessaires.
+"""
+import heapq
+import threading
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.utils import timezone
+
+from . import versioning
+from .models import Medecin, PlageHoraire, RendezVous
+from .overlaps import DUREE_MAX, STATUTS_LIBRES
+
+Creneau = namedtuple('Creneau', 'debut fin medecin_id')
+
+_cache = {'version': None, 'plages': None}
+_lock = threading.Lock()
+
+
+def minutes(moment):
+    """Minutes écoulées depuis l'époque : les comparaisons d'intervalles se font sur des entiers"""
+    return int(moment.timestamp()) // 60
+
+
+def plages_horaires():
+    """{medecin_id: {jour_semaine: [(heure_debut, heure_fin, duree_creneau)]}} de tous les médecins"""
+    table = versioning.table_of(PlageHoraire)
+    # (compteur, date) : un compteur revenu à la même valeur (base recréée) ne passe pas pour inchangé
+    version = versioning.read([table])[table]
+    with _lock:
+        if _cache['plages'] is not None and _cache['version'] == version:
+            return _cache['plages']
+    plages = defaultdict(lambda: defaultdict(list))
+    for medecin_id, jour, debut, fin, duree in PlageHoraire.objects.order_by(
+            'medecin_id', 'jour_semaine', 'heure_debut').values_list(
+            'medecin_id', 'jour_semaine', 'heure_debut', 'heure_fin', 'duree_creneau'):
+        plages[medecin_id][jour].append((debut, fin, duree))
+    plages = {medecin_id: dict(jours) for medecin_id, jours in plages.items()}
+    with _lock:
+        _cache.update(version=version, plages=plages)
+    return plages
+
+
+def invalidate():
+    """Oublie les plages en mémoire (écriture dans ce processus, avant même le commit)"""
+    with _lock:
+        _cache.update(version=None, plages=None)
+
+
+class Occupation:
+    """Rendez-vous des médecins candidats, chargés par jour à la première demande"""
+
+    def __init__(self, rendez_vous, tz):
+        self.rendez_vous = rendez_vous
+        self.tz = tz
+        self.jours = {}
+
+    def intervalles(self, jour, medecin_id):
+        """(débuts, fins) triés, en minutes, des rendez-vous du médecin qui touchent ce jour"""
+        if jour not in self.jours:
+            self.jours[jour] = self.charger(jour)
+        return self.jours[jour].get(medecin_id, ((), ()))
+
+    def charger(self, jour):
+        debut = timezone.make_aware(datetime.combine(jour, datetime.min.time()), self.tz)
+        rows = (self.rendez_vous
+                .filter(date_heure__gt=debut - DUREE_MAX, date_heure__lt=debut + timedelta(days=1),
+                        date_fin__gt=debut)
+                .exclude(statut__in=STATUTS_LIBRES)
+                .order_by('medecin_id', 'date_heure')
+                .values_list('medecin_id', 'date_heure', 'date_fin'))
+        par_medecin = defaultdict(lambda: ([], []))
+        for medecin_id, date_heure, date_fin in rows:
+            debuts, fins = par_medecin[medecin_id]
+            debuts.append(minutes(date_heure))
+            # Fins cumulées : la liste reste triée même si des rendez-vous anciens se chevauchent
+            fins.append(max(minutes(date_fin), fins[-1]) if fins else minutes(date_fin))
+        return dict(par_medecin)
+
+
+def est_libre(intervalles, debut, fin):
+    """Aucun intervalle [d, f) ne chevauche [debut, fin)"""
+    debuts, fins = intervalles
+    # Premier rendez-vous qui finit après le début du créneau
+    i = bisect_right(fins, debut)
+    return i == len(debuts) or debuts[i] >= fin
+
+
+class Calendrier:
+    """Jours de la période et bornes des plages en minutes, calculées une fois pour tous les médecins"""
+
+    def __init__(self, debut, fin):
+        self.tz = timezone.get_current_timezone()
+        self.debut, self.fin = minutes(debut), minutes(fin)
+        jour, dernier = timezone.localtime(debut, self.tz).date(), timezone.localtime(fin, self.tz).date()
+        self.jours = [jour + timedelta(days=i) for i in range((dernier - jour).days + 1)]
+        self.bornes = {}
+
+    def minute(self, jour, heure):
+        """Heure locale d'un jour, en minutes (changements d'heure compris)"""
+        key = (jour, heure)
+        if key not in self.bornes:
+            self.bornes[key] = minutes(timezone.make_aware(datetime.combine(jour, heure), self.tz))
+        return self.bornes[key]
+
+
+def creneaux(medecin_id, plages, occupation, calendrier):
+    """Créneaux libres du médecin qui commencent dans la période, dans l'ordre chronologique"""
+    for jour in calendrier.jours:
+        series = []
+        for heure_debut, heure_fin, duree in plages.get(jour.weekday(), ()):
+            origine = calendrier.minute(jour, heure_debut)
+            # Créneaux alignés sur le début de la plage
+            depart = origine + max(0, -(-(calendrier.debut - origine) // duree)) * duree
+            limite = min(calendrier.minute(jour, heure_fin), calendrier.fin + duree - 1)
+            if depart + duree <= limite:
+                series.append(zip(range(depart, limite - duree + 1, duree), range(depart + duree, limite + 1, duree)))
+        if not series:
+            continue
+        intervalles = occupation.intervalles(jour, medecin_id)
+        precedent = None
+        # Une plage par jour dans le cas courant ; plusieurs plages sont fusionnées sans doublon
+        for creneau in (series[0] if len(series) == 1 else heapq.merge(*series)):
+            if creneau != precedent and est_libre(intervalles, *creneau):
+                yield Creneau(*creneau, medecin_id)
+            precedent = creneau
+
+
+def rechercher(debut, fin, limite, medecin_id=None, specialite=None):
+    """Les ``limite`` premiers créneaux libres entre debut et fin, d'un médecin ou d'une spécialité"""
+    plages = plages_horaires()
+    rendez_vous = RendezVous.objects.all()
+    if medecin_id is not None:
+        candidats = [medecin_id] if medecin_id in plages else []
+        rendez_vous = rendez_vous.filter(medecin_id=medecin_id)
+    elif specialite is not None:
+        ids = set(Medecin.objects.filter(specialite=specialite).values_list('id', flat=True))
+        candidats = [pk for pk in plages if pk in ids]
+        rendez_vous = rendez_vous.filter(medecin__specialite=specialite)
+    else:
+        candidats = list(plages)
+    calendrier = Calendrier(debut, fin)
+    occupation = Occupation(rendez_vous, calendrier.tz)
+    flux = [creneaux(pk, plages[pk], occupation, calendrier) for pk in candidats]
+    return [Creneau(_moment(c.debut, calendrier.tz), _moment(c.fin, calendrier.tz), c.medecin_id)
+            for c in islice(heapq.merge(*flux), limite)]
+
+
+def _moment(valeur, tz):
+    return datetime.fromtimestamp(valeur * 60, tz=tz)
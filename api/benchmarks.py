@@ -0,0 +1,297 @@
+"""Budget de requêtes SQL et mesures de latence/mémoire pour chaque endpoint de l'API."""
+import itertools
+import json
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from . import cache, compiled, versioning
+
+# Nombre maximal de requêtes SQL par endpoint. L'utilisateur du jeton vient du cache du worker
+# (api/authentication.py, voir authenticate()).
+# Une liste paginée coûte 1 (versions des tables, ETag) + 1 (COUNT) + 1 (page) + 1 par prefetch.
+# Une écriture de facture met à jour jusqu'à 5 lignes d'agrégats (api/rollups.py).
+# Médecins et médicaments viennent du cache de référence (api/cache.py) : sans ETag, leur version
+# coûte 1 requête, qui remplace la jointure.
+QUERY_BUDGETS = {
+    'patient-list': 3,
+    'patient-detail': 2,
+    'patient-consultations': 3,
+    'patient-facturations': 3,
+    'patient-rendez-vous': 3,
+    'patient-agenda': 3,
+    'patient-import': 3,
+    'medecin-list': 3,
+    'medecin-detail': 2,
+    'medecin-consultations': 3,
+    'medecin-rendez-vous': 3,
+    'medecin-agenda': 3,
+    # Plages horaires relues si leur version a changé, puis une requête de rendez-vous par jour parcouru
+    'medecin-creneaux': 5,
+    'medecin-creneaux-specialite': 3,
+    'consultation-list': 3,
+    'consultation-detail': 2,
+    'consultation-ordonnance': 4,
+    'medicament-list': 3,
+    'medicament-detail': 2,
+    'medicament-import': 1,
+    'facturation-list': 3,
+    'facturation-detail': 2,
+    'facturation-enregistrer-paiement': 7,
+    'facturation-statistiques': 1,
+    'rendezvous-list': 3,
+    'rendezvous-detail': 2,
+    'rendezvous-annuler': 2,
+    'rendezvous-confirmer': 2,
+    'ordonnance-list': 4,
+    'ordonnance-detail': 3,
+    'ordonnance-ajouter-medicament': 4,
+    'plagehoraire-list': 3,
+    'plagehoraire-detail': 2,
+}
+
+# Corps des requêtes POST des actions personnalisées, construits à partir des objets de référence
+ACTION_PAYLOADS = {
+    'facturation-enregistrer-paiement': lambda objects: {'montant': '1'},
+    'patient-import': lambda objects: {'file': SimpleUploadedFile('patients.csv', (
+        'nom,prenom,date_naissance,adresse,telephone,email\n'
+        'Benchmark,Import,1980-01-01,Dakar,770000000,import@benchmark.sn\n').encode())},
+    'medicament-import': lambda objects: {'file': SimpleUploadedFile('medicaments.ndjson', (
+        '{"nom": "Benchmark", "description": "Import", "prix": "100", "dosage": "1g", "fabricant": "SN"}\n'
+    ).encode())},
+    'ordonnance-ajouter-medicament': lambda objects: {
+        'medicament_id': objects['medicament'].pk, 'dosage': '1', 'frequence': '1x/jour', 'duree': '5 jours',
+    },
+}
+
+
+class EndpointError(Exception):
+    """Réponse hors 2xx d'un endpoint mesuré : la mesure ne porterait pas sur le vrai traitement"""
+
+
+@dataclass
+class Endpoint:
+    name: str
+    method: str
+    url: str
+    payload: dict = field(default=None)
+
+
+def iter_endpoints(router, prefix='/api/'):
+    """Énumère les routes list/detail et les actions personnalisées enregistrées sur le router"""
+    # Mesures en régime établi : cache de référence chargé comme au démarrage de gunicorn
+    cache.warm()
+    objects = _reference_objects()
+    for url_prefix, viewset, basename in router.registry:
+        instance = viewset.queryset.model.objects.order_by('pk').first()
+        list_url = f'{prefix}{url_prefix}/'
+        yield Endpoint(f'{basename}-list', 'get', list_url)
+        if instance is not None:
+            yield Endpoint(f'{basename}-detail', 'get', f'{list_url}{instance.pk}/')
+        for action in viewset.get_extra_actions():
+            name = f'{basename}-{action.url_name}'
+            if action.detail and instance is None:
+                continue
+            url = f'{list_url}{instance.pk}/{action.url_path}/' if action.detail else f'{list_url}{action.url_path}/'
+            for method in action.mapping:
+                payload = ACTION_PAYLOADS[name](objects) if name in ACTION_PAYLOADS else None
+                yield Endpoint(name, method, url, payload)
+
+
+def _reference_objects():
+    from .models import Medicament
+    return {'medicament': Medicament.objects.order_by('pk').first()}
+
+
+def authenticate(client, username, password):
+    """Donne un jeton au client ; une première requête met l'utilisateur dans le cache du worker"""
+    token = client.post('/api/token/', {'username': username, 'password': password}, format='json')
+    if token.status_code != 200:
+        raise EndpointError(f'token: HTTP {token.status_code}')
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.json()["access"]}')
+    client.get('/api/')
+
+
+def call(client, endpoint):
+    """Exécute l'appel ; les écritures sont annulées pour garder des mesures reproductibles.
+
+    EndpointError si la réponse n'est pas un succès (2xx).
+    """
+    with transaction.atomic():
+        if endpoint.method == 'get':
+            response = client.get(endpoint.url)
+        else:
+            files = [value for value in (endpoint.payload or {}).values() if hasattr(value, 'seek')]
+            for upload in files:
+                upload.seek(0)
+            response = getattr(client, endpoint.method)(endpoint.url, endpoint.payload,
+                                                        format='multipart' if files else 'json')
+        if response.streaming:
+            # Le corps d'une réponse en flux est produit (et ses requêtes exécutées) à la lecture
+            b''.join(response.streaming_content)
+        transaction.set_rollback(True)
+    if not 200 <= response.status_code < 300:
+        raise EndpointError(f'{endpoint.name}: HTTP {response.status_code}')
+    return response
+
+
+def count_queries(captured_queries):
+    """Compte les requêtes en ignorant le contrôle de transaction ajouté par call()"""
+    return sum(1 for q in captured_queries
+               if 'SAVEPOINT' not in q['sql'] and q['sql'] not in ('BEGIN', 'COMMIT', 'ROLLBACK'))
+
+
+def measure(client, endpoint, iterations=20):
+    """Mesure nombre de requêtes, p50/p95 (ms) et pic mémoire (Kio) d'un endpoint"""
+    with CaptureQueriesContext(connection) as ctx:
+        call(client, endpoint)
+    queries = count_queries(ctx.captured_queries)
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call(client, endpoint)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    call(client, endpoint)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'queries': queries,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 3),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold=0.25):
+    """Liste les régressions par rapport à la référence (latence/mémoire au-delà du seuil relatif)"""
+    regressions = []
+    for name, current in results.items():
+        budget = QUERY_BUDGETS.get(name)
+        if budget is not None and current['queries'] > budget:
+            regressions.append(f'{name}: {current["queries"]} requêtes SQL (budget {budget})')
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: {current["queries"]} requêtes SQL (référence {previous["queries"]})')
+        for metric in ('p50_ms', 'p95_ms', 'peak_kib'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f'{name}: {metric} {current[metric]} (référence {previous[metric]})')
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+
+
+def compare_serialization(serializer, queryset, iterations=20):
+    """Temps médian (ms) de conversion des lignes par le serializer DRF et par le chemin compilé.
+
+    Les lignes sont lues une seule fois, seule la conversion est chronométrée. Lève AssertionError
+    si les deux sorties JSON diffèrent.
+    """
+    # Versions des tables mémorisées comme pendant une requête (cache de référence, api/versioning.py)
+    versioning.start_request()
+    try:
+        return _compare_serialization(serializer, queryset, iterations)
+    finally:
+        versioning.end_request()
+
+
+def _compare_serialization(serializer, queryset, iterations):
+    fast = compiled.compile(serializer)
+    objects = list(serializer.apply_eager_loading(queryset))
+    rows = list(fast.values(queryset))
+    renderer = JSONRenderer()
+    if renderer.render(type(serializer)(objects, many=True).data) != renderer.render(fast.render(rows)):
+        raise AssertionError(f'{type(serializer).__name__}: sortie compilée différente')
+
+    def median_ms(convert):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            convert()
+            timings.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(timings), 3)
+
+    drf_ms = median_ms(lambda: type(serializer)(objects, many=True).data)
+    compiled_ms = median_ms(lambda: fast.render(rows))
+    return {'rows': len(rows), 'drf_ms': drf_ms, 'compiled_ms': compiled_ms,
+            'speedup': round(drf_ms / compiled_ms, 1) if compiled_ms else None}
+
+
+def read_paths(router, get, prefix='/api/'):
+    """Chemins servis par les vues asynchrones en mode ASGI : listes, détails et sous-ressources.
+
+    ``get(path)`` renvoie le JSON d'une liste ; le premier objet de chaque liste sert au détail.
+    """
+    paths = []
+    for url_prefix, viewset, basename in router.registry:
+        list_url = f'{prefix}{url_prefix}/'
+        paths.append(list_url)
+        body = get(list_url)
+        results = body['results'] if isinstance(body, dict) else body
+        if not results:
+            continue
+        detail_url = f'{list_url}{results[0]["id"]}/'
+        paths.append(detail_url)
+        paths.extend(f'{detail_url}{action.url_path}/' for action in viewset.get_extra_actions()
+                     if action.detail and action.__name__ in getattr(viewset, 'async_actions', ()))
+    return paths
+
+
+def throughput(get, paths, clients=32, duration=10.0):
+    """Débit de ``clients`` clients concurrents qui parcourent ``paths`` en boucle pendant ``duration`` s.
+
+    ``get(path)`` exécute un appel et renvoie le code HTTP (chaque client l'appelle depuis son thread).
+    """
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        timings, errors = [], 0
+        for n in itertools.count(offset):
+            if time.perf_counter() >= deadline:
+                break
+            started = time.perf_counter()
+            try:
+                failed = get(paths[n % len(paths)]) >= 400
+            except OSError:
+                failed = True
+            timings.append((time.perf_counter() - started) * 1000)
+            errors += failed
+        return timings, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - started
+    timings = sorted(t for client_timings, _ in results for t in client_timings)
+    return {
+        'requests': len(timings),
+        'errors': sum(errors for _, errors in results),
+        'rps': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 3) if timings else None,
+        'p95_ms': round(timings[max(0, int(len(timings) * 0.95) - 1)], 3) if timings else None,
+    }
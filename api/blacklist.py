@@ -0,0 +1,175 @@
+"""Liste noire des refresh tokens, indexée par jti, devant laquelle chaque worker garde un filtre de Bloom.
+
+Un refresh token échangé (ROTATE_REFRESH_TOKENS + BLACKLIST_AFTER_ROTATION) est inscrit dans
+JetonRevoque jusqu'à son expiration. À chaque échange, le jti présenté est d'abord cherché dans le
+filtre de Bloom du processus : absent, le jeton n'est pas révoqué et la base n'est pas lue ; présent,
+une lecture par clé primaire écarte les faux positifs (``BLACKLIST_BLOOM_ERROR_RATE``).
+
+Le filtre est reconstruit depuis la table toutes les ``BLACKLIST_REBUILD_SECONDS`` (les jetons expirés
+en sortent) ; le premier worker de la période le dépose dans le cache Django, où les autres le
+reprennent si CACHES est partagé. Entre deux reconstructions, les révocations des autres workers sont
+ajoutées au plus toutes les ``BLACKLIST_CHECK_SECONDS`` ; pendant ce délai, un jeton révoqué par un
+autre worker peut encore être échangé une fois ici. ``manage.py purge_revoked_tokens`` supprime les
+lignes expirées.
+"""
+import hashlib
+import math
+import struct
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .models import JetonRevoque
+
+# Capacité minimale du filtre : les révocations de la période s'ajoutent à celles de la reconstruction
+MIN_CAPACITY = 10000
+
+# Recouvrement des lectures incrémentales, pour les révocations validées après leur date
+OVERLAP = timedelta(seconds=60)
+
+
+class BloomFilter:
+    """Filtre de Bloom : ``in`` peut répondre vrai à tort (taux ``error_rate``), jamais faux à tort"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        # Double hachage (Kirsch-Mitzenmacher) sur une seule empreinte
+        h1, h2 = struct.unpack('<QQ', hashlib.blake2b(item.encode(), digest_size=16).digest())
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    def to_bytes(self):
+        return struct.pack('<QI', self.size, self.hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        bloom = cls.__new__(cls)
+        bloom.size, bloom.hashes = struct.unpack_from('<QI', data)
+        bloom.bits = bytearray(data[struct.calcsize('<QI'):])
+        return bloom
+
+
+class _State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        # Période de reconstruction du filtre, date jusqu'à laquelle les révocations y sont, time.monotonic()
+        self.period = None
+        self.loaded_until = None
+        self.checked = None
+
+
+_state = _State()
+
+
+def _cache_key(period):
+    return f'blacklist:bloom:{period}'
+
+
+def build():
+    """Filtre des jetons révoqués non expirés ; renvoie (filtre, date de la lecture)"""
+    now = timezone.now()
+    rows = JetonRevoque.objects.filter(date_expiration__gt=now)
+    bloom = BloomFilter(max(MIN_CAPACITY, 2 * rows.count()), settings.BLACKLIST_BLOOM_ERROR_RATE)
+    for jti in rows.values_list('jti', flat=True).iterator(chunk_size=10000):
+        bloom.add(jti)
+    return bloom, now
+
+
+def current():
+    """Filtre du processus, reconstruit ou complété s'il date de plus de BLACKLIST_CHECK_SECONDS"""
+    state = _state
+    now = time.monotonic()
+    if state.checked is not None and now - state.checked < settings.BLACKLIST_CHECK_SECONDS:
+        return state.bloom
+    with state.lock:
+        if state.checked is not None and now - state.checked < settings.BLACKLIST_CHECK_SECONDS:
+            return state.bloom
+        period = int(time.time() // settings.BLACKLIST_REBUILD_SECONDS)
+        if period != state.period:
+            shared = cache.get(_cache_key(period))
+            if shared is None:
+                bloom, loaded_until = build()
+                cache.set(_cache_key(period), (loaded_until, bloom.to_bytes()), settings.BLACKLIST_REBUILD_SECONDS)
+            else:
+                bloom = BloomFilter.from_bytes(shared[1])
+                loaded_until = add_revoked_since(bloom, shared[0])
+            state.bloom, state.period = bloom, period
+        else:
+            loaded_until = add_revoked_since(state.bloom, state.loaded_until)
+        state.loaded_until, state.checked = loaded_until, time.monotonic()
+        return state.bloom
+
+
+def add_revoked_since(bloom, since):
+    """Ajoute au filtre les révocations (des autres workers) faites depuis ``since`` ; renvoie la date de lecture"""
+    now = timezone.now()
+    for jti in JetonRevoque.objects.filter(date_revocation__gte=since - OVERLAP).values_list('jti', flat=True):
+        bloom.add(jti)
+    return now
+
+
+def forget():
+    """Oublie le filtre du processus : il sera rechargé à la prochaine vérification"""
+    global _state
+    _state = _State()
+
+
+def is_revoked(jti):
+    if jti not in current():
+        return False
+    return JetonRevoque.objects.filter(jti=jti).exists()
+
+
+def revoke(jti, expires_at):
+    JetonRevoque.objects.bulk_create([JetonRevoque(jti=jti, date_expiration=expires_at)], ignore_conflicts=True)
+    bloom = current()
+    with _state.lock:
+        bloom.add(jti)
+
+
+def purge(batch_size=1000, progress=None):
+    """Supprime par lots les jetons expirés ; renvoie le nombre de lignes supprimées"""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        batch = list(JetonRevoque.objects.filter(date_expiration__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += JetonRevoque.objects.filter(pk__in=batch).delete()[0]
+        if progress is not None:
+            progress(deleted)
+
+
+class RefreshToken(tokens.RefreshToken):
+    """Refresh token contrôlé par la liste noire de ce module plutôt que par l'application token_blacklist"""
+
+    def verify(self, *args, **kwargs):
+        self.check_blacklist()
+        super().verify(*args, **kwargs)
+
+    def check_blacklist(self):
+        if is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        revoke(self.payload[api_settings.JTI_CLAIM], datetime_from_epoch(self.payload['exp']))
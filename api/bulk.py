@@ -0,0 +1,253 @@
+"""Écritures en masse (liste d'objets en POST/PATCH/DELETE sur une route de liste).
+
+La validation réutilise les serializers des ViewSets, par lots de ``BATCH_SIZE`` objets. Les
+PrimaryKeyRelatedField et les validateurs d'unicité, qui feraient une requête par objet, sont
+remplacés par une requête par champ et par lot. La persistance passe par bulk_create/bulk_update :
+save() n'est pas appelé, les signaux post_bulk_create/post_bulk_update (api/signals.py) prennent le relais.
+"""
+from datetime import date
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
+
+from . import overlaps
+from .cache import CachedPrimaryKeyRelatedField
+from .signals import post_bulk_create, post_bulk_update
+
+BATCH_SIZE = 1000
+
+
+class Preloaded:
+    """Remplace le queryset d'un PrimaryKeyRelatedField par les objets chargés pour tout le lot"""
+
+    def __init__(self, model, objects):
+        self.model = model
+        self.objects = objects
+
+    def get(self, pk):
+        try:
+            pk = self.model._meta.pk.to_python(pk)
+        except DjangoValidationError:
+            raise ValueError(pk)
+        try:
+            return self.objects[pk]
+        except (KeyError, TypeError):
+            raise self.model.DoesNotExist
+
+
+def unique_checks(model):
+    """Noms de champs de chaque contrainte d'unicité du modèle, hors clé primaire"""
+    checks = [(field.name,) for field in model._meta.concrete_fields if field.unique and not field.primary_key]
+    checks += [tuple(fields) for fields in model._meta.unique_together]
+    checks += [tuple(constraint.fields) for constraint in model._meta.total_unique_constraints if constraint.fields]
+    return checks
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """Valide une liste d'objets en gardant pour chacun les données validées ou ses erreurs.
+
+    ``instances`` (mise à jour) est aligné sur les données ; ``seen`` mémorise les valeurs uniques
+    des lots précédents pour détecter les doublons à l'intérieur d'une même requête.
+    """
+
+    def __init__(self, *args, instances=None, seen=None, **kwargs):
+        self.instances = instances
+        self.seen = {} if seen is None else seen
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        self.item_errors = [{} for _ in data]
+        self.strip_unique_validators()
+        self.preload_related(data)
+        instances = self.instances or [None] * len(data)
+        ret = []
+        for position, (item, instance) in enumerate(zip(data, instances)):
+            self.child.instance = instance
+            try:
+                ret.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                ret.append(None)
+                self.item_errors[position] = exc.detail
+        self.child.instance = None
+        self.check_unique(ret, instances)
+        if self.check_overlaps:
+            self.check_no_overlap(ret, instances)
+        return ret
+
+    def strip_unique_validators(self):
+        for field in self.child.fields.values():
+            field.validators = [v for v in field.validators if not isinstance(v, UniqueValidator)]
+        self.check_overlaps = any(isinstance(v, overlaps.NoOverlapValidator) for v in self.child.validators)
+        self.child.validators = [v for v in self.child.validators
+                                 if not isinstance(v, (UniqueTogetherValidator, overlaps.NoOverlapValidator))]
+
+    def preload_related(self, data):
+        for field in self.child.fields.values():
+            if (not isinstance(field, serializers.PrimaryKeyRelatedField) or field.read_only
+                    or field.pk_field is not None):
+                continue
+            queryset = field.get_queryset()
+            pk = queryset.model._meta.pk
+            values = set()
+            for item in data:
+                if isinstance(item, dict) and field.field_name in item:
+                    try:
+                        values.add(pk.to_python(item[field.field_name]))
+                    except (DjangoValidationError, TypeError):
+                        pass
+            values.discard(None)
+            if isinstance(field, CachedPrimaryKeyRelatedField):
+                # Objets de référence : lus dans le cache, complété en une requête si besoin
+                field.cache.prime(values)
+            else:
+                field.queryset = Preloaded(queryset.model, queryset.in_bulk(values))
+
+    def check_unique(self, validated, instances):
+        model = self.child.Meta.model
+        for names in unique_checks(model):
+            fields = [model._meta.get_field(name) for name in names]
+            keys = {}
+            for position, (data, instance) in enumerate(zip(validated, instances)):
+                if data is None or (instance is not None and not any(name in data for name in names)):
+                    continue
+                key = tuple(self.unique_value(field, data, instance) for field in fields)
+                if None not in key:
+                    keys[position] = key
+            if not keys:
+                continue
+            # Requête sur-ensemble (IN par colonne), les tuples exacts sont comparés ici
+            lookups = {f'{field.attname}__in': {key[i] for key in keys.values()} for i, field in enumerate(fields)}
+            taken = {row[:-1]: row[-1] for row in
+                     model._default_manager.filter(**lookups).values_list(*[f.attname for f in fields], 'pk')}
+            seen = self.seen.setdefault(names, {})
+            for position, key in keys.items():
+                # Une création n'est identique à aucune autre ligne
+                own = instances[position].pk if instances[position] is not None else object()
+                if taken.get(key, own) != own or seen.get(key, own) != own:
+                    validated[position] = None
+                    self.item_errors[position] = self.unique_error(names)
+                else:
+                    seen[key] = own
+
+    def check_no_overlap(self, validated, instances):
+        """Chevauchements de rendez-vous avec la base et dans la requête, en une requête par lot"""
+        intervals = {}
+        for position, (data, instance) in enumerate(zip(validated, instances)):
+            if data is not None:
+                interval = overlaps.interval(data, instance)
+                if interval is not None:
+                    intervals[position] = interval
+        for position in overlaps.conflicts(intervals, self.seen.setdefault('overlaps', [])):
+            validated[position] = None
+            self.item_errors[position] = serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [overlaps.MESSAGE]}, code='overlap').detail
+
+    @staticmethod
+    def unique_value(field, data, instance):
+        value = data[field.name] if field.name in data else getattr(instance, field.attname, None)
+        return value.pk if isinstance(value, models.Model) else value
+
+    def unique_error(self, names):
+        if len(names) == 1:
+            for field_name, field in self.child.fields.items():
+                if field.source == names[0] and not field.read_only:
+                    return serializers.ValidationError({field_name: [UniqueValidator.message]}, code='unique').detail
+        message = UniqueTogetherValidator.message.format(field_names=', '.join(names))
+        return serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='unique').detail
+
+
+INTEGRITY_MESSAGE = "Erreur d'intégrité : le lot n'a pas été enregistré"
+
+CHECK_MESSAGE = 'Valeurs incohérentes pour cet objet'
+
+
+def integrity_errors(model, exc):
+    """Erreurs par champ d'une IntegrityError, d'après la contrainte en cause.
+
+    Le texte de la base (tables, colonnes, contraintes) n'est pas renvoyé au client : une contrainte
+    inconnue donne seulement INTEGRITY_MESSAGE.
+    """
+    text = str(exc)
+    # psycopg nomme la contrainte ; SQLite ne la donne que dans le message
+    constraint = getattr(getattr(exc.__cause__, 'diag', None), 'constraint_name', None)
+    if constraint == overlaps.CONSTRAINT or overlaps.MESSAGE in text:
+        return {api_settings.NON_FIELD_ERRORS_KEY: [overlaps.MESSAGE]}
+    table = model._meta.db_table
+    for field in model._meta.concrete_fields:
+        if field.unique and not field.primary_key and (
+                f'{table}.{field.column}' in text or constraint == f'{table}_{field.column}_key'):
+            return {field.name: [str(UniqueValidator.message)]}
+    for check in model._meta.constraints:
+        if isinstance(check, models.CheckConstraint) and (check.name == constraint or check.name in text):
+            return {api_settings.NON_FIELD_ERRORS_KEY: [CHECK_MESSAGE]}
+    return {}
+
+
+def validate(serializer_class, entries, context, partial=False):
+    """Valide des (position, données, instance ou None) ; renvoie ({position: données}, {position: erreurs})"""
+    validated, errors, seen = {}, {}, {}
+    for start in range(0, len(entries), BATCH_SIZE):
+        chunk = entries[start:start + BATCH_SIZE]
+        serializer = BulkListSerializer(
+            child=serializer_class(context=context, partial=partial), data=[data for _, data, _ in chunk],
+            instances=[instance for _, _, instance in chunk], seen=seen, context=context, partial=partial,
+        )
+        serializer.is_valid()
+        for (position, _, _), data, error in zip(chunk, serializer.validated_data, serializer.item_errors):
+            if data is None:
+                errors[position] = error
+            else:
+                validated[position] = data
+    return validated, errors
+
+
+def create(model, validated):
+    """Crée les objets en bulk_create et renvoie les instances (clés primaires renseignées)"""
+    instances = [model(**data) for data in validated]
+    with transaction.atomic():
+        model._default_manager.bulk_create(instances, batch_size=BATCH_SIZE)
+        post_bulk_create.send(sender=model, instances=instances)
+    return instances
+
+
+def update(model, pairs):
+    """Applique les (instance, données validées) en bulk_update sur les seules colonnes reçues"""
+    if not pairs:
+        return []
+    with transaction.atomic():
+        # Versions enregistrées relues sous verrou, comme memoriser_facture pour save() : les receveurs
+        # de post_bulk_update (agrégats de facturation) ne calculent pas leurs différences sur une
+        # lecture qu'une écriture concurrente (paiement) aurait rendue obsolète
+        saved = model._default_manager.select_for_update().in_bulk([instance.pk for instance, _ in pairs])
+        pairs = [(instance, data) for instance, data in pairs if instance.pk in saved]
+        instances = [instance for instance, _ in pairs]
+        previous = [saved[instance.pk] for instance in instances]
+        names = set()
+        for instance, data in pairs:
+            for field in model._meta.concrete_fields:
+                setattr(instance, field.attname, getattr(saved[instance.pk], field.attname))
+            for name, value in data.items():
+                setattr(instance, name, value)
+                names.add(name)
+        # bulk_update n'appelle pas pre_save : les champs auto_now sont renseignés ici
+        now = timezone.now()
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                value = now if isinstance(field, models.DateTimeField) else date.today()
+                for instance in instances:
+                    setattr(instance, field.attname, value)
+                names.add(field.name)
+        model._default_manager.bulk_update(instances, sorted(names), batch_size=BATCH_SIZE)
+        post_bulk_update.send(sender=model, instances=instances, previous=previous)
+    return instances
+
+
+def delete(queryset):
+    """Supprime les objets (cascades et signaux post_delete compris) et renvoie leur nombre"""
+    with transaction.atomic():
+        _, deleted = queryset.delete()
+    return deleted.get(queryset.model._meta.label, 0)
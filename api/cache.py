@@ -0,0 +1,208 @@
+"""Cache en mémoire des données de référence : médecins et catalogue des médicaments.
+
+Chaque processus garde dans un LRU les instances de ces petites tables et leur représentation
+sérialisée ; les lignes de rendez-vous, consultations et ordonnances les servent depuis la clé
+étrangère, sans jointure ni nouvelle sérialisation (ReferenceField), et les champs d'écriture
+``medecin_id``/``medicament_id`` n'interrogent plus la base (CachedPrimaryKeyRelatedField).
+
+La validité est contrôlée par le compteur de version de la table (api/versioning.py), partagé par
+les workers à travers la base et lu au plus une fois par requête : une écriture validée dans un
+worker vide le cache des autres dès leur requête suivante. Les écritures du processus lui-même
+retirent aussitôt les lignes concernées (api/signals.py) ; les créations ne sont ajoutées qu'au
+commit, et les lignes lues dans une transaction sont relues une fois celle-ci terminée : une
+transaction annulée ne laisse pas d'objet fantôme dans le cache. Le cache est préchargé dans le processus
+maître de gunicorn (gunicorn.conf.py) et hérité par les workers au fork.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections, router, transaction
+from rest_framework import serializers
+
+from . import versioning
+from .models import Medecin, Medicament
+
+# Nombre maximal d'objets gardés par table ; au-delà, les moins récemment lus sont évincés
+MAX_SIZE = 10000
+
+REFERENCE_MODELS = [Medecin, Medicament]
+
+REFERENCE_TABLES = [versioning.table_of(model) for model in REFERENCE_MODELS]
+
+
+class ReferenceCache:
+    """LRU des instances d'un modèle et de leurs représentations, invalidé par la version de la table"""
+
+    def __init__(self, model, max_size=MAX_SIZE):
+        self.model = model
+        self.max_size = max_size
+        self.table = versioning.table_of(model)
+        self.lock = threading.RLock()
+        # pk -> (instance, {classe de serializer: représentation})
+        self.entries = OrderedDict()
+        self.version = None
+        # Toute la table est en mémoire : une clé absente n'existe pas
+        self.complete = False
+        # La table dépasse max_size : pas de chargement complet après invalidation
+        self.oversized = False
+        # Lignes lues dans une transaction, peut-être annulée depuis : table rechargée hors transaction
+        self.tainted = False
+
+    def in_transaction(self):
+        return connections[router.db_for_write(self.model)].in_atomic_block
+
+    def validate(self):
+        """Vide le cache si la table a changé depuis son chargement"""
+        version = versioning.read([self.table], also=REFERENCE_TABLES)[self.table][0]
+        with self.lock:
+            if version != self.version or (self.tainted and not self.in_transaction()):
+                self.entries.clear()
+                self.complete = False
+                self.version = version
+                if not self.oversized:
+                    self.load()
+
+    def load(self):
+        """Charge toute la table en un SELECT si elle tient dans le cache"""
+        objects = list(self.model._default_manager.order_by('pk')[:self.max_size + 1])
+        with self.lock:
+            self.oversized = len(objects) > self.max_size
+            self.complete = not self.oversized
+            self.tainted = self.in_transaction()
+            self.entries.clear()
+            for instance in objects[:self.max_size]:
+                self.entries[instance.pk] = (instance, {})
+
+    def discard(self, pks):
+        """Retire des objets modifiés par ce processus ; la table est rechargée à la lecture suivante"""
+        with self.lock:
+            for pk in pks:
+                self.entries.pop(pk, None)
+            self.complete = False
+            self.version = None
+
+    def prime(self, pks):
+        """Charge en une requête les objets absents parmi ``pks``"""
+        self.validate()
+        with self.lock:
+            if self.complete:
+                return
+            missing = [pk for pk in pks if pk not in self.entries]
+        if missing:
+            self.store(self.model._default_manager.in_bulk(missing).values())
+
+    def store(self, instances):
+        with self.lock:
+            self.tainted = self.tainted or self.in_transaction()
+            for instance in instances:
+                self.entries[instance.pk] = (instance, {})
+                self.entries.move_to_end(instance.pk)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.complete = False
+
+    def entry(self, pk):
+        try:
+            pk = self.model._meta.pk.to_python(pk)
+        except DjangoValidationError:
+            return None
+        if pk is None:
+            return None
+        self.validate()
+        with self.lock:
+            entry = self.entries.get(pk)
+            if entry is not None:
+                self.entries.move_to_end(pk)
+                return entry
+            if self.complete:
+                return None
+        instance = self.model._default_manager.filter(pk=pk).first()
+        if instance is None:
+            return None
+        self.store([instance])
+        return self.entries.get(pk, (instance, {}))
+
+    def get(self, pk):
+        """Copie de l'instance de clé ``pk``, ou None si elle n'existe pas"""
+        entry = self.entry(pk)
+        return copy.copy(entry[0]) if entry is not None else None
+
+    def representation(self, pk, serializer_class):
+        """Représentation de l'objet par ``serializer_class``, calculée une fois par version"""
+        entry = self.entry(pk)
+        if entry is None:
+            return None
+        instance, representations = entry
+        if serializer_class not in representations:
+            representations[serializer_class] = dict(serializer_class(instance).data)
+        return representations[serializer_class]
+
+
+_caches = {model: ReferenceCache(model) for model in REFERENCE_MODELS}
+
+
+def reference(model):
+    return _caches[model]
+
+
+def warm():
+    """Charge toutes les tables de référence (démarrage de gunicorn, benchmarks)"""
+    for cache in _caches.values():
+        cache.oversized = False
+        cache.version = None
+        cache.validate()
+
+
+def invalidate(model, instances, created=False):
+    """Répercute dans le cache de ce processus les écritures sur un modèle (les créations au commit)"""
+    if model not in _caches:
+        return
+    if created:
+        # Une création ne rend aucune entrée obsolète : l'objet est ajouté au commit, pas avant, pour
+        # qu'une transaction annulée ne laisse pas dans le cache une clé absente de la base
+        # d'ici là, une clé absente du cache est cherchée en base (visible dans la transaction)
+        copies = [copy.copy(instance) for instance in instances]
+        with _caches[model].lock:
+            _caches[model].complete = False
+        transaction.on_commit(lambda: _caches[model].store(copies), using=router.db_for_write(model))
+    else:
+        _caches[model].discard([instance.pk for instance in instances])
+
+
+class ReferenceField(serializers.Field):
+    """Objet de référence imbriqué, lu dans le cache à partir de la clé étrangère (``source='medecin_id'``)"""
+
+    def __init__(self, serializer_class, **kwargs):
+        kwargs['read_only'] = True
+        self.serializer_class = serializer_class
+        # Sous-ensemble de champs demandé par ``?fields=medecin.nom`` (api.serializers.SparseFieldsMixin)
+        self.only = None
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        data = reference(self.serializer_class.Meta.model).representation(value, self.serializer_class)
+        if self.only is None or data is None:
+            return data
+        return {name: value for name, value in data.items() if name in self.only}
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField dont la recherche passe par le cache de référence"""
+
+    @property
+    def cache(self):
+        return reference(self.queryset.model)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            self.queryset.model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        instance = self.cache.get(data)
+        if instance is None:
+            self.fail('does_not_exist', pk_value=data)
+        return instance
@@ -0,0 +1,110 @@
+"""Agendas iCalendar des médecins et des patients (``/api/medecins/{id}/agenda.ics``).
+
+Le flux est construit par une seule requête sur l'index (medecin, date_heure) ou
+(patient, date_heure), limitée à une fenêtre de dates, et envoyé au fil de l'eau. Les rendez-vous
+annulés restent dans le flux (STATUS:CANCELLED) pour que les agendas abonnés les retirent. L'ETag
+suit les versions des tables lues (api/versioning.py) : un client qui interroge le flux toutes les
+quelques minutes reçoit 304 tant qu'aucun rendez-vous n'a changé.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import RendezVous
+from .renderers import ics_escape
+
+# Fenêtre par défaut autour de maintenant et durée maximale, en jours
+PASSE = 90
+AVENIR = 365
+FENETRE_MAX = 2 * 366
+
+PRODID = '-//SYST-HOPITAL//Agenda//FR'
+
+# Suffixe des UID : un rendez-vous garde le même UID quel que soit l'hôte qui sert le flux
+UID_DOMAINE = 'syst-hopital'
+
+# Intervalle de rafraîchissement suggéré aux clients
+RAFRAICHISSEMENT = 'PT15M'
+
+STATUTS = {
+    'confirme': 'CONFIRMED',
+    'complete': 'CONFIRMED',
+    'reporte': 'TENTATIVE',
+    'annule': 'CANCELLED',
+}
+
+COLUMNS = ['id', 'date_heure', 'date_fin', 'motif', 'statut', 'notes', 'date_creation', 'date_modification',
+           'patient__nom', 'patient__prenom', 'medecin__nom', 'medecin__prenom', 'medecin__adresse_cabinet']
+
+
+def parse_moment(value):
+    """Date ou date-heure ISO 8601 d'un paramètre ; une date vaut minuit, une heure sans fuseau l'heure locale"""
+    if value is None:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def window(params):
+    """(début, fin) des paramètres ``debut``/``fin`` ; ValueError si la fenêtre est invalide"""
+    now = timezone.now()
+    debut = parse_moment(params.get('debut')) or now - timedelta(days=PASSE)
+    fin = parse_moment(params.get('fin')) or max(now, debut) + timedelta(days=AVENIR)
+    if fin <= debut or fin - debut > timedelta(days=FENETRE_MAX):
+        raise ValueError(f'La période doit durer au plus {FENETRE_MAX} jours')
+    return debut, fin
+
+
+def rows(field, pk, debut, fin):
+    """Rendez-vous de l'objet qui commencent dans la fenêtre, en une requête indexée"""
+    return (RendezVous.objects
+            .filter(**{f'{field}_id': pk}, date_heure__gte=debut, date_heure__lt=fin)
+            .order_by('date_heure', 'id')
+            .values(*COLUMNS))
+
+
+def utc(moment):
+    return moment.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def properties(name):
+    return [
+        ('PRODID', PRODID),
+        ('CALSCALE', 'GREGORIAN'),
+        ('METHOD', 'PUBLISH'),
+        ('X-WR-CALNAME', ics_escape(name)),
+        ('REFRESH-INTERVAL;VALUE=DURATION', RAFRAICHISSEMENT),
+        ('X-PUBLISHED-TTL', RAFRAICHISSEMENT),
+    ]
+
+
+def event(row, field):
+    """Propriétés VEVENT d'un rendez-vous ; le résumé nomme l'autre partie (patient ou médecin)"""
+    if field == 'medecin':
+        avec = f"{row['patient__prenom']} {row['patient__nom']}"
+    else:
+        avec = f"Dr {row['medecin__prenom']} {row['medecin__nom']}"
+    description = f"Patient : {row['patient__prenom']} {row['patient__nom']}\n" \
+                  f"Médecin : Dr {row['medecin__prenom']} {row['medecin__nom']}"
+    if row['notes']:
+        description += f"\n{row['notes']}"
+    return [
+        ('UID', f"rdv-{row['id']}@{UID_DOMAINE}"),
+        ('DTSTAMP', utc(row['date_modification'])),
+        ('LAST-MODIFIED', utc(row['date_modification'])),
+        ('CREATED', utc(row['date_creation'])),
+        ('DTSTART', utc(row['date_heure'])),
+        ('DTEND', utc(row['date_fin'])),
+        ('SUMMARY', ics_escape(f"{row['motif']} - {avec}")),
+        ('DESCRIPTION', ics_escape(description)),
+        ('LOCATION', ics_escape(row['medecin__adresse_cabinet'])),
+        ('STATUS', STATUTS.get(row['statut'], 'CONFIRMED')),
+    ]
@@ -0,0 +1,157 @@
+"""Chemin de lecture compilé des listes : lignes ``.values()`` converties par une fonction générée.
+
+La sérialisation DRF d'un objet parcourt ses champs un à un (get_attribute, contrôle de None,
+to_representation, SerializerMethodField...). Pour un serializer sans relation multiple, compile()
+détermine une fois les colonnes à lire et génère une fonction qui construit la représentation
+d'une ligne en une seule expression. Les champs calculés déclarés dans ``Meta.sql_annotations``
+(âge, solde) sont calculés par la base. La sortie est identique octet par octet à celle du
+serializer ; un serializer non compilable est servi par le chemin habituel (compile() renvoie None).
+"""
+import threading
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import DecimalField
+from rest_framework import serializers
+
+from . import metrics
+from .cache import ReferenceField
+
+# Champs dont to_representation() renvoie la valeur lue en base telle quelle
+IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.ReadOnlyField)
+
+_compiled = {}
+_lock = threading.Lock()
+MAX_COMPILED = 256
+
+
+class NotCompilable(Exception):
+    pass
+
+
+class CompiledSerializer:
+    """Colonnes à lire, annotations SQL et fonction de conversion d'une ligne"""
+
+    def __init__(self, columns, annotations, convert, source):
+        self.columns = columns
+        self.annotations = annotations
+        self.convert = convert
+        self.source = source
+
+    def values(self, queryset, extra=()):
+        """Queryset de dictionnaires portant les colonnes du serializer (et ``extra``, pour le tri)"""
+        columns = list(dict.fromkeys([*self.columns, *extra]))
+        annotations = {alias: factory(prefix) for alias, (factory, prefix) in self.annotations.items()}
+        return queryset.prefetch_related(None).values(*columns, **annotations)
+
+    def render(self, rows):
+        with metrics.serialization():
+            return [self.convert(row) for row in rows]
+
+
+def compiled_for(serializer):
+    """CompiledSerializer du serializer (construit une fois par forme), ou None s'il n'est pas compilable"""
+    # Clé tirée des champs retenus par le serializer, pas des paramètres ?fields=/?expand= bruts :
+    # ordre, doublons et noms inconnus ne créent pas de nouvelle entrée
+    key = (type(serializer), shape(serializer))
+    try:
+        return _compiled[key]
+    except KeyError:
+        pass
+    try:
+        compiled = compile(serializer)
+    except NotCompilable:
+        compiled = None
+    with _lock:
+        if len(_compiled) >= MAX_COMPILED:
+            _compiled.clear()
+        _compiled[key] = compiled
+    return compiled
+
+
+def shape(serializer):
+    """Champs lus par le serializer (nom, type, source), avec la forme des relations imbriquées"""
+    return tuple(
+        (name, type(field), field.source,
+         shape(field) if isinstance(field, serializers.Serializer) else tuple(getattr(field, 'only', None) or ()))
+        for name, field in serializer.fields.items() if not field.write_only
+    )
+
+
+def compile(serializer):
+    columns, annotations, namespace = [], {}, {}
+    expression = _expression(serializer, '', columns, annotations, namespace)
+    source = f'def convert(row):\n    return {expression}\n'
+    exec(source, namespace)
+    return CompiledSerializer(list(dict.fromkeys(columns)), annotations, namespace['convert'], source)
+
+
+def _expression(serializer, prefix, columns, annotations, namespace):
+    """Expression Python construisant le dictionnaire d'une ligne pour ce serializer"""
+    model = serializer.Meta.model
+    sql = getattr(serializer.Meta, 'sql_annotations', {})
+    items = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in sql:
+            alias = f'compiled_{len(annotations)}'
+            annotations[alias] = (sql[name], prefix)
+            output = sql[name]().output_field
+            if isinstance(output, DecimalField):
+                # Même exposant que la différence de deux Decimal lus en base
+                items.append((name, _call(namespace, _quantizer(output), alias)))
+            else:
+                items.append((name, f'row[{alias!r}]'))
+            continue
+        if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField,
+                              serializers.SerializerMethodField)) or field.source == '*':
+            raise NotCompilable(name)
+        path = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            pk = f'{path}__{field.Meta.model._meta.pk.attname}'
+            columns.append(pk)
+            nested = _expression(field, path + '__', columns, annotations, namespace)
+            items.append((name, f'(None if row[{pk!r}] is None else {nested})'))
+            continue
+        if not isinstance(field, ReferenceField):
+            _check_column(model, field.source)
+        columns.append(path)
+        if _is_identity(field):
+            items.append((name, f'row[{path!r}]'))
+        else:
+            items.append((name, _call(namespace, field.to_representation, path)))
+    return '{' + ', '.join(f'{name!r}: {value}' for name, value in items) + '}'
+
+
+def _call(namespace, function, column):
+    """Appel de ``function`` sur la colonne, None restant None comme dans Serializer.to_representation"""
+    alias = f'f{len(namespace)}'
+    namespace[alias] = function
+    return f'(None if (v := row[{column!r}]) is None else {alias}(v))'
+
+
+def _quantizer(output_field):
+    exponent = Decimal(1).scaleb(-output_field.decimal_places)
+    return lambda value: value.quantize(exponent)
+
+
+def _check_column(model, source):
+    """Les champs lus doivent être des colonnes (pas des propriétés ni des chemins)"""
+    try:
+        field = model._meta.get_field(source)
+    except FieldDoesNotExist:
+        raise NotCompilable(source)
+    if not field.concrete:
+        raise NotCompilable(source)
+
+
+def _is_identity(field):
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        return field.pk_field is None
+    if isinstance(field, serializers.ChoiceField):
+        return (type(field).to_representation is serializers.ChoiceField.to_representation
+                and all(isinstance(key, str) for key in field.choice_strings_to_values.values()))
+    return isinstance(field, IDENTITY_FIELDS) and type(field).to_representation in (
+        serializers.CharField.to_representation, serializers.IntegerField.to_representation,
+        serializers.ReadOnlyField.to_representation)
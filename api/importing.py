@@ -0,0 +1,101 @@
+"""Import en flux de fichiers CSV ou NDJSON (patients, médicaments).
+
+Le fichier est lu ligne à ligne et traité par blocs : validation par lots et contrôle d'unicité en
+base par bloc (api/bulk.py), insertion en bulk_create. La mémoire utilisée dépend de la taille des
+blocs, pas de celle du fichier. Chaque bloc est enregistré dans sa propre transaction.
+"""
+import codecs
+import csv
+import json
+import os
+from collections import namedtuple
+from itertools import islice
+
+from django.db import IntegrityError
+from rest_framework.settings import api_settings
+
+from . import bulk
+from .serializers import MedicamentSerializer, PatientSerializer
+
+IMPORTS = {
+    'patients': PatientSerializer,
+    'medicaments': MedicamentSerializer,
+}
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+CHUNK_SIZE = 1000
+
+# Ligne du fichier : numéro, valeurs lues, erreurs (lecture ou validation) si elle est rejetée
+Row = namedtuple('Row', 'ligne donnees erreurs')
+
+# Bilan d'un bloc : lignes lues, objets créés, lignes rejetées
+ImportChunk = namedtuple('ImportChunk', 'lignes creees rejets')
+
+
+def detect_format(filename, default='csv'):
+    return FORMATS.get(os.path.splitext(filename or '')[1].lower(), default)
+
+
+def read_rows(lines, fmt):
+    """Produit les Row d'un fichier parcouru ligne à ligne (itérable d'octets)"""
+    text = codecs.iterdecode(lines, 'utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for values in reader:
+            # Une cellule vide vaut un champ absent (valeur par défaut du modèle)
+            yield Row(reader.line_num, {k: v for k, v in values.items() if k is not None and v != ''}, None)
+        return
+    for ligne, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            values = json.loads(line)
+        except ValueError as exc:
+            yield Row(ligne, line.strip(), {api_settings.NON_FIELD_ERRORS_KEY: [f'JSON invalide : {exc}']})
+            continue
+        if not isinstance(values, dict):
+            yield Row(ligne, values, {api_settings.NON_FIELD_ERRORS_KEY: ['Un objet JSON est attendu']})
+        else:
+            yield Row(ligne, values, None)
+
+
+def run_import(serializer_class, rows, chunk_size=CHUNK_SIZE, context=None):
+    """Valide et insère les lignes par blocs ; produit un ImportChunk après chaque bloc"""
+    model = serializer_class.Meta.model
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        rejets = [row for row in chunk if row.erreurs]
+        entries = [(i, row.donnees, None) for i, row in enumerate(chunk) if not row.erreurs]
+        validated, errors = bulk.validate(serializer_class, entries, context or {})
+        rejets += [chunk[i]._replace(erreurs=errors[i]) for i in errors]
+        positions = sorted(validated)
+        try:
+            creees = len(bulk.create(model, [validated[i] for i in positions]))
+        except IntegrityError as exc:
+            # Conflit avec une écriture concurrente : le bloc entier est rejeté, sans le texte de la base
+            creees = 0
+            erreurs = {api_settings.NON_FIELD_ERRORS_KEY: [bulk.INTEGRITY_MESSAGE], **bulk.integrity_errors(model, exc)}
+            rejets += [chunk[i]._replace(erreurs=erreurs) for i in positions]
+        rejets.sort(key=lambda row: row.ligne)
+        yield ImportChunk(len(chunk), creees, rejets)
+
+
+class RejectsWriter:
+    """Fichier des lignes rejetées, au format du fichier importé, avec les erreurs de chaque ligne"""
+
+    def __init__(self, fh, fmt):
+        self.fh = fh
+        self.fmt = fmt
+        self.writer = None
+
+    def write(self, row):
+        erreurs = json.dumps(row.erreurs, ensure_ascii=False)
+        if self.fmt == 'ndjson':
+            self.fh.write(json.dumps({'ligne': row.ligne, 'donnees': row.donnees, 'erreurs': row.erreurs},
+                                     ensure_ascii=False) + '\n')
+            return
+        if self.writer is None:
+            self.writer = csv.writer(self.fh)
+            self.writer.writerow(['ligne', 'erreurs', 'donnees'])
+        self.writer.writerow([row.ligne, erreurs, json.dumps(row.donnees, ensure_ascii=False)])
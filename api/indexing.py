@@ -0,0 +1,78 @@
+"""Déduit les index composites utiles des déclarations filterset_fields/ordering des ViewSets."""
+from dataclasses import dataclass
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection, models
+
+
+@dataclass
+class IndexProposal:
+    model: type
+    fields: list
+    reason: str
+
+    def as_index(self):
+        index = models.Index(fields=self.fields, name='')
+        index.set_name_with_model(self.model)
+        return index
+
+
+def _local_field(model, name):
+    """Champ concret local correspondant à un nom de filtre/tri, ou None (relation traversée...)"""
+    try:
+        field = model._meta.get_field(name.lstrip('-'))
+    except FieldDoesNotExist:
+        return None
+    if not getattr(field, 'concrete', False) or field.many_to_many:
+        return None
+    return field
+
+
+def existing_indexes(model):
+    """Colonnes des index existants : base de données et Meta (index pas encore migrés)"""
+    found = [[model._meta.pk.column]]
+    for field in model._meta.concrete_fields:
+        if field.unique or field.db_index:
+            found.append([field.column])
+    for fields in model._meta.unique_together:
+        found.append([model._meta.get_field(name).column for name in fields])
+    for index in model._meta.indexes:
+        found.append([model._meta.get_field(name.lstrip('-')).column for name in index.fields])
+    with connection.cursor() as cursor:
+        if model._meta.db_table in connection.introspection.table_names(cursor):
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            found.extend(c['columns'] for c in constraints.values() if c['index'] or c['unique'])
+    return found
+
+
+def is_covered(columns, indexes):
+    """Un index couvre la proposition si ses premières colonnes sont exactement celles proposées"""
+    return any(list(index[:len(columns)]) == columns for index in indexes)
+
+
+def propose_indexes(router):
+    """Propose un index (filtre, tri par défaut) par champ filtrable et un index par champ triable"""
+    proposals = []
+    for _, viewset, basename in router.registry:
+        model = viewset.queryset.model
+        ordering = [f for f in (getattr(viewset, 'ordering', None) or model._meta.ordering)
+                    if _local_field(model, f)]
+        candidates = []
+        for name in getattr(viewset, 'filterset_fields', None) or []:
+            if _local_field(model, name):
+                candidates.append(([name] + [f.lstrip('-') for f in ordering if f.lstrip('-') != name],
+                                   f'{basename}: filtre ?{name}= trié par {",".join(ordering)}'))
+        if ordering:
+            candidates.append(([f.lstrip('-') for f in ordering], f'{basename}: tri par défaut'))
+        for name in getattr(viewset, 'ordering_fields', None) or []:
+            if _local_field(model, name):
+                candidates.append(([name], f'{basename}: ?ordering={name}'))
+
+        indexes = existing_indexes(model)
+        for fields, reason in candidates:
+            columns = [_local_field(model, name).column for name in fields]
+            if is_covered(columns, indexes) or any(p.model is model and p.fields == fields for p in proposals):
+                continue
+            proposals.append(IndexProposal(model, fields, reason))
+            indexes.append(columns)
+    return proposals
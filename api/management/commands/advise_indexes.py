@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.migrations import Migration
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from api.indexing import propose_indexes
+from api.operations import AddIndexConcurrentlyIfSupported
+from api.urls import router
+
+
+class Command(BaseCommand):
+    help = ('Propose composite indexes derived from the viewsets filterset_fields / ordering_fields / '
+            'ordering, and optionally write the migration (built CONCURRENTLY on PostgreSQL)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--write', action='store_true', help='Write a migration with the proposed indexes')
+        parser.add_argument('--name', default='advised_indexes', help='Migration name suffix')
+
+    def handle(self, *args, **options):
+        proposals = propose_indexes(router)
+        if not proposals:
+            self.stdout.write(self.style.SUCCESS('[OK] Every filter and ordering is covered by an index'))
+            return
+
+        by_app = defaultdict(list)
+        for proposal in proposals:
+            index = proposal.as_index()
+            by_app[proposal.model._meta.app_label].append((proposal, index))
+            self.stdout.write(f'{proposal.model.__name__:14} {", ".join(proposal.fields):40} {proposal.reason}')
+
+        self.stdout.write('\nAdd to the models Meta.indexes:')
+        for proposals_for_app in by_app.values():
+            for proposal, index in proposals_for_app:
+                self.stdout.write(f'  {proposal.model.__name__}: models.Index(fields={proposal.fields!r}, '
+                                  f'name={index.name!r}),')
+
+        if options['write']:
+            for app_label, items in by_app.items():
+                path = self.write_migration(app_label, items, options['name'])
+                self.stdout.write(self.style.SUCCESS(f'Migration written to {path}'))
+
+    def write_migration(self, app_label, items, name):
+        loader = MigrationLoader(connections['default'], ignore_no_migrations=True)
+        leaf = loader.graph.leaf_nodes(app_label)
+        number = int(leaf[0][1][:4]) + 1 if leaf else 1
+        migration = Migration(f'{number:04d}_{name}', app_label)
+        migration.dependencies = leaf
+        migration.operations = [
+            AddIndexConcurrentlyIfSupported(model_name=proposal.model._meta.model_name, index=index)
+            for proposal, index in items
+        ]
+        writer = MigrationWriter(migration)
+        # CREATE INDEX CONCURRENTLY ne peut pas s'exécuter dans une transaction
+        content = writer.as_string().replace(
+            'class Migration(migrations.Migration):\n',
+            'class Migration(migrations.Migration):\n\n    atomic = False\n', 1,
+        )
+        with open(writer.path, 'w', encoding='utf-8') as fh:
+            fh.write(content)
+        return writer.path
@@ -0,0 +1,89 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from api import benchmarks, throttling
+from api.seeding import seed_dataset
+from api.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every API endpoint (SQL query budget, p50/p95 latency, peak memory) against a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=10000, help='Number of patients to seed')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed calls per endpoint')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'),
+                            help='JSON baseline file')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed relative regression for latency and memory (0.25 = +25%%)')
+        parser.add_argument('--update-baseline', action='store_true', help='Overwrite the baseline with these results')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the seeded benchmark database')
+
+    def handle(self, *args, **options):
+        # Same throwaway database as the test runner: never benchmark against real data
+        creation = connection.creation
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with self.isolated_settings():
+                results = self.run(options)
+        except benchmarks.EndpointError as exc:
+            raise CommandError(f'Benchmark aborted: {exc}')
+        finally:
+            creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        path = Path(options['baseline'])
+        baseline = benchmarks.load_baseline(path)
+        regressions = benchmarks.compare(results, baseline or {}, options['threshold'])
+        if baseline is None or options['update_baseline']:
+            benchmarks.save_baseline(path, results)
+            self.stdout.write(f'Baseline written to {path}')
+        if regressions:
+            raise CommandError('Performance regressions:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('[OK] No regression'))
+
+    @staticmethod
+    @contextmanager
+    def isolated_settings():
+        # As in api/tests.py, throttle counters of this run only, in a throwaway store; every endpoint
+        # times --iterations calls, far beyond the user rate, so rates are raised out of reach (the
+        # throttles still run and stay in the measures). The periodic auth_user version check would
+        # add a query to whichever call happens to hit it.
+        rates = throttling.ScopedThrottle.THROTTLE_RATES
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(THROTTLE_STORE={'BACKEND': 'api.throttling.SQLiteStore',
+                                                  'LOCATION': os.path.join(directory, 'throttle.sqlite3')},
+                                  AUTH_USER_CHECK_SECONDS=3600), \
+                mock.patch.dict(rates, {scope: '1000000/second' for scope in rates}):
+            yield
+
+    def run(self, options):
+        if not User.objects.filter(username='benchmark').exists():
+            self.stdout.write(f'Seeding {options["patients"]} patients...')
+            counts = seed_dataset(patients=options['patients'])
+            self.stdout.write('  ' + ', '.join(f'{k}: {v}' for k, v in counts.items()))
+            User.objects.create_user(username='benchmark', password='benchmark')
+
+        client = APIClient()
+        benchmarks.authenticate(client, 'benchmark', 'benchmark')
+
+        results = {}
+        self.stdout.write(f'{"endpoint":40} {"method":6} {"queries":>7} {"p50 ms":>9} {"p95 ms":>9} {"peak KiB":>9}')
+        for endpoint in benchmarks.iter_endpoints(router):
+            result = benchmarks.measure(client, endpoint, options['iterations'])
+            results[endpoint.name] = result
+            self.stdout.write(f'{endpoint.name:40} {endpoint.method.upper():6} {result["queries"]:>7} '
+                              f'{result["p50_ms"]:>9} {result["p95_ms"]:>9} {result["peak_kib"]:>9}')
+        return results
@@ -0,0 +1,71 @@
+import threading
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+from api.urls import router
+
+
+class Command(BaseCommand):
+    help = ('Concurrent-client throughput of running deployments (e.g. gunicorn sync workers against '
+            'gunicorn with uvicorn workers) on the list, detail and patient sub-resource reads')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, metavar='NAME=URL',
+                            help='Deployment to measure, e.g. wsgi=http://127.0.0.1:8000 (repeatable)')
+        parser.add_argument('--username', required=True, help='API user used to obtain a JWT')
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--clients', type=int, default=32, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=15.0, help='Seconds of load per target')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f'Invalid target {target!r}: expected NAME=URL')
+            targets.append((name, url.rstrip('/')))
+
+        results = {}
+        paths = None
+        for name, url in targets:
+            token = self.token(url, options['username'], options['password'])
+            if paths is None:
+                # Same paths for every target, discovered on the first one
+                session = self.session(token)
+                paths = benchmarks.read_paths(router, lambda path: session.get(url + path, timeout=30).json())
+                self.stdout.write(f'{len(paths)} read paths, {options["clients"]} clients, '
+                                  f'{options["duration"]:g} s per target')
+            results[name] = benchmarks.throughput(self.getter(url, token), paths, options['clients'],
+                                                  options['duration'])
+
+        reference = next(iter(results.values()))['rps']
+        self.stdout.write(f'{"target":12} {"requests":>9} {"errors":>7} {"req/s":>9} {"p50 ms":>9} {"p95 ms":>9} '
+                          f'{"speedup":>8}')
+        for name, result in results.items():
+            speedup = f'x{result["rps"] / reference:.2f}' if reference else '-'
+            self.stdout.write(f'{name:12} {result["requests"]:>9} {result["errors"]:>7} {result["rps"]:>9} '
+                              f'{result["p50_ms"]:>9} {result["p95_ms"]:>9} {speedup:>8}')
+
+    def token(self, url, username, password):
+        resp = requests.post(f'{url}/api/token/', json={'username': username, 'password': password}, timeout=30)
+        if resp.status_code != 200:
+            raise CommandError(f'{url}: authentication failed (HTTP {resp.status_code})')
+        return resp.json()['access']
+
+    @staticmethod
+    def session(token):
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {token}'
+        return session
+
+    def getter(self, url, token):
+        # One keep-alive session per client thread
+        local = threading.local()
+
+        def get(path):
+            if not hasattr(local, 'session'):
+                local.session = self.session(token)
+            return local.session.get(url + path, timeout=60).status_code
+        return get
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api import benchmarks, compiled
+from api.seeding import seed_dataset
+from api.urls import router
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark of list serialization: DRF serializers against the compiled read path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=2000, help='Number of patients to seed')
+        parser.add_argument('--rows', type=int, default=1000, help='Rows serialized per measure')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed conversions per serializer')
+
+    def handle(self, *args, **options):
+        # Same throwaway database as benchmark_api: never benchmark against real data
+        creation = connection.creation
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, options):
+        self.stdout.write(f'Seeding {options["patients"]} patients...')
+        seed_dataset(patients=options['patients'])
+        self.stdout.write(f'{"serializer":32} {"rows":>6} {"DRF ms":>9} {"compiled ms":>12} {"speedup":>8}')
+        for _, viewset, _ in router.registry:
+            serializer = viewset.serializer_class()
+            try:
+                compiled.compile(serializer)
+            except compiled.NotCompilable:
+                self.stdout.write(f'{type(serializer).__name__:32} not compilable (nested list)')
+                continue
+            queryset = viewset.queryset.order_by('pk')[:options['rows']]
+            result = benchmarks.compare_serialization(serializer, queryset, options['iterations'])
+            self.stdout.write(f'{type(serializer).__name__:32} {result["rows"]:>6} {result["drf_ms"]:>9} '
+                              f'{result["compiled_ms"]:>12} {str(result["speedup"]) + "x":>8}')
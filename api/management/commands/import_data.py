@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importing import CHUNK_SIZE, FORMATS, IMPORTS, RejectsWriter, detect_format, read_rows, run_import
+
+
+class Command(BaseCommand):
+    help = 'Stream-import patients or medications from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(IMPORTS), help='What the file contains')
+        parser.add_argument('path', help='CSV or NDJSON file to import')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help='File format (default: guessed from the extension, csv otherwise)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows validated and inserted together')
+        parser.add_argument('--rejects', help='Write rejected rows and their errors to this file '
+                                              '(default: <path>.rejects.<format>)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        rejects_path = options['rejects'] or f"{options['path']}.rejects.{fmt}"
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        totals = {'rows': 0, 'created': 0, 'rejected': 0}
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as source, \
+                    open(rejects_path, 'w', encoding='utf-8', newline='') as rejects_file:
+                rejects = RejectsWriter(rejects_file, fmt)
+                for chunk in run_import(IMPORTS[options['resource']], read_rows(source, fmt), options['chunk_size']):
+                    totals['rows'] += chunk.lignes
+                    totals['created'] += chunk.creees
+                    totals['rejected'] += len(chunk.rejets)
+                    for row in chunk.rejets:
+                        rejects.write(row)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"  {totals['rows']} rows, {totals['created']} created, "
+                                      f"{totals['rejected']} rejected, {totals['rows'] / elapsed:,.0f} rows/s")
+        except OSError as exc:
+            raise CommandError(str(exc))
+        except UnicodeDecodeError as exc:
+            raise CommandError(f"Invalid encoding after {totals['rows']} rows (UTF-8 expected): {exc}")
+
+        if not totals['rejected']:
+            os.remove(rejects_path)
+        message = f"[OK] {totals['created']} {options['resource']} imported from {totals['rows']} rows"
+        if totals['rejected']:
+            self.stdout.write(self.style.WARNING(f"{message}, {totals['rejected']} rejected (see {rejects_path})"))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.blacklist import purge
+
+
+class Command(BaseCommand):
+    help = 'Delete expired entries from the refresh-token blacklist, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Blacklist rows deleted per statement')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def progress(deleted):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {deleted} deleted')
+
+        deleted = purge(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'[OK] {deleted} expired blacklist entries deleted'))
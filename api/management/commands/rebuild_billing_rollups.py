@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the billing rollups (global, per patient, per month, per status) from the invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Patient ids recomputed per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  patients {done}/{total}')
+
+        written = rebuild(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'[OK] {written} billing rollup rows rebuilt'))
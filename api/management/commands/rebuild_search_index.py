@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.search import install, is_installed
+
+
+class Command(BaseCommand):
+    help = 'Create or repair the full-text search indexes (FTS5 on SQLite, tsvector/trigram on PostgreSQL)'
+
+    def handle(self, *args, **options):
+        with connection.schema_editor() as schema_editor:
+            install(schema_editor)
+        if is_installed(connection):
+            self.stdout.write(self.style.SUCCESS('[OK] Search indexes installed and rebuilt'))
+        else:
+            self.stdout.write(self.style.WARNING('This database does not support the search indexes; '
+                                                 '?search= falls back to ILIKE'))
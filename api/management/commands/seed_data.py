@@ -1,4 +1,4 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from decimal import Decimal
 from datetime import timedelta
@@ -6,13 +6,28 @@ from api.models import (
     Patient, Medecin, RendezVous, Consultation, 
     Medicament, Ordonnance, OrdonnanceMedicament, Facturation
 )
+from api.seeding import seed_dataset
 import random
+import time
 
 
 class Command(BaseCommand):
-    help = 'Seed the database with test data'
+    help = 'Seed the database with test data (use --patients for the bulk scale mode)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, help='Scale mode: number of patients to generate')
+        parser.add_argument('--doctors', type=int, help='Scale mode: number of doctors (default: patients / 50)')
+        parser.add_argument('--medications', type=int, default=200, help='Scale mode: number of medications')
+        parser.add_argument('--years', type=float, default=1, help='Scale mode: history span of the appointments')
+        parser.add_argument('--appointments-per-patient', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (same seed, same data)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Patients per bulk insert transaction')
+        parser.add_argument('--workers', type=int, default=1, help='Processes used to generate the rows')
 
     def handle(self, *args, **options):
+        if options['patients']:
+            return self.handle_scale(options)
+
         self.stdout.write('Starting database seed...')
         
         # Create patients
@@ -51,6 +66,33 @@ class Command(BaseCommand):
         self.stdout.write(f'  • {len(consultations)} consultations created')
         self.stdout.write(f'  • {len(prescriptions)} prescriptions created')
 
+    def handle_scale(self, options):
+        """Bulk-insert a large deterministic dataset and report the insertion rate"""
+        self.stdout.write(f"Seeding {options['patients']} patients with {options['workers']} worker(s)...")
+
+        def progress(counts, elapsed):
+            rows = sum(counts.values())
+            self.stdout.write(f"  {counts['patients']}/{options['patients']} patients, "
+                              f'{rows} rows, {rows / elapsed:,.0f} rows/s')
+
+        started = time.perf_counter()
+        try:
+            counts = seed_dataset(
+                patients=options['patients'], doctors=options['doctors'], medicaments=options['medications'],
+                rdv_per_patient=options['appointments_per_patient'], years=options['years'],
+                seed=options['seed'], batch_size=options['batch_size'], workers=options['workers'],
+                progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+        rows = sum(counts.values())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'[OK] {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)'))
+        for key, value in counts.items():
+            self.stdout.write(f'  • {value} {key}')
+
     def create_patients(self):
         """Create sample patients"""
         patient_data = [
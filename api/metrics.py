@@ -0,0 +1,295 @@
+"""Mesures par endpoint, agrégées entre les workers et exposées au format texte de Prometheus.
+
+Pour chaque requête, MetricsMiddleware relève, sous le nom de la route (``patient-list``,
+``facturation-statistiques``...), la méthode et le statut :
+
+- la durée, en histogramme (``BUCKETS``) ;
+- le nombre et la durée des requêtes SQL, sur toutes les connexions (``instrument``) ;
+- le temps de sérialisation : représentation des objets (serializers, chemin compilé) et rendu du
+  corps par le renderer, requêtes SQL déclenchées pendant ce temps exclues ;
+- la taille du corps (les réponses en flux ne sont pas comptées, leur corps est produit plus tard).
+
+Chaque processus cumule ses mesures en mémoire et les écrit au plus toutes les
+``METRICS_FLUSH_SECONDS`` dans un fichier à lui de ``METRICS_DIR`` ; ``/metrics`` additionne les
+fichiers de tous les workers, y compris ceux des workers terminés pour que les compteurs ne
+reculent pas. Sans ``METRICS_DIR``, seules les mesures du processus qui répond sont exposées.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, JsonResponse
+
+# Bornes (s) de l'histogramme des durées
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Mesures de la requête en cours (None hors requête)
+_current = ContextVar('request_metrics', default=None)
+
+
+def _empty_serie():
+    return {'count': 0, 'duration': 0.0, 'buckets': [0] * len(BUCKETS), 'queries': 0, 'sql': 0.0,
+            'serialization': 0.0, 'bytes': 0}
+
+
+class RequestStats:
+    __slots__ = ('request', 'queries', 'sql_seconds', 'serialization_seconds', 'depth')
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.depth = 0
+
+
+class Registry:
+    """Séries du processus : (endpoint, méthode, statut) -> compteurs"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        # Fichier du processus : le pid seul pourrait être repris par un worker redémarré
+        self.name = f'{os.getpid()}-{time.time_ns()}.json'
+        self.flushed = time.monotonic()
+
+    def record(self, labels, duration, stats, size):
+        with self.lock:
+            serie = self.series.get(labels)
+            if serie is None:
+                serie = self.series[labels] = _empty_serie()
+            serie['count'] += 1
+            serie['duration'] += duration
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    serie['buckets'][i] += 1
+                    break
+            serie['queries'] += stats.queries
+            serie['sql'] += stats.sql_seconds
+            serie['serialization'] += stats.serialization_seconds
+            serie['bytes'] += size
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), dict(serie, buckets=list(serie['buckets']))]
+                    for labels, serie in self.series.items()]
+
+    def flush(self, force=False):
+        """Écrit les séries du processus dans METRICS_DIR (au plus toutes les METRICS_FLUSH_SECONDS)"""
+        directory = settings.METRICS_DIR
+        if not directory or (not force and time.monotonic() - self.flushed < settings.METRICS_FLUSH_SECONDS):
+            return
+        self.flushed = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(f'{path}.tmp', path)
+
+
+registry = Registry()
+
+
+def _reinit_after_fork():
+    # Un worker forké repart de zéro : les mesures du maître sont dans son propre fichier
+    global registry
+    registry = Registry()
+
+
+os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def collect():
+    """Séries de tous les processus : {(endpoint, méthode, statut): compteurs additionnés}"""
+    registry.flush(force=True)
+    snapshots = [registry.snapshot()]
+    directory = settings.METRICS_DIR
+    if directory and os.path.isdir(directory):
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name), encoding='utf-8') as fh:
+                    snapshots.append(json.load(fh))
+            except (OSError, ValueError):
+                # Fichier supprimé ou remplacé pendant la lecture
+                continue
+    merged = {}
+    for snapshot in snapshots:
+        for labels, serie in snapshot:
+            total = merged.setdefault(tuple(labels), _empty_serie())
+            for key, value in serie.items():
+                if key == 'buckets':
+                    total[key] = [a + b for a, b in zip(total[key], value)]
+                else:
+                    total[key] += value
+    return merged
+
+
+def reset_directory():
+    """Supprime les fichiers d'une exécution précédente (démarrage du maître gunicorn)"""
+    directory = settings.METRICS_DIR
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(directory, name))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(series):
+    """Format texte d'exposition de Prometheus (version 0.0.4)"""
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+
+    def labels(key, **extra):
+        endpoint, method, status = key
+        pairs = {'endpoint': endpoint, 'method': method, 'status': status, **extra}
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + '}'
+
+    keys = sorted(series)
+    histogram = []
+    for key in keys:
+        serie, cumulative = series[key], 0
+        for bound, count in zip(BUCKETS, serie['buckets']):
+            cumulative += count
+            histogram.append(f'hospital_http_request_duration_seconds_bucket{labels(key, le=bound)} {cumulative}')
+        histogram.append(f'hospital_http_request_duration_seconds_bucket{labels(key, le="+Inf")} {serie["count"]}')
+        histogram.append(f'hospital_http_request_duration_seconds_sum{labels(key)} {serie["duration"]}')
+        histogram.append(f'hospital_http_request_duration_seconds_count{labels(key)} {serie["count"]}')
+    family('hospital_http_request_duration_seconds', 'histogram', 'Durée des requêtes HTTP', histogram)
+    for name, field, help_text in (
+            ('hospital_db_queries_total', 'queries', 'Requêtes SQL exécutées'),
+            ('hospital_db_query_seconds_total', 'sql', 'Temps passé dans les requêtes SQL'),
+            ('hospital_serialization_seconds_total', 'serialization', 'Temps de sérialisation et de rendu'),
+            ('hospital_response_bytes_total', 'bytes', 'Taille des corps de réponse')):
+        family(name, 'counter', help_text, [f'{name}{labels(key)} {series[key][field]}' for key in keys])
+    return '\n'.join(lines) + '\n'
+
+
+def instrument(sender, connection, **kwargs):
+    """Ajoute le relevé des requêtes SQL à une connexion (signal connection_created)"""
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def _execute(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.sql_seconds += time.perf_counter() - started
+
+
+@contextmanager
+def serialization():
+    """Compte le bloc comme temps de sérialisation (une seule fois s'il est imbriqué, SQL exclu)"""
+    stats = _current.get()
+    if stats is None or stats.depth:
+        yield
+        return
+    stats.depth += 1
+    started, sql = time.perf_counter(), stats.sql_seconds
+    try:
+        yield
+    finally:
+        stats.depth -= 1
+        stats.serialization_seconds += time.perf_counter() - started - (stats.sql_seconds - sql)
+
+
+def endpoint_of(request):
+    match = getattr(request, 'resolver_match', None)
+    # Routes inconnues regroupées : pas une série par URL demandée
+    return (match.url_name or match.view_name or 'unnamed') if match else 'unmatched'
+
+
+def current_request():
+    """Requête HTTP en cours (None hors requête)"""
+    stats = _current.get()
+    return stats.request if stats is not None else None
+
+
+class MetricsMiddleware:
+    """Relève durée, SQL, sérialisation et taille de chaque réponse (synchrone et asynchrone)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, stats, started)
+        return response
+
+    @staticmethod
+    def start(request):
+        stats = RequestStats(request)
+        return stats, _current.set(stats), time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Appelé juste avant le rendu du corps (Response de DRF) ; la fin est notée après le rendu
+        stats = _current.get()
+        if stats is not None:
+            started, sql = time.perf_counter(), stats.sql_seconds
+
+            def rendered(response):
+                stats.serialization_seconds += time.perf_counter() - started - (stats.sql_seconds - sql)
+            response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def finish(request, response, stats, started):
+        duration = time.perf_counter() - started
+        size = 0 if response.streaming else len(response.content)
+        registry.record((endpoint_of(request), request.method, str(response.status_code)), duration, stats, size)
+        registry.flush()
+
+
+def metrics_view(request):
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def healthz_view(request):
+    """Sonde de disponibilité : processus en vie et base joignable, sans authentification"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError:
+        return JsonResponse({'status': 'error', 'database': 'unavailable'}, status=503)
+    return JsonResponse({'status': 'ok'})
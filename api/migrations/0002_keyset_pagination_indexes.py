@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['date_consultation', 'id'], name='api_consult_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='facturation',
+            index=models.Index(fields=['date_facturation', 'id'], name='api_fact_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['date_enregistrement', 'id'], name='api_patient_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rendezvous',
+            index=models.Index(fields=['date_heure', 'id'], name='api_rdv_date_id_idx'),
+        ),
+    ]
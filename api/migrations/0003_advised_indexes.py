@@ -0,0 +1,96 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:07
+
+import api.operations
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='patient',
+            index=models.Index(fields=['statut', 'date_enregistrement'], name='api_patient_statut_3ca543_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='patient',
+            index=models.Index(fields=['genre', 'date_enregistrement'], name='api_patient_genre_d44121_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='patient',
+            index=models.Index(fields=['nom'], name='api_patient_nom_eb318a_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='patient',
+            index=models.Index(fields=['prenom'], name='api_patient_prenom_a73efd_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='medecin',
+            index=models.Index(fields=['specialite', 'nom', 'prenom'], name='api_medecin_special_d70008_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='medecin',
+            index=models.Index(fields=['nom', 'prenom'], name='api_medecin_nom_893005_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='medecin',
+            index=models.Index(fields=['prenom'], name='api_medecin_prenom_9bbf19_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='consultation',
+            index=models.Index(fields=['statut', 'date_consultation'], name='api_consult_statut_0acebf_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='consultation',
+            index=models.Index(fields=['medecin', 'date_consultation'], name='api_consult_medecin_b5f73e_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='consultation',
+            index=models.Index(fields=['patient', 'date_consultation'], name='api_consult_patient_66a53b_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='medicament',
+            index=models.Index(fields=['nom'], name='api_medicam_nom_7fa4c1_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='medicament',
+            index=models.Index(fields=['prix'], name='api_medicam_prix_47999b_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='facturation',
+            index=models.Index(fields=['statut', 'date_facturation'], name='api_factura_statut_e86e4a_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='facturation',
+            index=models.Index(fields=['patient', 'date_facturation'], name='api_factura_patient_8d7f83_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='facturation',
+            index=models.Index(fields=['montant'], name='api_factura_montant_a37c14_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='rendezvous',
+            index=models.Index(fields=['statut', 'date_heure'], name='api_rendezv_statut_17bed1_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='rendezvous',
+            index=models.Index(fields=['date_creation'], name='api_rendezv_date_cr_f1178f_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='ordonnance',
+            index=models.Index(fields=['patient', 'date_ordonnance'], name='api_ordonna_patient_18f6fa_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='ordonnance',
+            index=models.Index(fields=['medecin', 'date_ordonnance'], name='api_ordonna_medecin_a78b5c_idx'),
+        ),
+        api.operations.AddIndexConcurrentlyIfSupported(
+            model_name='ordonnance',
+            index=models.Index(fields=['date_ordonnance'], name='api_ordonna_date_or_05210d_idx'),
+        ),
+    ]
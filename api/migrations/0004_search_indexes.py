@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_search_indexes(apps, schema_editor):
+    from api.search import install
+    install(schema_editor)
+
+
+def uninstall_search_indexes(apps, schema_editor):
+    from api.search import uninstall
+    uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_advised_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_indexes, uninstall_search_indexes),
+    ]
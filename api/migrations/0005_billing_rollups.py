@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:12
+
+from django.db import migrations, models
+
+
+def build_rollups(apps, schema_editor):
+    from api.rollups import rebuild
+    rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatistiqueFacturation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('portee', models.CharField(choices=[('global', 'Global'), ('patient', 'Par patient'), ('mois', 'Par mois'), ('statut', 'Par statut')], max_length=10)),
+                ('cle', models.CharField(blank=True, default='', max_length=32)),
+                ('nombre', models.IntegerField(default=0)),
+                ('total_montant', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('total_paye', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+            options={
+                'unique_together': {('portee', 'cle')},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
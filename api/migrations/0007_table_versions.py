@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_payment_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionTable',
+            fields=[
+                ('table', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+                ('date_modification', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
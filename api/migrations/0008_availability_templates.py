@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:43
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_table_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlageHoraire',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour_semaine', models.PositiveSmallIntegerField(choices=[(0, 'Lundi'), (1, 'Mardi'), (2, 'Mercredi'), (3, 'Jeudi'), (4, 'Vendredi'), (5, 'Samedi'), (6, 'Dimanche')])),
+                ('heure_debut', models.TimeField()),
+                ('heure_fin', models.TimeField()),
+                ('duree_creneau', models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5)])),
+                ('medecin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plages_horaires', to='api.medecin')),
+            ],
+            options={
+                'ordering': ['medecin', 'jour_semaine', 'heure_debut'],
+                'indexes': [models.Index(fields=['medecin', 'jour_semaine', 'heure_debut'], name='api_plage_medecin_jour_idx')],
+            },
+        ),
+    ]
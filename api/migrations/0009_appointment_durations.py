@@ -0,0 +1,86 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:20
+
+from datetime import timedelta
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Concat
+
+
+def fill_date_fin(apps, schema_editor):
+    RendezVous = apps.get_model('api', 'RendezVous')
+    # Tous les rendez-vous existants ont la durée par défaut
+    RendezVous.objects.update(date_fin=models.F('date_heure') + timedelta(minutes=30))
+
+
+def resolve_overlaps(apps, schema_editor):
+    """Supprime les chevauchements hérités de l'ancien schéma, avant l'installation de la contrainte.
+
+    L'ancien schéma n'interdisait que deux rendez-vous à la même heure : ceux d'un médecin espacés de
+    moins de 30 minutes se chevauchent désormais. Le premier est raccourci jusqu'au début du suivant ;
+    si l'écart est inférieur à la durée minimale (5 minutes), le suivant est annulé.
+    """
+    RendezVous = apps.get_model('api', 'RendezVous')
+    rows = (RendezVous.objects.using(schema_editor.connection.alias).exclude(statut='annule')
+            .order_by('medecin_id', 'date_heure', 'id').values('id', 'medecin_id', 'date_heure', 'date_fin'))
+    previous = None
+    for row in rows.iterator():
+        if previous and previous['medecin_id'] == row['medecin_id'] and row['date_heure'] < previous['date_fin']:
+            minutes = int((row['date_heure'] - previous['date_heure']).total_seconds() // 60)
+            if minutes < 5:
+                RendezVous.objects.using(schema_editor.connection.alias).filter(pk=row['id']).update(
+                    statut='annule',
+                    notes=Concat(Coalesce('notes', Value('')),
+                                 Value(f"\nAnnulé à la migration : chevauchait le rendez-vous {previous['id']}")))
+                continue
+            date_fin = previous['date_heure'] + timedelta(minutes=minutes)
+            RendezVous.objects.using(schema_editor.connection.alias).filter(pk=previous['id']).update(
+                duree=minutes, date_fin=date_fin)
+        previous = row
+
+
+def install_overlap_constraint(apps, schema_editor):
+    from api.overlaps import install
+    install(schema_editor.connection)
+
+
+def uninstall_overlap_constraint(apps, schema_editor):
+    from api.overlaps import uninstall
+    uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_availability_templates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rendezvous',
+            name='duree',
+            field=models.PositiveSmallIntegerField(default=30, validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(480)]),
+        ),
+        migrations.AddField(
+            model_name='rendezvous',
+            name='date_fin',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_date_fin, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='rendezvous',
+            name='date_fin',
+            field=models.DateTimeField(editable=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rendezvous',
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name='rendezvous',
+            index=models.Index(fields=['medecin', 'date_heure'], name='api_rdv_medecin_date_idx'),
+        ),
+        migrations.RunPython(resolve_overlaps, migrations.RunPython.noop),
+        migrations.RunPython(install_overlap_constraint, uninstall_overlap_constraint),
+    ]
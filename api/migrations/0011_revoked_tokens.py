@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:36
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_appointment_calendars'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JetonRevoque',
+            fields=[
+                ('jti', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('date_expiration', models.DateTimeField(db_index=True)),
+                ('date_revocation', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:43
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_revoked_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequeteLente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('empreinte', models.CharField(max_length=40, unique=True)),
+                ('sql', models.TextField()),
+                ('parametres', models.TextField(blank=True)),
+                ('base', models.CharField(default='default', max_length=64)),
+                ('vue', models.CharField(blank=True, max_length=255)),
+                ('pile', models.TextField(blank=True)),
+                ('plan', models.TextField(blank=True)),
+                ('nombre', models.PositiveIntegerField(default=0)),
+                ('duree_totale_ms', models.FloatField(default=0)),
+                ('duree_max_ms', models.FloatField(default=0)),
+                ('date_premiere', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_derniere', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'requête lente',
+                'verbose_name_plural': 'requêtes lentes',
+                'ordering': ['-duree_totale_ms'],
+            },
+        ),
+    ]
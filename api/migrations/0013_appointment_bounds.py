@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:13
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_slow_queries'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='rendezvous',
+            constraint=models.CheckConstraint(check=models.Q(('duree__lte', 480)), name='api_rdv_duree_max'),
+        ),
+        migrations.AddConstraint(
+            model_name='rendezvous',
+            constraint=models.CheckConstraint(check=models.Q(('date_fin', api.models.AjoutMinutes('date_heure', 'duree'))), name='api_rdv_date_fin'),
+        ),
+    ]
@@ -0,0 +1,492 @@
+import functools
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError
+from django.db.models import QuerySet
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import bulk, cache, calendars, compiled, importing, replicas, versioning
+from .models import Medecin, Patient, RendezVous
+from .renderers import CSVRenderer, ICalendarRenderer, NDJSONRenderer, columns
+
+
+class EagerLoadingViewSetMixin:
+    """Applique au queryset le chargement anticipé déclaré par le serializer de l'action."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if hasattr(self.get_serializer_class(), 'apply_eager_loading'):
+            # Serializer de la requête : ?fields= et ?expand= réduisent jointures et colonnes lues ;
+            # les colonnes de l'ordering restent chargées pour le curseur de KeysetPagination
+            required = [field.lstrip('-') for field in getattr(self, 'ordering', None) or ()]
+            queryset = self.get_serializer().apply_eager_loading(queryset, required=required)
+        return queryset
+
+
+class ConditionalGetMixin:
+    """ETag forts et Last-Modified sur la liste et le détail, 304 sans requête principale ni sérialisation.
+
+    Les validateurs dérivent des versions des tables lues par le serializer (api/versioning.py), en
+    une requête. Avec ``last_modified_field``, le détail se fonde sur l'horodatage de la ligne.
+    """
+    last_modified_field = None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = self.not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+
+    @staticmethod
+    def not_modified_response(request, etag, last_modified):
+        return get_conditional_response(
+            request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()))
+
+    @staticmethod
+    def set_validators(response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def get_validators(self, request):
+        """(ETag, date de dernière modification ou None) de la réponse demandée"""
+        models = self.get_validated_models()
+        parts = [self.basename, self.action, request.accepted_media_type, sorted(request.query_params.lists()),
+                 sorted(self.kwargs.items())]
+        dates = []
+        if self.action == 'retrieve' and self.last_modified_field:
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            row = models[0]._default_manager.filter(**{self.lookup_field: lookup}).values_list(
+                self.last_modified_field, flat=True).first()
+            parts += [lookup, row]
+            dates.append(row)
+            models = models[1:]
+        if models:
+            versions = versioning.read([versioning.table_of(model) for model in models],
+                                     also=cache.REFERENCE_TABLES)
+            parts.append(sorted(versions.items()))
+            dates.extend(date for _, date in versions.values())
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        return f'"{digest}"', max((d for d in dates if d is not None), default=None)
+
+    def get_validated_models(self):
+        """Modèles dont les versions valident la réponse (le premier porte ``last_modified_field``)"""
+        return versioning.serializer_models(self.get_serializer_class())
+
+
+class CompiledListMixin:
+    """Liste servie par le chemin de lecture compilé (api/compiled.py) quand le serializer s'y prête.
+
+    Les lignes sont lues par ``.values()`` et converties par une fonction générée une fois par
+    serializer et par jeu de ``?fields=``/``?expand=`` ; la réponse est identique à celle du serializer.
+    """
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.get_compiled_queryset(compiled)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.render(page))
+        return Response(compiled.render(queryset))
+
+    def get_compiled_serializer(self):
+        return compiled.compiled_for(self.get_serializer())
+
+    def get_compiled_queryset(self, compiled):
+        queryset = self.filter_queryset(self.get_queryset())
+        # Colonnes de tri lues aussi, pour le curseur de KeysetPagination
+        extra = [field.lstrip('-') for field in getattr(self, 'ordering', None) or ()]
+        return compiled.values(queryset, extra=[*extra, queryset.model._meta.pk.attname])
+
+
+class ExportViewSetMixin:
+    """``?format=csv`` ou ``?format=ndjson`` sur la liste : export complet en flux.
+
+    Les filtres, la recherche et le tri de la liste s'appliquent ; la pagination et son ``COUNT(*)``
+    non. Les lignes sont lues par blocs de ``export_chunk_size`` (curseur côté serveur sur
+    PostgreSQL) et envoyées au fil de l'eau : la mémoire ne dépend pas du nombre de lignes.
+    """
+    export_chunk_size = 2000
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CSVRenderer, NDJSONRenderer]
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not hasattr(renderer, 'stream'):
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer()
+        compiled = self.get_compiled_serializer() if hasattr(self, 'get_compiled_serializer') else None
+        if compiled is not None:
+            queryset = self.get_compiled_queryset(compiled)
+            rows = map(compiled.convert, queryset.iterator(chunk_size=self.export_chunk_size))
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+            rows = (serializer.to_representation(obj)
+                    for obj in queryset.iterator(chunk_size=self.export_chunk_size))
+        response = StreamingHttpResponse(renderer.stream(rows, columns(serializer)),
+                                         content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="{self.basename}.{renderer.format}"'
+        return response
+
+
+class BulkWriteViewSetMixin:
+    """Création, modification et suppression d'une liste d'objets sur la route de liste.
+
+    ``POST`` avec une liste crée les objets, ``PATCH`` modifie des objets portant leur ``id`` et
+    ``DELETE`` supprime une liste d'identifiants (routes ajoutées par api.routers.HospitalRouter).
+    Les objets invalides sont signalés par leur position sans bloquer les autres (HTTP 207), sauf
+    avec ``?atomic=true`` : la moindre erreur annule alors tout le lot (HTTP 400).
+    """
+    bulk_max_items = 10000
+    atomic_query_param = 'atomic'
+
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.bulk_create(request, *args, **kwargs)
+        return super().create(request, *args, **kwargs)
+
+    def bulk_create(self, request, *args, **kwargs):
+        items = self.get_bulk_items(request)
+        entries = [(position, item, None) for position, item in enumerate(items)]
+        validated, errors = bulk.validate(self.get_serializer_class(), entries, self.get_serializer_context())
+        if errors and self.is_atomic(request):
+            return self.bulk_response(len(items), {}, errors)
+        positions = sorted(validated)
+        try:
+            instances = bulk.create(self.get_queryset().model, [validated[p] for p in positions])
+        except IntegrityError as exc:
+            return self.integrity_error_response(exc)
+        return self.bulk_response(len(items), dict(zip(positions, instances)), errors, status.HTTP_201_CREATED)
+
+    def bulk_update(self, request, *args, **kwargs):
+        items = self.get_bulk_items(request)
+        instances, errors = self.get_bulk_instances([item.get('id') if isinstance(item, dict) else None
+                                                     for item in items])
+        entries = [(position, item, instances[position]) for position, item in enumerate(items)
+                   if position in instances]
+        validated, invalid = bulk.validate(self.get_serializer_class(), entries, self.get_serializer_context(),
+                                           partial=True)
+        errors.update(invalid)
+        if errors and self.is_atomic(request):
+            return self.bulk_response(len(items), {}, errors)
+        positions = sorted(validated)
+        try:
+            bulk.update(self.get_queryset().model, [(instances[p], validated[p]) for p in positions])
+        except IntegrityError as exc:
+            return self.integrity_error_response(exc)
+        return self.bulk_response(len(items), {p: instances[p] for p in positions}, errors)
+
+    def integrity_error_response(self, exc):
+        """400 sans le texte de la base : message fixe et, pour une contrainte connue, le champ en cause"""
+        return Response({'error': bulk.INTEGRITY_MESSAGE, **bulk.integrity_errors(self.get_queryset().model, exc)},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    def bulk_destroy(self, request, *args, **kwargs):
+        items = self.get_bulk_items(request)
+        instances, errors = self.get_bulk_instances([item.get('id') if isinstance(item, dict) else item
+                                                     for item in items])
+        if errors and self.is_atomic(request):
+            return self.bulk_response(len(items), {}, errors)
+        model = self.get_queryset().model
+        deleted = bulk.delete(model._default_manager.filter(pk__in=[i.pk for i in instances.values()]))
+        return Response({
+            'deleted': deleted,
+            'errors': self.format_errors(errors),
+        }, status=status.HTTP_207_MULTI_STATUS if errors else status.HTTP_200_OK)
+
+    def get_bulk_items(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Une liste d'objets est attendue"]})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'Au plus {self.bulk_max_items} objets par requête']})
+        return items
+
+    def get_bulk_instances(self, ids):
+        """Charge en une requête les objets désignés par position ; renvoie (instances, erreurs)"""
+        pk = self.get_queryset().model._meta.pk
+        wanted, errors = {}, {}
+        for position, value in enumerate(ids):
+            try:
+                wanted[position] = pk.to_python(value)
+            except (DjangoValidationError, TypeError):
+                wanted[position] = None
+            if wanted[position] is None:
+                errors[position] = {'id': [serializers.Field.default_error_messages['required']]}
+                del wanted[position]
+        found = self.get_queryset().in_bulk(set(wanted.values()))
+        instances, used = {}, set()
+        for position, value in wanted.items():
+            if value not in found or value in used:
+                errors[position] = {'id': [NotFound.default_detail]}
+                continue
+            self.check_object_permissions(self.request, found[value])
+            instances[position] = found[value]
+            used.add(value)
+        return instances, errors
+
+    def is_atomic(self, request):
+        return request.query_params.get(self.atomic_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def bulk_response(self, count, instances, errors, success_status=status.HTTP_200_OK):
+        """Résultats alignés sur les données reçues (None pour un objet non enregistré) et erreurs par position"""
+        results = [None] * count
+        data = self.get_serializer(list(instances.values()), many=True).data
+        for position, item in zip(instances, data):
+            results[position] = item
+        if not errors:
+            response_status = success_status
+        elif instances:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({'results': results, 'errors': self.format_errors(errors)}, status=response_status)
+
+    @staticmethod
+    def format_errors(errors):
+        return [{'index': position, 'errors': errors[position]} for position in sorted(errors)]
+
+
+class ImportViewSetMixin:
+    """Action ``POST <liste>/import/`` : import en flux d'un fichier CSV ou NDJSON (champ ``file``).
+
+    La réponse est un flux NDJSON : une ligne ``progression`` par bloc, une ligne ``rejet`` par
+    ligne refusée et un ``resume`` final. Le format est déduit de l'extension du fichier ou du
+    champ ``format`` (csv, ndjson).
+    """
+    import_chunk_size = importing.CHUNK_SIZE
+
+    @action(detail=False, methods=['post'], url_path='import', url_name='import', parser_classes=[MultiPartParser])
+    def importer(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Fichier manquant (champ file)'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or importing.detect_format(upload.name)
+        if fmt not in importing.FORMATS.values():
+            return Response({'error': f'Format inconnu : {fmt}'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = importing.read_rows(upload, fmt)
+        chunks = importing.run_import(self.get_serializer_class(), rows, self.import_chunk_size,
+                                      self.get_serializer_context())
+        return StreamingHttpResponse(self.import_events(chunks), content_type='application/x-ndjson')
+
+    @staticmethod
+    def import_events(chunks):
+        totals = {'lignes': 0, 'creees': 0, 'rejetees': 0}
+        try:
+            for chunk in chunks:
+                totals['lignes'] += chunk.lignes
+                totals['creees'] += chunk.creees
+                totals['rejetees'] += len(chunk.rejets)
+                for row in chunk.rejets:
+                    yield json.dumps({'type': 'rejet', **row._asdict()}, ensure_ascii=False) + '\n'
+                yield json.dumps({'type': 'progression', **totals}) + '\n'
+        except UnicodeDecodeError as exc:
+            # Les blocs précédents restent enregistrés
+            yield json.dumps({'type': 'erreur', 'error': f'Encodage invalide (UTF-8 attendu) : {exc}'}) + '\n'
+        yield json.dumps({'type': 'resume', **totals}) + '\n'
+
+
+class AgendaViewSetMixin:
+    """``GET <détail>/agenda.ics`` : rendez-vous de l'objet au format iCalendar, en flux (api/calendars.py).
+
+    ``agenda_field`` nomme la clé étrangère de RendezVous vers le modèle du ViewSet. La fenêtre se
+    choisit par ``?debut=`` et ``?fin=`` ; l'ETag (ConditionalGetMixin) suit les tables des rendez-vous,
+    patients et médecins, et le jour courant quand une borne de la fenêtre glisse avec la date.
+    """
+    agenda_field = None
+
+    @action(detail=True, methods=['get'], renderer_classes=[ICalendarRenderer])
+    def agenda(self, request, pk=None, format=None):
+        try:
+            debut, fin = calendars.window(request.query_params)
+        except ValueError:
+            return Response({'error': f'Période invalide (au plus {calendars.FENETRE_MAX} jours)'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return self.conditional_response(request, self.stream_agenda, debut, fin)
+
+    def stream_agenda(self, request, debut, fin):
+        obj = self.get_object()
+        rows = calendars.rows(self.agenda_field, obj.pk, debut, fin).iterator(chunk_size=self.export_chunk_size)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream((calendars.event(row, self.agenda_field) for row in rows), calendars.properties(str(obj))),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'inline; filename="{self.basename}-{obj.pk}.ics"'
+        return response
+
+    def get_validators(self, request):
+        etag, last_modified = super().get_validators(request)
+        params = request.query_params
+        if self.action != 'agenda' or (params.get('debut') and params.get('fin')):
+            return etag, last_modified
+        # Fenêtre par défaut relative à maintenant : le flux change chaque jour sans écriture
+        jour = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        digest = hashlib.sha1(f'{etag}{jour.date()}'.encode()).hexdigest()
+        return f'"{digest}"', max(jour, last_modified) if last_modified else jour
+
+    def get_validated_models(self):
+        if self.action == 'agenda':
+            return (RendezVous, Patient, Medecin)
+        return super().get_validated_models()
+
+
+class ReplicaReadViewSetMixin:
+    """Lectures des requêtes GET/HEAD/OPTIONS sur un réplica, écritures suivies de lectures sur la base
+    principale (api/replicas.py).
+
+    Le réplica est choisi après l'authentification, qui lit la base principale. Une écriture réussie
+    garde l'utilisateur sur la base principale pendant ``REPLICA_PIN_SECONDS``.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            replicas.use_replica(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            replicas.pin(request.user)
+        return response
+
+
+class AsyncReadViewSetMixin:
+    """Vues asynchrones pour les lectures en mode ASGI (``settings.ASYNC_READS``, hospital_api/asgi.py).
+
+    Les actions de ``async_actions`` sont servies par leur variante ``a<action>`` : les requêtes
+    principales (COUNT, page, objet, sous-ressources) passent par l'ORM asynchrone et ne bloquent pas
+    la boucle d'événements. L'authentification, les permissions, le throttling, l'ETag et la
+    conversion des lignes (cache de référence) restent synchrones, exécutés dans le thread de la
+    requête. Les autres actions sont servies par la vue synchrone habituelle ; en WSGI rien ne change.
+    """
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_READS:
+            return sync_view
+        actions = {'head': actions['get'], **actions} if 'get' in actions else actions
+
+        async def view(request, *args, **kwargs):
+            if actions.get(request.method.lower()) not in cls.async_actions:
+                return async_streaming(await sync_to_async(sync_view)(request, *args, **kwargs))
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, action in actions.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return async_streaming(await self.adispatch(request, *args, **kwargs))
+
+        # cls, initkwargs, actions (schéma, router) et csrf_exempt de la vue de DRF
+        functools.update_wrapper(view, sync_view)
+        return view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch() dont le handler est la coroutine ``a<action>``"""
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await getattr(self, f'a{self.action}')(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aconditional_response(self, request, handler, *args, **kwargs):
+        etag, last_modified = await sync_to_async(self.get_validators)(request)
+        response = self.not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+
+    async def alist(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None or hasattr(request.accepted_renderer, 'stream'):
+            # Export en flux ou serializer non compilable : chemin synchrone
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+        return await self.aconditional_response(request, self.alist_compiled, compiled)
+
+    async def alist_compiled(self, request, compiled):
+        # Les filtres peuvent valider leurs paramètres en base (ModelChoiceFilter)
+        queryset = await sync_to_async(self.get_compiled_queryset)(compiled)
+        page = await self.apaginate_queryset(queryset)
+        rows = page if page is not None else [row async for row in queryset]
+        data = await sync_to_async(compiled.render)(rows)
+        return self.get_paginated_response(data) if page is not None else Response(data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.aconditional_response(request, self.aretrieve_object)
+
+    async def aretrieve_object(self, request):
+        instance = await self.aget_object()
+        return Response(await self.aserialize(self.get_serializer, instance))
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def aget_object(self):
+        """get_object() lu par l'ORM asynchrone"""
+        queryset = await sync_to_async(lambda: self.filter_queryset(self.get_queryset()))()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, DjangoValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    @staticmethod
+    async def aserialize(serializer_class, data, **kwargs):
+        """``serializer_class(data).data`` ; un queryset est d'abord lu par l'ORM asynchrone"""
+        if isinstance(data, QuerySet):
+            data = [obj async for obj in data]
+        return await sync_to_async(lambda: serializer_class(data, **kwargs).data)()
+
+
+_END = object()
+
+
+def async_streaming(response):
+    """Sous ASGI, Django lirait en entier une réponse en flux synchrone avant de l'envoyer : ses blocs
+    sont produits un à un dans le thread de la requête (curseur côté serveur compris)"""
+    if getattr(response, 'streaming', False) and not response.is_async:
+        response.streaming_content = _aiterate(response.streaming_content)
+    return response
+
+
+async def _aiterate(iterator):
+    step = sync_to_async(next)
+    while (chunk := await step(iterator, _END)) is not _END:
+        yield chunk
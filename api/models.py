@@ -1,5 +1,8 @@
-from django.db import models
-from django.core.validators import MinValueValidator
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 
 class Patient(models.Model):
@@ -21,6 +24,15 @@ class Patient(models.Model):
 
     class Meta:
         ordering = ['-date_enregistrement']
+        indexes = [
+            # Pagination par curseur sur (date, id)
+            models.Index(fields=['date_enregistrement', 'id'], name='api_patient_date_id_idx'),
+            # Filtres et tris des ViewSets (manage.py advise_indexes)
+            models.Index(fields=['statut', 'date_enregistrement'], name='api_patient_statut_3ca543_idx'),
+            models.Index(fields=['genre', 'date_enregistrement'], name='api_patient_genre_d44121_idx'),
+            models.Index(fields=['nom'], name='api_patient_nom_eb318a_idx'),
+            models.Index(fields=['prenom'], name='api_patient_prenom_a73efd_idx'),
+        ]
 
     def __str__(self):
         return f"{self.prenom} {self.nom}"
@@ -49,10 +61,39 @@ class Medecin(models.Model):
 
     class Meta:
         ordering = ['nom', 'prenom']
+        # Filtres et tris des ViewSets (manage.py advise_indexes)
+        indexes = [
+            models.Index(fields=['specialite', 'nom', 'prenom'], name='api_medecin_special_d70008_idx'),
+            models.Index(fields=['nom', 'prenom'], name='api_medecin_nom_893005_idx'),
+            models.Index(fields=['prenom'], name='api_medecin_prenom_9bbf19_idx'),
+        ]
 
     def __str__(self):
         return f"Dr. {self.prenom} {self.nom}"
 
+# Durée maximale d'un rendez-vous, en minutes : borne la recherche des chevauchements (api/overlaps.py)
+DUREE_MAX_RDV = 8 * 60
+
+
+class AjoutMinutes(models.Func):
+    """``date + minutes`` calculé par la base, au format où Django y enregistre les dates"""
+    arity = 2
+    output_field = models.DateTimeField()
+
+    def compile_arguments(self, compiler):
+        (date, date_params), (minutes, minutes_params) = (compiler.compile(e) for e in self.source_expressions)
+        return date, date_params, minutes, minutes_params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        date, date_params, minutes, minutes_params = self.compile_arguments(compiler)
+        return f'({date} + make_interval(mins => {minutes}))', [*date_params, *minutes_params]
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # datetime() tronque les fractions de seconde, inchangées par l'ajout de minutes : elles sont recopiées
+        date, date_params, minutes, minutes_params = self.compile_arguments(compiler)
+        return (f"(datetime({date}, '+' || {minutes} || ' minutes') || substr({date}, 20))",
+                [*date_params, *minutes_params, *date_params])
+
 class RendezVous(models.Model):
     STATUT_RDV = [
         ('confirme', 'Confirmé'),
@@ -60,22 +101,80 @@ class RendezVous(models.Model):
         ('complete', 'Complété'),
         ('reporte', 'Reporté'),
     ]
+    DUREE_MAX = DUREE_MAX_RDV
     
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='rendez_vous')
     medecin = models.ForeignKey(Medecin, on_delete=models.CASCADE, related_name='rendez_vous')
     date_heure = models.DateTimeField()
+    # Durée en minutes ; date_fin en est déduite à l'enregistrement
+    duree = models.PositiveSmallIntegerField(default=30, validators=[MinValueValidator(5), MaxValueValidator(DUREE_MAX)])
+    date_fin = models.DateTimeField(editable=False)
     motif = models.CharField(max_length=255)
     statut = models.CharField(max_length=15, choices=STATUT_RDV, default='confirme')
     notes = models.TextField(blank=True, null=True)
     date_creation = models.DateTimeField(auto_now_add=True)
+    # DTSTAMP/LAST-MODIFIED des agendas iCalendar (api/calendars.py)
+    date_modification = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-date_heure']
-        unique_together = ['medecin', 'date_heure']
+        indexes = [
+            # Pagination par curseur sur (date, id)
+            models.Index(fields=['date_heure', 'id'], name='api_rdv_date_id_idx'),
+            # Filtres et tris des ViewSets (manage.py advise_indexes)
+            models.Index(fields=['statut', 'date_heure'], name='api_rendezv_statut_17bed1_idx'),
+            models.Index(fields=['date_creation'], name='api_rendezv_date_cr_f1178f_idx'),
+            # Chevauchements et créneaux libres d'un médecin (api/overlaps.py, api/availability.py)
+            models.Index(fields=['medecin', 'date_heure'], name='api_rdv_medecin_date_idx'),
+            # Agenda d'un patient (api/calendars.py)
+            models.Index(fields=['patient', 'date_heure'], name='api_rdv_patient_date_idx'),
+        ]
+        constraints = [
+            # La recherche des chevauchements ne remonte que DUREE_MAX minutes et lit date_fin : ces
+            # bornes tiennent aussi pour les écritures hors serializer (QuerySet.update, bulk_create)
+            models.CheckConstraint(check=models.Q(duree__lte=DUREE_MAX_RDV), name='api_rdv_duree_max'),
+            models.CheckConstraint(check=models.Q(date_fin=AjoutMinutes('date_heure', 'duree')),
+                                   name='api_rdv_date_fin'),
+        ]
 
     def __str__(self):
         return f"RDV {self.patient} - Dr. {self.medecin.prenom} - {self.date_heure}"
 
+    def save(self, *args, **kwargs):
+        self.date_fin = self.date_heure + timedelta(minutes=self.duree)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'date_heure', 'duree'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'date_fin'}
+        super().save(*args, **kwargs)
+
+class PlageHoraire(models.Model):
+    """Horaires de travail hebdomadaires d'un médecin, découpés en créneaux (voir api/availability.py)"""
+    JOURS = [
+        (0, 'Lundi'),
+        (1, 'Mardi'),
+        (2, 'Mercredi'),
+        (3, 'Jeudi'),
+        (4, 'Vendredi'),
+        (5, 'Samedi'),
+        (6, 'Dimanche'),
+    ]
+
+    medecin = models.ForeignKey(Medecin, on_delete=models.CASCADE, related_name='plages_horaires')
+    jour_semaine = models.PositiveSmallIntegerField(choices=JOURS)
+    heure_debut = models.TimeField()
+    heure_fin = models.TimeField()
+    # Durée d'un créneau, en minutes
+    duree_creneau = models.PositiveSmallIntegerField(default=30, validators=[MinValueValidator(5)])
+
+    class Meta:
+        ordering = ['medecin', 'jour_semaine', 'heure_debut']
+        indexes = [
+            models.Index(fields=['medecin', 'jour_semaine', 'heure_debut'], name='api_plage_medecin_jour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.medecin} - {self.get_jour_semaine_display()} {self.heure_debut}-{self.heure_fin}"
+
 class Consultation(models.Model):
     STATUT_CONSULTATION = [
         ('en_cours', 'En cours'),
@@ -94,6 +193,14 @@ class Consultation(models.Model):
 
     class Meta:
         ordering = ['-date_consultation']
+        indexes = [
+            # Pagination par curseur sur (date, id)
+            models.Index(fields=['date_consultation', 'id'], name='api_consult_date_id_idx'),
+            # Filtres et tris des ViewSets (manage.py advise_indexes)
+            models.Index(fields=['statut', 'date_consultation'], name='api_consult_statut_0acebf_idx'),
+            models.Index(fields=['medecin', 'date_consultation'], name='api_consult_medecin_b5f73e_idx'),
+            models.Index(fields=['patient', 'date_consultation'], name='api_consult_patient_66a53b_idx'),
+        ]
 
     def __str__(self):
         return f"Consultation de {self.patient} avec {self.medecin} le {self.date_consultation}"
@@ -109,6 +216,11 @@ class Medicament(models.Model):
 
     class Meta:
         ordering = ['nom']
+        # Filtres et tris des ViewSets (manage.py advise_indexes)
+        indexes = [
+            models.Index(fields=['nom'], name='api_medicam_nom_7fa4c1_idx'),
+            models.Index(fields=['prix'], name='api_medicam_prix_47999b_idx'),
+        ]
 
     def __str__(self):
         return self.nom
@@ -124,6 +236,12 @@ class Ordonnance(models.Model):
 
     class Meta:
         ordering = ['-date_ordonnance']
+        # Filtres et tris des ViewSets (manage.py advise_indexes)
+        indexes = [
+            models.Index(fields=['patient', 'date_ordonnance'], name='api_ordonna_patient_18f6fa_idx'),
+            models.Index(fields=['medecin', 'date_ordonnance'], name='api_ordonna_medecin_a78b5c_idx'),
+            models.Index(fields=['date_ordonnance'], name='api_ordonna_date_or_05210d_idx'),
+        ]
 
     def __str__(self):
         return f"Ordonnance {self.id} - {self.patient} ({self.date_ordonnance})"
@@ -159,6 +277,109 @@ class Facturation(models.Model):
 
     class Meta:
         ordering = ['-date_facturation']
+        indexes = [
+            # Pagination par curseur sur (date, id)
+            models.Index(fields=['date_facturation', 'id'], name='api_fact_date_id_idx'),
+            # Filtres et tris des ViewSets (manage.py advise_indexes)
+            models.Index(fields=['statut', 'date_facturation'], name='api_factura_statut_e86e4a_idx'),
+            models.Index(fields=['patient', 'date_facturation'], name='api_factura_patient_8d7f83_idx'),
+            models.Index(fields=['montant'], name='api_factura_montant_a37c14_idx'),
+        ]
 
     def __str__(self):
         return f"Facture {self.id} - {self.patient} - {self.montant}€"
+
+    def save(self, *args, **kwargs):
+        # Les agrégats (signaux) sont mis à jour dans la même transaction que la facture
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+class Paiement(models.Model):
+    """Journal des paiements : une ligne par encaissement, jamais modifiée"""
+    facture = models.ForeignKey(Facturation, on_delete=models.CASCADE, related_name='paiements')
+    montant = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
+    utilisateur = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    date_paiement = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date_paiement']
+
+    def __str__(self):
+        return f"Paiement {self.id} - Facture {self.facture_id} - {self.montant}€"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Un paiement enregistré ne peut pas être modifié')
+        super().save(*args, **kwargs)
+
+class StatistiqueFacturation(models.Model):
+    """Agrégats de facturation maintenus à chaque écriture (voir api/rollups.py)"""
+    PORTEES = [
+        ('global', 'Global'),
+        ('patient', 'Par patient'),
+        ('mois', 'Par mois'),
+        ('statut', 'Par statut'),
+    ]
+
+    portee = models.CharField(max_length=10, choices=PORTEES)
+    cle = models.CharField(max_length=32, blank=True, default='')
+    nombre = models.IntegerField(default=0)
+    total_montant = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    total_paye = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['portee', 'cle']
+
+    def __str__(self):
+        return f"{self.portee}:{self.cle} - {self.nombre} factures"
+
+class VersionTable(models.Model):
+    """Compteur de modifications par table, pour les ETag des réponses (voir api/versioning.py)"""
+    table = models.CharField(max_length=64, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    date_modification = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+class JetonRevoque(models.Model):
+    """Refresh token révoqué (rotation), identifié par sa claim jti (voir api/blacklist.py)"""
+    jti = models.CharField(max_length=64, primary_key=True)
+    date_expiration = models.DateTimeField(db_index=True)
+    date_revocation = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.jti} (expire le {self.date_expiration})"
+
+
+class RequeteLente(models.Model):
+    """Requête SQL lente, regroupée par empreinte ; les N plus coûteuses sont gardées (voir api/slowqueries.py)"""
+    empreinte = models.CharField(max_length=40, unique=True)
+    sql = models.TextField()
+    # Dernière occurrence : paramètres, base, vue et pile d'appels
+    parametres = models.TextField(blank=True)
+    base = models.CharField(max_length=64, default='default')
+    vue = models.CharField(max_length=255, blank=True)
+    pile = models.TextField(blank=True)
+    plan = models.TextField(blank=True)
+    nombre = models.PositiveIntegerField(default=0)
+    duree_totale_ms = models.FloatField(default=0)
+    duree_max_ms = models.FloatField(default=0)
+    date_premiere = models.DateTimeField(default=timezone.now)
+    date_derniere = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-duree_totale_ms']
+        verbose_name = 'requête lente'
+        verbose_name_plural = 'requêtes lentes'
+
+    def __str__(self):
+        return f"{self.empreinte[:12]} - {self.nombre} x, {self.duree_totale_ms:.0f} ms"
+
+    @property
+    def duree_moyenne_ms(self):
+        return self.duree_totale_ms / self.nombre if self.nombre else 0
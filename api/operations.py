@@ -0,0 +1,28 @@
+from django.db.migrations.operations import AddIndex
+
+
+class AddIndexConcurrentlyIfSupported(AddIndex):
+    """AddIndex construit avec CREATE INDEX CONCURRENTLY sur PostgreSQL.
+
+    Les grandes tables ne sont pas verrouillées en écriture pendant la construction ; sur les
+    autres bases l'opération se comporte comme AddIndex. La migration doit déclarer ``atomic = False``.
+    """
+
+    def describe(self):
+        return 'Create index %s on field(s) %s of model %s (concurrently on PostgreSQL)' % (
+            self.index.name, ', '.join(self.index.fields), self.model_name,
+        )
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
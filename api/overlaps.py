@@ -0,0 +1,150 @@
+"""Rendez-vous qui se chevauchent : contrôle par la base et par les serializers.
+
+Un rendez-vous occupe [date_heure, date_fin) ; deux rendez-vous non annulés d'un même médecin ne
+peuvent pas se chevaucher. PostgreSQL le garantit par une contrainte d'exclusion sur
+tstzrange(date_heure, date_fin) (index GiST, extension btree_gist) ; SQLite par des triggers qui
+parcourent l'index (medecin_id, date_heure) sur une fenêtre bornée par la durée maximale d'un
+rendez-vous. Dans les deux cas, une réservation concurrente perdante lève IntegrityError. Les
+contraintes CHECK de RendezVous (durée au plus DUREE_MAX, date_fin = date_heure + durée) gardent
+cette fenêtre et date_fin exactes pour les écritures qui contournent save().
+
+Les serializers vérifient le chevauchement avant l'écriture pour renvoyer une erreur lisible
+(NoOverlapValidator), en une requête par lot pour les écritures en masse (api/bulk.py).
+
+Sur SQLite, une migration qui reconstruit api_rendezvous supprime ses triggers : install() est
+rappelée après chaque migrate (api/signals.py).
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+from rest_framework import serializers
+
+from .models import RendezVous
+
+TABLE = RendezVous._meta.db_table
+
+CONSTRAINT = 'api_rdv_sans_chevauchement'
+
+# Statuts de rendez-vous qui libèrent leur créneau
+STATUTS_LIBRES = ['annule']
+
+MESSAGE = 'Ce créneau chevauche un autre rendez-vous du médecin'
+
+DUREE_MAX = timedelta(minutes=RendezVous.DUREE_MAX)
+
+
+def sqlite_trigger(event):
+    exclude_self = ' AND r.id <> NEW.id' if event == 'update' else ''
+    columns = ' OF medecin_id, date_heure, date_fin, statut' if event == 'update' else ''
+    return (
+        f'CREATE TRIGGER IF NOT EXISTS {CONSTRAINT}_{event} BEFORE {event.upper()}{columns} ON {TABLE} '
+        f"WHEN NEW.statut NOT IN ({', '.join(repr(s) for s in STATUTS_LIBRES)}) AND EXISTS ("
+        f'SELECT 1 FROM {TABLE} r WHERE r.medecin_id = NEW.medecin_id '
+        f"AND r.date_heure > datetime(NEW.date_heure, '-{RendezVous.DUREE_MAX} minutes') "
+        f'AND r.date_heure < NEW.date_fin AND r.date_fin > NEW.date_heure '
+        f"AND r.statut NOT IN ({', '.join(repr(s) for s in STATUTS_LIBRES)}){exclude_self}) "
+        f"BEGIN SELECT RAISE(ABORT, '{MESSAGE}'); END"
+    )
+
+
+POSTGRESQL_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    f"ALTER TABLE {TABLE} ADD CONSTRAINT {CONSTRAINT} EXCLUDE USING gist "
+    f"(medecin_id WITH =, tstzrange(date_heure, date_fin, '[)') WITH &&) "
+    f"WHERE (statut NOT IN ({', '.join(repr(s) for s in STATUTS_LIBRES)}))",
+]
+
+
+def install(connection):
+    """Crée la contrainte (PostgreSQL) ou les triggers (SQLite) s'ils n'existent pas"""
+    with connection.cursor() as cursor:
+        if TABLE not in connection.introspection.table_names(cursor):
+            return
+        if connection.vendor == 'sqlite':
+            for event in ('insert', 'update'):
+                cursor.execute(sqlite_trigger(event))
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s', [CONSTRAINT])
+            if cursor.fetchone() is None:
+                for statement in POSTGRESQL_SQL:
+                    cursor.execute(statement)
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for event in ('insert', 'update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {CONSTRAINT}_{event}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'ALTER TABLE {TABLE} DROP CONSTRAINT IF EXISTS {CONSTRAINT}')
+
+
+def interval(attrs, instance=None):
+    """(medecin_id, début, fin, pk) du rendez-vous après écriture, ou None s'il n'occupe pas de créneau"""
+    def value(name):
+        return attrs[name] if name in attrs else getattr(instance, name, None)
+
+    medecin_id = attrs['medecin'].pk if 'medecin' in attrs else getattr(instance, 'medecin_id', None)
+    debut, duree = value('date_heure'), value('duree')
+    if medecin_id is None or debut is None or value('statut') in STATUTS_LIBRES:
+        return None
+    if duree is None:
+        duree = RendezVous._meta.get_field('duree').default
+    return medecin_id, debut, debut + timedelta(minutes=duree), getattr(instance, 'pk', None)
+
+
+def overlapping(medecin_id, debut, fin, exclude=None):
+    """Rendez-vous non annulés du médecin qui chevauchent [debut, fin), par l'index (medecin, date_heure)"""
+    queryset = RendezVous.objects.filter(
+        medecin_id=medecin_id, date_heure__gt=debut - DUREE_MAX, date_heure__lt=fin, date_fin__gt=debut,
+    ).exclude(statut__in=STATUTS_LIBRES)
+    if exclude is not None:
+        queryset = queryset.exclude(pk=exclude)
+    return queryset
+
+
+def conflicts(intervals, accepted=None):
+    """Positions des {position: (medecin_id, début, fin, pk)} qui chevauchent la base ou le lot, en une requête.
+
+    ``accepted`` (liste) reçoit les intervalles retenus, pour les comparer aux lots suivants.
+    """
+    accepted = [] if accepted is None else accepted
+    if not intervals:
+        return set()
+    debut = min(i[1] for i in intervals.values())
+    fin = max(i[2] for i in intervals.values())
+    pks = {i[3] for i in intervals.values() if i[3] is not None}
+    calendars = defaultdict(list)
+    rows = (RendezVous.objects
+            .filter(medecin_id__in={i[0] for i in intervals.values()},
+                    date_heure__gt=debut - DUREE_MAX, date_heure__lt=fin, date_fin__gt=debut)
+            .exclude(statut__in=STATUTS_LIBRES).exclude(pk__in=pks)
+            .values_list('medecin_id', 'date_heure', 'date_fin'))
+    for medecin_id, row_debut, row_fin in [*rows, *accepted]:
+        calendars[medecin_id].append((row_debut, row_fin))
+    for calendar in calendars.values():
+        calendar.sort()
+    found = set()
+    # Les calendriers ne contiennent que des intervalles disjoints : seuls les voisins comptent.
+    # Les rendez-vous du lot y sont ajoutés dans l'ordre des positions.
+    for position in sorted(intervals):
+        medecin_id, item_debut, item_fin, _ = intervals[position]
+        calendar = calendars[medecin_id]
+        i = bisect_left(calendar, (item_debut,))
+        if (i < len(calendar) and calendar[i][0] < item_fin) or (i > 0 and calendar[i - 1][1] > item_debut):
+            found.add(position)
+        else:
+            calendar.insert(i, (item_debut, item_fin))
+            accepted.append((medecin_id, item_debut, item_fin))
+    return found
+
+
+class NoOverlapValidator:
+    """Refuse un rendez-vous qui chevauche un autre rendez-vous non annulé du même médecin"""
+    requires_context = True
+
+    def __call__(self, attrs, serializer):
+        found = interval(attrs, serializer.instance)
+        if found is not None and overlapping(*found[:3], exclude=found[3]).exists():
+            raise serializers.ValidationError(MESSAGE, code='overlap')
@@ -0,0 +1,176 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Pagination par curseur opaque sur (ordering du ViewSet, id).
+
+    Chaque page est une requête ``WHERE (date, id) < (:date, :id) ORDER BY date DESC, id DESC LIMIT n``
+    servie par un index composite : la latence ne dépend pas de la profondeur de la page et
+    aucun ``COUNT(*)`` n'est exécuté. Le paramètre ``ordering`` est ignoré dans ce mode.
+    """
+    cursor_query_param = 'cursor'
+    page_size = PageNumberPagination.page_size
+    invalid_cursor_message = 'Curseur invalide'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_rows(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() des vues asynchrones (mode ASGI), page lue par l'ORM asynchrone"""
+        return self.set_rows([row async for row in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view):
+        """Requête de la page demandée, une ligne de plus pour savoir s'il existe une page suivante"""
+        self.request = request
+        self.model = queryset.model
+        self.ordering = self.get_ordering(view)
+        self.start, self.reverse = self.decode_cursor(request)
+
+        ordering = [self.invert(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.start is not None:
+            queryset = queryset.filter(self.after(ordering, self.start))
+        return queryset[:self.page_size + 1]
+
+    def set_rows(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = self.start is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.start is not None
+        self.rows = rows
+        return rows
+
+    def get_ordering(self, view):
+        ordering = list(getattr(view, 'ordering', None) or self.model._meta.ordering)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            # L'id départage les lignes ayant la même valeur de tri
+            ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def after(ordering, position):
+        """Condition lexicographique « strictement après position » pour l'ordre donné"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def position(self, row):
+        return [row[f.lstrip('-')] if isinstance(row, dict) else getattr(row, f.lstrip('-'))
+                for f in self.ordering]
+
+    def encode_cursor(self, row, reverse):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else str(value)
+                  for value in self.position(row)]
+        payload = json.dumps({'p': values, 'r': reverse}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            position = [self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                        for field, value in zip(self.ordering, payload['p'], strict=True)]
+            return position, bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.rows[0], reverse=True)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class HospitalPagination(PageNumberPagination):
+    """Pagination par numéro de page, ou par curseur si le ViewSet l'autorise et que ?cursor= est passé.
+
+    Un ViewSet active le mode curseur avec ``cursor_pagination = True`` ; les clients existants
+    (``?page=``) ne sont pas affectés. ``?cursor=`` (vide) demande la première page.
+    """
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request, view):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() des vues asynchrones (mode ASGI) : COUNT(*) et page lus par l'ORM asynchrone"""
+        self.keyset = None
+        if self.use_keyset(request, view):
+            self.keyset = self.keyset_class()
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Paginator.count est une cached_property : le COUNT(*) n'est pas refait de façon synchrone
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [row async for row in self.page.object_list]
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+    def use_keyset(self, request, view):
+        return getattr(view, 'cursor_pagination', False) and self.keyset_class.cursor_query_param in request.query_params
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,150 @@
+"""Renderers CSV, NDJSON (``?format=csv`` / ``?format=ndjson``) et iCalendar (agendas ``.ics``).
+
+``render()`` sert les réponses ordinaires ; ``stream()`` produit un export ligne à ligne à partir
+d'un itérable de dictionnaires, sans construire le document complet en mémoire (voir
+api.mixins.ExportViewSetMixin).
+"""
+import csv
+import io
+import json
+import re
+
+from rest_framework import serializers
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Lignes regroupées par morceau envoyé au client
+STREAM_BATCH = 500
+
+# Débuts de cellule qu'un tableur interprète comme une formule (injection CSV)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+NUMBER = re.compile(r'[+-]?\d+(?:\.\d+)?')
+
+
+def flatten(data, prefix=''):
+    """Aplatit les objets imbriqués en colonnes ``patient.nom`` ; les listes restent en JSON"""
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, list):
+            flat[f'{prefix}{key}'] = json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def neutralize(value):
+    """Texte préfixé d'une apostrophe s'il serait exécuté comme formule à l'ouverture dans un tableur"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def columns(serializer, prefix=''):
+    """Colonnes CSV d'un serializer, dans l'ordre de ses champs"""
+    names = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.BaseSerializer) and not isinstance(field, serializers.ListSerializer):
+            names.extend(columns(field, f'{prefix}{name}.'))
+        elif getattr(field, 'serializer_class', None) is not None:
+            # Objet de référence servi par le cache (api.cache.ReferenceField)
+            names.extend(columns(field.serializer_class(), f'{prefix}{name}.'))
+        else:
+            names.append(f'{prefix}{name}')
+    return names
+
+
+def _rows(data):
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return data['results']
+    if isinstance(data, list):
+        return data
+    return [] if data is None else [data]
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = [flatten(row) for row in _rows(data)]
+        fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+        return ''.join(self.stream(rows, fieldnames)).encode(self.charset)
+
+    def stream(self, rows, fieldnames):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for count, row in enumerate(rows, start=1):
+            writer.writerow({key: neutralize(value) for key, value in flatten(row).items()})
+            if count % STREAM_BATCH == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return ''.join(self.stream(_rows(data))).encode(self.charset)
+
+    def stream(self, rows, fieldnames=None):
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(row, cls=JSONEncoder, ensure_ascii=False))
+            if len(lines) == STREAM_BATCH:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+
+def ics_escape(value):
+    """Texte iCalendar (RFC 5545, 3.3.11) : antislash, virgule, point-virgule et retours à la ligne échappés"""
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def ics_fold(line):
+    """Lignes de 75 octets au plus, suites préfixées d'une espace (RFC 5545, 3.1)"""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts, start, limit = [], 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # Pas de coupure au milieu d'un caractère UTF-8
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode('utf-8'))
+        start, limit = end, 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+class ICalendarRenderer(BaseRenderer):
+    """Agenda iCalendar : ``stream()`` reçoit l'en-tête du calendrier et les événements (listes de propriétés)"""
+    media_type = 'text/calendar'
+    format = 'ics'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Les réponses d'erreur (400, 404) restent lisibles
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, events, properties=()):
+        lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', *(f'{name}:{value}' for name, value in properties)]
+        for count, event in enumerate(events, start=1):
+            lines += ['BEGIN:VEVENT', *(f'{name}:{value}' for name, value in event), 'END:VEVENT']
+            if count % STREAM_BATCH == 0:
+                yield ''.join(ics_fold(line) for line in lines)
+                lines = []
+        lines.append('END:VCALENDAR')
+        yield ''.join(ics_fold(line) for line in lines)
@@ -0,0 +1,129 @@
+"""Lectures sur réplicas, avec lecture de ses propres écritures.
+
+Les requêtes GET, HEAD et OPTIONS des ViewSets (api.mixins.ReplicaReadViewSetMixin) lisent sur un
+des alias de ``settings.DATABASE_REPLICAS``, une fois l'utilisateur authentifié sur la base
+principale. Les écritures et les migrations restent sur ``default``.
+
+Un utilisateur qui vient d'écrire reste sur la base principale pendant ``REPLICA_PIN_SECONDS`` ; le
+repère est posé dans le magasin partagé par les workers de ``THROTTLE_STORE`` (api/throttling.py :
+fichier SQLite de l'hôte, ou cache partagé entre plusieurs hôtes), pas dans le cache du processus.
+
+Un réplica en retard est écarté : sa table des versions (api/versioning.py) est comparée à celle de
+la base principale au plus toutes les ``REPLICA_CHECK_SECONDS`` par processus. Pour une table dont
+il n'a pas la dernière version, son retard est l'âge de la dernière écriture qu'il a reçue sur cette
+table ; au-delà de ``REPLICA_MAX_LAG_SECONDS``, il est mis de côté jusqu'à la vérification suivante.
+Sans réplica disponible, la requête lit la base principale.
+"""
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.utils import timezone
+
+from .models import VersionTable
+from .throttling import get_store
+
+# Alias de lecture de la requête en cours (None : base principale)
+_alias = ContextVar('replica_alias', default=None)
+
+# alias -> (time.monotonic() de la vérification, réplica utilisable)
+_health = {}
+_lock = threading.Lock()
+
+
+def reset(**kwargs):
+    _alias.set(None)
+
+
+def current():
+    return _alias.get()
+
+
+def use_replica(user):
+    """Dirige les lectures de la requête vers un réplica à jour ; renvoie l'alias choisi ou None"""
+    if not settings.DATABASE_REPLICAS or is_pinned(user):
+        return None
+    candidates = [alias for alias in settings.DATABASE_REPLICAS if is_healthy(alias)]
+    alias = random.choice(candidates) if candidates else None
+    _alias.set(alias)
+    return alias
+
+
+def pin(user):
+    """Garde l'utilisateur sur la base principale après une écriture"""
+    if settings.DATABASE_REPLICAS and user.is_authenticated and settings.REPLICA_PIN_SECONDS > 0:
+        get_store().mark(_pin_key(user), settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and get_store().is_marked(_pin_key(user))
+
+
+def _pin_key(user):
+    return f'replicas:pin:{user.pk}'
+
+
+def is_healthy(alias):
+    """Le réplica répond et n'a pas de retard excessif (vérifié au plus toutes les REPLICA_CHECK_SECONDS)"""
+    checked = _health.get(alias)
+    if checked is not None and time.monotonic() - checked[0] < settings.REPLICA_CHECK_SECONDS:
+        return checked[1]
+    try:
+        healthy = lag(alias) <= settings.REPLICA_MAX_LAG_SECONDS
+    except DatabaseError:
+        healthy = False
+    with _lock:
+        _health[alias] = (time.monotonic(), healthy)
+    return healthy
+
+
+def forget():
+    """Oublie l'état des réplicas : ils seront vérifiés à la prochaine lecture"""
+    with _lock:
+        _health.clear()
+
+
+def lag(alias):
+    """Retard du réplica, en secondes : pour chaque table où il n'a pas la dernière version, âge de la
+    dernière écriture qu'il a reçue sur cette table.
+
+    Mesurer l'âge de la dernière écriture de la base principale ne suffit pas : sur une table écrite
+    en continu, il reste proche de zéro alors que le réplica est bloqué. Une écriture récente après
+    un long silence surestime le retard, le réplica est alors évité jusqu'à ce qu'il l'ait reçue.
+    """
+    primary, replica = versions(DEFAULT_DB_ALIAS), versions(alias)
+    now = timezone.now()
+    # Table jamais écrite sur le réplica : au moins depuis la dernière écriture de la base principale
+    return max(((now - replica.get(table, (0, date))[1]).total_seconds()
+                for table, (version, date) in primary.items() if replica.get(table, (0, None))[0] < version),
+               default=0)
+
+
+def versions(alias):
+    return {table: (version, date) for table, version, date in
+            VersionTable.objects.using(alias).values_list('table', 'version', 'date_modification')}
+
+
+class ReplicaRouter:
+    """Lectures sur l'alias choisi pour la requête (use_replica), écritures et migrations sur default"""
+
+    def db_for_read(self, model, **hints):
+        return _alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Un objet lu sur un réplica est enregistré sur la base principale
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,154 @@
+"""Agrégats de facturation (global, par patient, par mois, par statut) tenus à jour de façon incrémentale.
+
+Chaque écriture d'une facture retire la contribution de son ancienne version et ajoute celle de la
+nouvelle, par des ``UPDATE ... SET total = total + delta`` exécutés dans la transaction de l'écriture :
+la lecture des statistiques est en O(1). Les paiements (FacturationViewSet.enregistrer_paiement)
+appliquent leur delta après le commit, pour ne pas garder la ligne globale verrouillée pendant leur
+transaction ; un arrêt du processus entre les deux laisse une dérive que corrige la reconstruction.
+Les écritures qui contournent save()/delete()
+(``QuerySet.update``, ``bulk_create``) doivent appeler apply_changes() elles-mêmes, comme le font
+les signaux post_bulk_* d'api/bulk.py ; ``manage.py rebuild_billing_rollups`` recalcule tout en
+cas de dérive.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Count, DecimalField, F, Max, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, TruncMonth
+
+from .models import Facturation, Patient, StatistiqueFacturation
+
+# Valeurs d'une facture qui déterminent sa contribution aux agrégats
+Contribution = namedtuple('Contribution', 'patient_id date_facturation statut montant montant_paye')
+
+ZERO = Decimal('0.00')
+
+
+def contribution_of(facture):
+    return Contribution(*(getattr(facture, name) for name in Contribution._fields))
+
+
+def rollup_keys(contribution):
+    return [
+        ('global', ''),
+        ('patient', str(contribution.patient_id)),
+        ('mois', contribution.date_facturation.strftime('%Y-%m')),
+        ('statut', contribution.statut),
+    ]
+
+
+def apply_change(old=None, new=None):
+    """Applique la différence entre deux versions d'une facture (None : inexistante)"""
+    apply_changes([(old, new)])
+
+
+def apply_changes(changes):
+    """Applique en une fois les différences d'une suite de (ancienne, nouvelle) versions"""
+    deltas = {}
+    for old, new in changes:
+        for contribution, sign in ((old, -1), (new, 1)):
+            if contribution is None:
+                continue
+            for key in rollup_keys(contribution):
+                nombre, montant, paye = deltas.get(key, (0, ZERO, ZERO))
+                deltas[key] = (nombre + sign, montant + sign * Decimal(contribution.montant),
+                               paye + sign * Decimal(contribution.montant_paye))
+    # Les clés qui reçoivent le même delta sont mises à jour par un seul UPDATE
+    groups = {}
+    for key, delta in deltas.items():
+        if any(delta):
+            groups.setdefault(delta, []).append(key)
+    with transaction.atomic():
+        for delta, keys in groups.items():
+            _increment(keys, *delta)
+
+
+def _matching(keys):
+    condition = Q()
+    for portee, cle in keys:
+        condition |= Q(portee=portee, cle=cle)
+    return StatistiqueFacturation.objects.filter(condition)
+
+
+def _increment(keys, nombre, montant, paye):
+    updates = dict(nombre=F('nombre') + nombre, total_montant=F('total_montant') + montant,
+                   total_paye=F('total_paye') + paye)
+    savepoint = transaction.savepoint()
+    if _matching(keys).update(**updates) == len(keys):
+        transaction.savepoint_commit(savepoint)
+        return
+    # Au moins une ligne manque : on annule et on traite les clés une à une
+    transaction.savepoint_rollback(savepoint)
+    for key in keys:
+        if _matching([key]).update(**updates):
+            continue
+        try:
+            with transaction.atomic():
+                StatistiqueFacturation.objects.create(portee=key[0], cle=key[1], nombre=nombre,
+                                                      total_montant=montant, total_paye=paye)
+        except IntegrityError:
+            # Ligne créée entre-temps par une transaction concurrente
+            _matching([key]).update(**updates)
+
+
+def read(*keys):
+    """Lit les agrégats demandés en une seule requête ; une clé absente vaut zéro"""
+    return _or_zero(keys, {(s.portee, s.cle): s for s in _matching(keys)})
+
+
+async def aread(*keys):
+    """read() par l'ORM asynchrone (vues asynchrones du mode ASGI)"""
+    return _or_zero(keys, {(s.portee, s.cle): s async for s in _matching(keys)})
+
+
+def _or_zero(keys, found):
+    return [found.get(key) or StatistiqueFacturation(portee=key[0], cle=key[1], total_montant=ZERO,
+                                                     total_paye=ZERO) for key in keys]
+
+
+def _totals():
+    decimal = DecimalField(max_digits=16, decimal_places=2)
+    return dict(
+        nombre=Count('id'),
+        total_montant=Coalesce(Sum('montant'), Value(ZERO), output_field=decimal),
+        total_paye=Coalesce(Sum('montant_paye'), Value(ZERO), output_field=decimal),
+    )
+
+
+def rebuild(chunk_size=1000, progress=None):
+    """Recalcule tous les agrégats depuis les factures et renvoie le nombre de lignes écrites.
+
+    Les portées globale, mensuelle et par statut sont remplacées en une transaction ; les agrégats
+    par patient le sont par tranches de ``chunk_size`` identifiants, chacune dans sa transaction.
+    ``progress(done, total)`` est appelé après chaque tranche.
+    """
+    factures = Facturation.objects.order_by()
+    with transaction.atomic():
+        StatistiqueFacturation.objects.exclude(portee='patient').delete()
+        # Agrégats de patients supprimés, hors des tranches recalculées ci-dessous
+        StatistiqueFacturation.objects.filter(portee='patient').exclude(
+            cle__in=Patient.objects.annotate(cle=Cast('id', CharField())).values('cle')).delete()
+        rows = [StatistiqueFacturation(portee='global', cle='', **factures.aggregate(**_totals()))]
+        rows += [StatistiqueFacturation(portee='statut', cle=row.pop('statut'), **row)
+                 for row in factures.values('statut').annotate(**_totals())]
+        rows += [StatistiqueFacturation(portee='mois', cle=row.pop('mois').strftime('%Y-%m'), **row)
+                 for row in factures.annotate(mois=TruncMonth('date_facturation')).values('mois')
+                 .annotate(**_totals())]
+        StatistiqueFacturation.objects.bulk_create(rows)
+    written = len(rows)
+
+    last = Patient.objects.aggregate(m=Max('id'))['m'] or 0
+    for start in range(1, last + 1, chunk_size):
+        end = min(start + chunk_size - 1, last)
+        with transaction.atomic():
+            StatistiqueFacturation.objects.filter(
+                portee='patient', cle__in=[str(i) for i in range(start, end + 1)]).delete()
+            rows = [StatistiqueFacturation(portee='patient', cle=str(row.pop('patient_id')), **row)
+                    for row in factures.filter(patient_id__gte=start, patient_id__lte=end)
+                    .values('patient_id').annotate(**_totals())]
+            StatistiqueFacturation.objects.bulk_create(rows)
+        written += len(rows)
+        if progress:
+            progress(end, last)
+    return written
@@ -0,0 +1,16 @@
+from rest_framework.routers import DefaultRouter
+
+
+class HospitalRouter(DefaultRouter):
+    """DefaultRouter dont la route de liste accepte aussi PATCH et DELETE (écritures en masse).
+
+    Les méthodes ne sont exposées que si le ViewSet définit bulk_update/bulk_destroy.
+    """
+    routes = [
+        DefaultRouter.routes[0]._replace(mapping={
+            **DefaultRouter.routes[0].mapping,
+            'patch': 'bulk_update',
+            'delete': 'bulk_destroy',
+        }),
+        *DefaultRouter.routes[1:],
+    ]
@@ -0,0 +1,266 @@
+"""Recherche plein texte pour ?search= : index FTS5 sur SQLite, tsvector/trigrammes sur PostgreSQL.
+
+Les deux moteurs trouvent un terme n'importe où dans les colonnes indexées, comme le ILIKE de
+``SearchFilter`` (``3456`` dans un téléphone, ``iop`` dans Diop), ignorent les accents (Ndèye = Ndeye)
+et classent les résultats par pertinence. Sur SQLite avant 3.45, les accents ne sont ignorés que
+pour les termes qui commencent un mot. Les autres bases, et les recherches sur des relations
+(``patient__nom``), gardent le comportement ILIKE de ``SearchFilter``.
+
+Sur SQLite, une migration qui reconstruit l'une des tables indexées supprime ses triggers : ``repair``
+les recrée après chaque migrate (api/signals.py).
+"""
+import re
+import sqlite3
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+# Colonnes indexées par table ; doivent correspondre aux search_fields des ViewSets
+SEARCH_INDEXES = {
+    'api_patient': ['nom', 'prenom', 'email', 'telephone'],
+    'api_medecin': ['nom', 'prenom', 'email', 'specialite'],
+    'api_medicament': ['nom', 'description', 'fabricant'],
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def trigram_table(table):
+    return f'{table}_fts_trgm'
+
+
+class SQLiteFTS5Backend:
+    """Deux tables virtuelles FTS5 à contenu externe par table, synchronisées par triggers :
+
+    - ``{table}_fts`` (unicode61, sans accents) : mots commençant par le terme, classement bm25 ;
+    - ``{table}_fts_trgm`` (trigrammes) : le terme n'importe où dans une colonne, comme ILIKE.
+    """
+
+    @staticmethod
+    def indexes(table):
+        # (table FTS, tokenizer) ; trigram ignore les accents à partir de SQLite 3.45
+        trigram = 'trigram remove_diacritics 1' if sqlite3.sqlite_version_info >= (3, 45) else 'trigram'
+        return [(fts_table(table), 'unicode61 remove_diacritics 2'), (trigram_table(table), trigram)]
+
+    @classmethod
+    def tables_sql(cls, table, columns):
+        cols = ', '.join(columns)
+        return [f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', "
+                f"content_rowid='id', tokenize='{tokenizer}')" for fts, tokenizer in cls.indexes(table)]
+
+    @classmethod
+    def triggers_sql(cls, table, columns):
+        cols = ', '.join(columns)
+        new = ', '.join(f'new.{c}' for c in columns)
+        old = ', '.join(f'old.{c}' for c in columns)
+        statements = []
+        for fts, _ in cls.indexes(table):
+            statements += [
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END',
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+                f'INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END',
+            ]
+        return statements
+
+    @classmethod
+    def rebuild_sql(cls, table):
+        return [f"INSERT INTO {fts}({fts}) VALUES ('rebuild')" for fts, _ in cls.indexes(table)]
+
+    @classmethod
+    def install_sql(cls, table, columns):
+        return cls.tables_sql(table, columns) + cls.triggers_sql(table, columns) + cls.rebuild_sql(table)
+
+    @staticmethod
+    def uninstall_sql(table, columns):
+        return [f'DROP TRIGGER IF EXISTS {fts}_{suffix}'
+                for fts in (fts_table(table), trigram_table(table)) for suffix in ('ai', 'ad', 'au')] + [
+            f'DROP TABLE IF EXISTS {fts_table(table)}', f'DROP TABLE IF EXISTS {trigram_table(table)}']
+
+    @classmethod
+    def repair(cls, connection):
+        """Recrée les tables et triggers manquants (reconstruction de table par une migration) et
+        réindexe les tables concernées ; les index complets ne sont pas relus"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+            existing = {row[0] for row in cursor.fetchall()}
+            for table, columns in SEARCH_INDEXES.items():
+                if table not in existing:
+                    continue
+                expected = [name for fts, _ in cls.indexes(table)
+                            for name in (fts, f'{fts}_ai', f'{fts}_ad', f'{fts}_au')]
+                if all(name in existing for name in expected):
+                    continue
+                for statement in cls.install_sql(table, columns):
+                    cursor.execute(statement)
+
+    def search(self, queryset, table, terms):
+        # Chaque terme doit apparaître dans au moins une colonne : en début de mot (accents ignorés)
+        # ou n'importe où, comme le ILIKE '%terme%' de SearchFilter et du moteur PostgreSQL
+        fts, trgm = fts_table(table), trigram_table(table)
+        where, params = [], []
+        for term in terms:
+            tokens = TOKEN_RE.findall(term)
+            prefix = ' AND '.join('"{}"*'.format(token) for token in tokens)
+            if len(term) >= 3:
+                substring = f'{table}.id IN (SELECT rowid FROM {trgm} WHERE {trgm} MATCH %s)'
+                substring_params = ['"{}"'.format(term.replace('"', '""'))]
+            else:
+                # Moins d'un trigramme : parcours de la table
+                substring = ' OR '.join(f"{table}.{column} LIKE %s ESCAPE '\\'"
+                                        for column in SEARCH_INDEXES[table])
+                escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                substring_params = [f'%{escaped}%'] * len(SEARCH_INDEXES[table])
+            if prefix:
+                where.append(f'({table}.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s) OR {substring})')
+                params += [prefix, *substring_params]
+            else:
+                where.append(f'({substring})')
+                params += substring_params
+        match = ' AND '.join('"{}"*'.format(token) for term in terms for token in TOKEN_RE.findall(term))
+        # Pertinence bm25 des correspondances en début de mot ; 0 pour les sous-chaînes seules
+        rank = RawSQL(f'coalesce((SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s '
+                      f'AND {fts}.rowid = {table}.id), 0)', [match]) if match else RawSQL('0', [])
+        return queryset.extra(where=where, params=params).annotate(search_rank=rank)
+
+
+class PostgreSQLBackend:
+    """Index GIN tsvector + trigrammes sur une expression sans accents, maintenus par PostgreSQL"""
+
+    @staticmethod
+    def document(table, columns, qualified=False):
+        prefix = f'{table}.' if qualified else ''
+        joined = " || ' ' || ".join(f"coalesce({prefix}{c}, '')" for c in columns)
+        return f'api_unaccent({joined})'
+
+    @classmethod
+    def install_sql(cls, table, columns):
+        document = cls.document(table, columns)
+        return [
+            f"CREATE INDEX IF NOT EXISTS {table}_search_tsv ON {table} "
+            f"USING gin (to_tsvector('simple', {document}))",
+            f'CREATE INDEX IF NOT EXISTS {table}_search_trgm ON {table} USING gin ({document} gin_trgm_ops)',
+        ]
+
+    @staticmethod
+    def uninstall_sql(table, columns):
+        return [f'DROP INDEX IF EXISTS {table}_search_tsv', f'DROP INDEX IF EXISTS {table}_search_trgm']
+
+    def search(self, queryset, table, terms):
+        document = self.document(table, SEARCH_INDEXES[table], qualified=True)
+        # Sous-chaîne sans accents (index trigrammes), même sémantique que ILIKE '%terme%'
+        where = [f"{document} ILIKE '%%' || api_unaccent(%s) || '%%'" for _ in terms]
+        tsquery = ' & '.join(f'{token}:*' for term in terms for token in TOKEN_RE.findall(term))
+        rank = (f"ts_rank(to_tsvector('simple', {document}), to_tsquery('simple', api_unaccent(%s)))"
+                f" + similarity({document}, api_unaccent(%s))")
+        escaped = [term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for term in terms]
+        return queryset.extra(where=where, params=escaped).annotate(
+            search_rank=RawSQL(rank, [tsquery or "''", ' '.join(terms)]))
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTS5Backend(),
+    'postgresql': PostgreSQLBackend(),
+}
+
+_installed = {}
+
+
+def get_backend(alias):
+    """Moteur disponible pour la base, ou None si les index de recherche ne sont pas installés"""
+    connection = connections[alias]
+    backend = BACKENDS.get(connection.vendor)
+    if backend is None:
+        return None
+    key = (alias, connection.settings_dict['NAME'])
+    if key not in _installed:
+        _installed[key] = is_installed(connection)
+    return backend if _installed[key] else None
+
+
+def is_installed(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            tables = connection.introspection.table_names(cursor)
+            return all(fts in tables for table in SEARCH_INDEXES for fts in (fts_table(table), trigram_table(table)))
+        cursor.execute("SELECT 1 FROM pg_proc WHERE proname = 'api_unaccent'")
+        return cursor.fetchone() is not None
+
+
+def install(schema_editor):
+    """Crée (ou répare) les index de recherche ; sans effet si la base ne les supporte pas"""
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'")
+            if cursor.fetchone() is None:
+                return
+    elif connection.vendor == 'postgresql':
+        for statement in POSTGRESQL_SETUP:
+            schema_editor.execute(statement)
+    else:
+        return
+    backend = BACKENDS[connection.vendor]
+    for table, columns in SEARCH_INDEXES.items():
+        for statement in backend.install_sql(table, columns):
+            schema_editor.execute(statement)
+    _installed.clear()
+
+
+def repair(connection):
+    """Recrée les index de recherche supprimés par une migration, s'ils avaient été installés"""
+    if connection.vendor == 'sqlite' and any(
+            fts_table(table) in connection.introspection.table_names() for table in SEARCH_INDEXES):
+        BACKENDS['sqlite'].repair(connection)
+        _installed.clear()
+
+
+def uninstall(schema_editor):
+    backend = BACKENDS.get(schema_editor.connection.vendor)
+    if backend is None:
+        return
+    for table, columns in SEARCH_INDEXES.items():
+        for statement in backend.uninstall_sql(table, columns):
+            schema_editor.execute(statement)
+    _installed.clear()
+
+
+# unaccent() n'est pas IMMUTABLE : l'enveloppe permet de l'utiliser dans un index d'expression
+POSTGRESQL_SETUP = [
+    'CREATE EXTENSION IF NOT EXISTS unaccent',
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE OR REPLACE FUNCTION api_unaccent(text) RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE "
+    "STRICT AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, lower($1)) $$",
+]
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """SearchFilter servi par l'index plein texte quand les search_fields du ViewSet sont indexés"""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        table = queryset.model._meta.db_table
+        search_fields = self.get_search_fields(view, request) or []
+        if not terms or set(search_fields) - set(SEARCH_INDEXES.get(table, ())):
+            return super().filter_queryset(request, queryset, view)
+        backend = get_backend(queryset.db)
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+        return backend.search(queryset, table, terms)
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """OrderingFilter qui trie par pertinence une recherche plein texte sans ?ordering= explicite"""
+
+    def filter_queryset(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return queryset.order_by('-search_rank', *self.get_default_ordering(view) or ())
+        return super().filter_queryset(request, queryset, view)
@@ -0,0 +1,236 @@
+"""Génération de jeux de données volumineux (benchmarks, reproduction de problèmes de performance).
+
+Chaque bloc de patients est généré avec son propre générateur aléatoire (graine + numéro de bloc) :
+le résultat est identique quel que soit le nombre de processus utilisés pour la génération.
+"""
+import math
+import multiprocessing
+import random
+import time as timer
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+import django
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import rollups, versioning
+from .models import (Patient, Medecin, RendezVous, Consultation, Medicament, Ordonnance,
+                     OrdonnanceMedicament, Facturation, PlageHoraire)
+
+NOMS = ['Diallo', 'Ndiaye', 'Sow', 'Ba', 'Fall', 'Gueye', 'Diop', 'Sarr', 'Faye', 'Cisse',
+        'Kane', 'Toure', 'Camara', 'Mbaye', 'Seck', 'Niang', 'Dupont', 'Durand', 'Lefèvre', 'Bâ']
+PRENOMS = ['Ahmed', 'Fatou', 'Mamadou', 'Awa', 'Ibrahima', 'Aïssatou', 'Moussa', 'Khady',
+           'Ousmane', 'Mariama', 'Cheikh', 'Ndèye', 'Jean', 'Sophie', 'Hélène', 'François']
+VILLES = ['Dakar', 'Thiès', 'Saint-Louis', 'Kaolack', 'Ziguinchor', 'Touba', 'Mbour', 'Rufisque']
+MOTIFS = ['Consultation générale', 'Suivi médical', 'Traitement', 'Contrôle', 'Urgence']
+MEDICAMENTS = ['Amoxicilline', 'Ibuprofène', 'Paracétamol', 'Loratadine', 'Metformine', 'Oméprazole',
+               'Amlodipine', 'Salbutamol', 'Artéméther', 'Ciprofloxacine', 'Diclofénac', 'Vitamine C']
+
+# Créneaux de 30 minutes entre 8h et 16h
+CRENEAUX_PAR_JOUR = 16
+
+# Modèles générés par bloc, dans l'ordre d'insertion imposé par les clés étrangères
+CHUNK_MODELS = [
+    ('patients', Patient), ('rendez_vous', RendezVous), ('consultations', Consultation),
+    ('ordonnances', Ordonnance), ('ordonnance_medicaments', OrdonnanceMedicament),
+    ('facturations', Facturation),
+]
+
+
+@dataclass(frozen=True)
+class SeedPlan:
+    """Paramètres partagés par tous les blocs (doit rester sérialisable pour les processus)"""
+    seed: int
+    patients: int
+    doctors: int
+    medicaments: int
+    rdv_per_patient: int
+    chunk_size: int
+    start: datetime
+    now: datetime
+    slot_stride: int
+    first_ids: dict
+    first_medecin: int
+    first_medicament: int
+
+    @property
+    def chunks(self):
+        return math.ceil(self.patients / self.chunk_size)
+
+
+@contextmanager
+def auto_now_disabled(*models):
+    """Permet de fixer explicitement les champs auto_now/auto_now_add lors d'un bulk_create"""
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def next_id(model):
+    return (model.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+
+def seed_dataset(patients=10000, doctors=None, medicaments=50, rdv_per_patient=3, years=1, seed=42,
+                 batch_size=2000, workers=1, progress=None):
+    """Insère un jeu de données déterministe et renvoie le nombre de lignes créées par modèle.
+
+    ``progress(counts, elapsed)`` est appelé après l'insertion de chaque bloc.
+    """
+    doctors = doctors or max(1, patients // 50)
+    counts = dict.fromkeys(['medecins', 'plages_horaires', 'medicaments'] + [key for key, _ in CHUNK_MODELS], 0)
+    now = timezone.now()
+    days = max(1, int(365 * years))
+    start = timezone.make_aware(datetime.combine(date.today() - timedelta(days=days), time(8, 0)))
+    slots_per_doctor = math.ceil(patients * rdv_per_patient / doctors)
+    if slots_per_doctor > days * CRENEAUX_PAR_JOUR:
+        raise ValueError(f'{slots_per_doctor} rendez-vous par médecin ne tiennent pas sur {days} jours '
+                         f'({CRENEAUX_PAR_JOUR} créneaux/jour) : augmentez --doctors ou --years')
+    started = timer.perf_counter()
+
+    with auto_now_disabled(Patient, Medecin, RendezVous, Consultation, Medicament, Ordonnance, Facturation):
+        first_medecin, first_medicament = _seed_reference_data(seed, doctors, medicaments, now, batch_size)
+        counts['medecins'], counts['medicaments'] = doctors, medicaments
+        counts['plages_horaires'] = doctors * 7
+
+        plan = SeedPlan(
+            seed=seed, patients=patients, doctors=doctors, medicaments=medicaments,
+            rdv_per_patient=rdv_per_patient, chunk_size=batch_size, start=start, now=now,
+            slot_stride=max(1, days * CRENEAUX_PAR_JOUR // max(1, slots_per_doctor)),
+            first_ids={key: next_id(model) for key, model in CHUNK_MODELS},
+            first_medecin=first_medecin, first_medicament=first_medicament,
+        )
+        for rows in _generate(plan, workers):
+            with transaction.atomic():
+                for key, model in CHUNK_MODELS:
+                    model.objects.bulk_create([model(**values) for values in rows[key]], batch_size=batch_size)
+                    counts[key] += len(rows[key])
+            if progress:
+                progress(counts, timer.perf_counter() - started)
+    # bulk_create n'envoie pas les signaux qui tiennent les agrégats et les versions à jour
+    rollups.rebuild(chunk_size=batch_size)
+    versioning.changed(Medecin, PlageHoraire, Medicament, *(model for _, model in CHUNK_MODELS))
+    return counts
+
+
+def _seed_reference_data(seed, doctors, medicaments, now, batch_size):
+    rng = random.Random(f'{seed}-reference')
+    with transaction.atomic():
+        first_medecin = next_id(Medecin)
+        Medecin.objects.bulk_create([
+            Medecin(
+                id=first_medecin + i, nom=rng.choice(NOMS), prenom=rng.choice(PRENOMS),
+                specialite=rng.choice(Medecin.SPECIALITES_CHOICES)[0], telephone=f'78{first_medecin + i:07d}',
+                email=f'medecin{first_medecin + i}@hospital.sn', numero_licence=f'LIC{first_medecin + i:08d}',
+                adresse_cabinet=rng.choice(VILLES), date_ajout=now,
+            ) for i in range(doctors)
+        ], batch_size=batch_size)
+        # Tous les jours, aux horaires des rendez-vous générés
+        PlageHoraire.objects.bulk_create([
+            PlageHoraire(medecin_id=first_medecin + i, jour_semaine=jour, heure_debut=time(8, 0),
+                         heure_fin=time(8 + CRENEAUX_PAR_JOUR // 2, 0), duree_creneau=30)
+            for i in range(doctors) for jour in range(7)
+        ], batch_size=batch_size)
+        first_medicament = next_id(Medicament)
+        Medicament.objects.bulk_create([
+            Medicament(
+                id=first_medicament + i, nom=f'{MEDICAMENTS[i % len(MEDICAMENTS)]} {i}',
+                description='Médicament de référence', prix=Decimal(rng.randint(100, 20000)),
+                dosage=f'{rng.choice([10, 100, 250, 500])}mg', fabricant='Pharma SN', date_creation=now,
+            ) for i in range(medicaments)
+        ], batch_size=batch_size)
+    return first_medecin, first_medicament
+
+
+def _generate(plan, workers):
+    """Produit les blocs dans l'ordre, générés en parallèle si workers > 1"""
+    if workers <= 1:
+        for chunk in range(plan.chunks):
+            yield generate_chunk(plan, chunk)
+        return
+    # Les connexions ne doivent pas être partagées avec les processus enfants
+    connections.close_all()
+    with multiprocessing.Pool(workers, initializer=django.setup) as pool:
+        # Fenêtre bornée de blocs en attente : la mémoire ne dépend pas du volume total
+        pending = deque()
+        for chunk in range(plan.chunks):
+            pending.append(pool.apply_async(generate_chunk, (plan, chunk)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def generate_chunk(plan, chunk):
+    """Génère les lignes d'un bloc de patients sous forme de dictionnaires de champs"""
+    rng = random.Random(f'{plan.seed}-{chunk}')
+    rows = {key: [] for key, _ in CHUNK_MODELS}
+    ids = plan.first_ids
+    first = chunk * plan.chunk_size
+    for i in range(first, min(first + plan.chunk_size, plan.patients)):
+        patient_id = ids['patients'] + i
+        rows['patients'].append(dict(
+            id=patient_id, nom=rng.choice(NOMS), prenom=rng.choice(PRENOMS),
+            date_naissance=date(1940, 1, 1) + timedelta(days=rng.randint(0, 30000)),
+            genre=rng.choice('MF'), adresse=rng.choice(VILLES), telephone=f'77{patient_id:07d}',
+            email=f'patient{patient_id}@example.sn', numero_secu=f'SN{patient_id:012d}',
+            statut=rng.choice(['actif'] * 9 + ['inactif']), date_enregistrement=plan.start,
+            date_modification=plan.start,
+        ))
+        for j in range(plan.rdv_per_patient):
+            # Un index global par rendez-vous garantit des créneaux disjoints par médecin
+            k = i * plan.rdv_per_patient + j
+            slot = (k // plan.doctors) * plan.slot_stride
+            date_heure = plan.start + timedelta(days=slot // CRENEAUX_PAR_JOUR,
+                                                minutes=30 * (slot % CRENEAUX_PAR_JOUR))
+            medecin_id = plan.first_medecin + k % plan.doctors
+            if date_heure > plan.now:
+                statut = 'confirme'
+            else:
+                statut = rng.choice(['complete', 'complete', 'complete', 'annule'])
+            rdv_id = ids['rendez_vous'] + k
+            rows['rendez_vous'].append(dict(
+                id=rdv_id, patient_id=patient_id, medecin_id=medecin_id, date_heure=date_heure, duree=30,
+                date_fin=date_heure + timedelta(minutes=30),
+                motif=rng.choice(MOTIFS), statut=statut, date_creation=date_heure - timedelta(days=7),
+                date_modification=date_heure - timedelta(days=7),
+            ))
+            if statut != 'complete':
+                continue
+            consultation_id = ids['consultations'] + k
+            rows['consultations'].append(dict(
+                id=consultation_id, patient_id=patient_id, medecin_id=medecin_id, rendez_vous_id=rdv_id,
+                date_consultation=date_heure, diagnostic='Examen clinique normal', traitement='Repos',
+                statut='complete',
+            ))
+            rows['ordonnances'].append(dict(
+                id=ids['ordonnances'] + k, consultation_id=consultation_id, patient_id=patient_id,
+                medecin_id=medecin_id, date_ordonnance=date_heure,
+                date_expiration=date_heure.date() + timedelta(days=30), instructions='Selon prescription',
+            ))
+            rows['ordonnance_medicaments'].append(dict(
+                id=ids['ordonnance_medicaments'] + k, ordonnance_id=ids['ordonnances'] + k,
+                medicament_id=plan.first_medicament + rng.randrange(plan.medicaments), dosage='1 comprimé',
+                frequence=rng.choice(['1x/jour', '2x/jour', '3x/jour']), duree=f'{rng.randint(5, 14)} jours',
+            ))
+            montant = Decimal(rng.randint(5, 50) * 1000)
+            paye = rng.choice([montant, montant / 2, Decimal(0)])
+            rows['facturations'].append(dict(
+                id=ids['facturations'] + k, patient_id=patient_id, consultation_id=consultation_id,
+                montant=montant, montant_paye=paye, date_facturation=date_heure.date(),
+                date_echeance=date_heure.date() + timedelta(days=30), description='Consultation',
+                statut='paye' if paye == montant else 'partiel' if paye else 'impaye',
+            ))
+    return rows
@@ -1,8 +1,200 @@
+from datetime import date, timedelta
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import (Case, DecimalField, ExpressionWrapper, F, IntegerField, ManyToOneRel, Prefetch, Q,
+                              Value, When)
+from django.db.models.functions import ExtractYear
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from . import metrics
+from .cache import CachedPrimaryKeyRelatedField, ReferenceField
 from .models import (Patient, Medecin, Consultation, Medicament, Facturation, 
-                     RendezVous, Ordonnance, OrdonnanceMedicament)
+                     RendezVous, Ordonnance, OrdonnanceMedicament, PlageHoraire)
+from .overlaps import NoOverlapValidator
+
+
+def collect_eager_loading(serializer, prefix=''):
+    """Retourne les chemins select_related et les Prefetch requis par les serializers imbriqués"""
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path = prefix + field.source.replace('.', '__')
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            queryset = child.Meta.model._default_manager.all()
+            if isinstance(child, EagerLoadingMixin):
+                queryset = child.apply_eager_loading(queryset, required=remote_fields(serializer, field.source))
+            prefetch.append(Prefetch(path, queryset=queryset))
+        elif isinstance(field, serializers.ManyRelatedField):
+            # Relation multiple rendue par ses identifiants (?expand= sans elle)
+            related = serializer.Meta.model._meta.get_field(field.source).related_model
+            columns = [related._meta.pk.name, *remote_fields(serializer, field.source)]
+            prefetch.append(Prefetch(path, queryset=related._default_manager.only(*columns)))
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(path)
+            nested_select, nested_prefetch = collect_eager_loading(field, path + '__')
+            select.extend(nested_select)
+            prefetch.extend(nested_prefetch)
+    return select, prefetch
+
+
+def remote_fields(serializer, source):
+    """Clé étrangère des objets liés vers le serializer, nécessaire au prefetch"""
+    relation = serializer.Meta.model._meta.get_field(source)
+    return [relation.field.name] if isinstance(relation, ManyToOneRel) else []
+
+
+def collect_columns(serializer, prefix=''):
+    """Colonnes à charger (``only()``) pour les champs retenus, ou None si elles ne peuvent être déduites"""
+    model = serializer.Meta.model
+    dependencies = getattr(serializer.Meta, 'sparse_dependencies', {})
+    columns = [prefix + model._meta.pk.name]
+    for name, field in serializer.fields.items():
+        if field.write_only or isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+            continue
+        if name in dependencies:
+            columns.extend(prefix + column for column in dependencies[name])
+            continue
+        if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+            return None
+        source = field.source.replace('.', '__')
+        if isinstance(field, serializers.BaseSerializer):
+            nested = collect_columns(field, f'{prefix}{source}__')
+            if nested is None:
+                return None
+            columns += [prefix + source, *nested]
+            continue
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete:
+            return None
+        columns.append(prefix + source)
+    return list(dict.fromkeys(columns))
+
+
+def parse_field_paths(value):
+    """``id,patient.nom,patient.prenom`` -> ``{'id': {}, 'patient': {'nom': {}, 'prenom': {}}}``"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class SparseFieldsMixin:
+    """Champs choisis (``?fields=id,patient.nom``) et relations imbriquées à la demande (``?expand=patient``).
+
+    Ne s'applique qu'aux lectures. Sans ces paramètres, la représentation est complète ; avec l'un
+    d'eux, seules les relations nommées dans ``expand``, ou par un chemin ``patient.nom`` dans
+    ``fields``, sont imbriquées : les autres sont rendues par leur identifiant.
+    ``Meta.sparse_dependencies`` indique les colonnes lues par les champs calculés.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = self.sparse_spec()
+        if spec is None:
+            return fields
+        wanted, expand = spec
+        pruned = {}
+        for name, field in fields.items():
+            if wanted is not None and name not in wanted and not field.write_only:
+                continue
+            nested = wanted.get(name) if wanted else None
+            if isinstance(field, ReferenceField) and nested:
+                field.only = list(nested)
+            elif isinstance(field, (serializers.BaseSerializer, ReferenceField)) and not (nested or name in expand):
+                field = self.id_field(name, field)
+            pruned[name] = field
+        return pruned
+
+    def sparse_spec(self):
+        """(champs demandés ou None pour tous, relations à imbriquer) au niveau de ce serializer"""
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        params = request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None
+        wanted = parse_field_paths(params['fields']) if 'fields' in params else None
+        expand = parse_field_paths(params.get('expand', ''))
+        for name in self.sparse_path():
+            wanted = (wanted or {}).get(name) or None
+            expand = expand.get(name, {})
+        return wanted, expand
+
+    def sparse_path(self):
+        path, node = [], self
+        while node.parent is not None:
+            if not isinstance(node.parent, serializers.ListSerializer):
+                path.insert(0, node.field_name)
+            node = node.parent
+        return path
+
+    @staticmethod
+    def id_field(name, field):
+        kwargs = {'source': field.source} if field.source not in (None, name) else {}
+        if isinstance(field, ReferenceField):
+            return serializers.ReadOnlyField(**kwargs)
+        return serializers.PrimaryKeyRelatedField(read_only=True, many=isinstance(field, serializers.ListSerializer),
+                                                  **kwargs)
 
-class PatientSerializer(serializers.ModelSerializer):
+
+class EagerLoadingMixin(SparseFieldsMixin):
+    """Déduit select_related/prefetch_related des relations déclarées par le serializer.
+
+    Chaque serializer imbriqué (``PatientSerializer(read_only=True)``...) devient un
+    ``select_related`` et chaque serializer ``many=True`` un ``Prefetch``, de sorte
+    qu'une liste s'exécute en un nombre constant de requêtes. Avec ``?fields=``, seules les
+    colonnes des champs retenus sont lues (``only()``).
+    """
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return cls().apply_eager_loading(queryset)
+
+    def to_representation(self, instance):
+        # Temps de sérialisation de l'endpoint (api/metrics.py), compté au niveau le plus externe
+        with metrics.serialization():
+            return super().to_representation(instance)
+
+    def apply_eager_loading(self, queryset, required=()):
+        select, prefetch = collect_eager_loading(self)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        spec = self.sparse_spec()
+        if spec is not None and spec[0] is not None:
+            columns = collect_columns(self)
+            if columns is not None:
+                queryset = queryset.only(*columns, *required)
+        return queryset
+
+def age_expression(prefix=''):
+    """Âge en années révolues calculé par la base, comme PatientSerializer.get_age"""
+    today = date.today()
+    naissance = prefix + 'date_naissance'
+    avant_anniversaire = (Q(**{f'{naissance}__month__gt': today.month})
+                          | Q(**{f'{naissance}__month': today.month, f'{naissance}__day__gt': today.day}))
+    return ExpressionWrapper(
+        Value(today.year) - ExtractYear(naissance) - Case(When(avant_anniversaire, then=Value(1)), default=Value(0)),
+        output_field=IntegerField(),
+    )
+
+
+def solde_expression(prefix=''):
+    """Solde d'une facture calculé par la base, comme FacturationSerializer.get_solde"""
+    return ExpressionWrapper(F(prefix + 'montant') - F(prefix + 'montant_paye'),
+                             output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+class PatientSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     age = serializers.SerializerMethodField()
     
     class Meta:
@@ -10,34 +202,61 @@ class PatientSerializer(serializers.ModelSerializer):
         fields = ['id', 'nom', 'prenom', 'age', 'date_naissance', 'genre', 'adresse', 
                   'telephone', 'email', 'numero_secu', 'statut', 'date_enregistrement', 'notes']
         read_only_fields = ['date_enregistrement']
+        sparse_dependencies = {'age': ['date_naissance']}
+        # Chemin de lecture compilé (api/compiled.py)
+        sql_annotations = {'age': age_expression}
     
     def get_age(self, obj):
-        from datetime import date
         today = date.today()
         return today.year - obj.date_naissance.year - ((today.month, today.day) < (obj.date_naissance.month, obj.date_naissance.day))
 
-class MedecinSerializer(serializers.ModelSerializer):
+class MedecinSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Medecin
         fields = ['id', 'nom', 'prenom', 'specialite', 'telephone', 'email', 'numero_licence', 'adresse_cabinet', 'date_ajout']
         read_only_fields = ['date_ajout']
 
-class RendezVousSerializer(serializers.ModelSerializer):
+class PlageHoraireSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    medecin = ReferenceField(MedecinSerializer, source='medecin_id')
+    medecin_id = CachedPrimaryKeyRelatedField(queryset=Medecin.objects.all(), source='medecin', write_only=True)
+
+    class Meta:
+        model = PlageHoraire
+        fields = ['id', 'medecin', 'medecin_id', 'jour_semaine', 'heure_debut', 'heure_fin', 'duree_creneau']
+
+    def validate(self, attrs):
+        debut = attrs.get('heure_debut', getattr(self.instance, 'heure_debut', None))
+        fin = attrs.get('heure_fin', getattr(self.instance, 'heure_fin', None))
+        if debut is not None and fin is not None and fin <= debut:
+            raise serializers.ValidationError({'heure_fin': "L'heure de fin doit suivre l'heure de début"})
+        return attrs
+
+class RendezVousSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     patient = PatientSerializer(read_only=True)
-    medecin = MedecinSerializer(read_only=True)
+    medecin = ReferenceField(MedecinSerializer, source='medecin_id')
     patient_id = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all(), source='patient', write_only=True)
-    medecin_id = serializers.PrimaryKeyRelatedField(queryset=Medecin.objects.all(), source='medecin', write_only=True)
+    medecin_id = CachedPrimaryKeyRelatedField(queryset=Medecin.objects.all(), source='medecin', write_only=True)
 
     class Meta:
         model = RendezVous
-        fields = ['id', 'patient', 'patient_id', 'medecin', 'medecin_id', 'date_heure', 'motif', 'statut', 'notes', 'date_creation']
+        fields = ['id', 'patient', 'patient_id', 'medecin', 'medecin_id', 'date_heure', 'duree', 'date_fin', 'motif',
+                  'statut', 'notes', 'date_creation']
         read_only_fields = ['date_creation']
+        validators = [NoOverlapValidator()]
+
+    def validate(self, attrs):
+        # date_fin est aussi écrite par bulk_create/bulk_update, qui n'appellent pas save()
+        if 'date_heure' in attrs or 'duree' in attrs:
+            debut = attrs.get('date_heure', getattr(self.instance, 'date_heure', None))
+            duree = attrs.get('duree', getattr(self.instance, 'duree', RendezVous._meta.get_field('duree').default))
+            attrs['date_fin'] = debut + timedelta(minutes=duree)
+        return attrs
 
-class ConsultationSerializer(serializers.ModelSerializer):
+class ConsultationSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     patient = PatientSerializer(read_only=True)
-    medecin = MedecinSerializer(read_only=True)
+    medecin = ReferenceField(MedecinSerializer, source='medecin_id')
     patient_id = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all(), source='patient', write_only=True)
-    medecin_id = serializers.PrimaryKeyRelatedField(queryset=Medecin.objects.all(), source='medecin', write_only=True)
+    medecin_id = CachedPrimaryKeyRelatedField(queryset=Medecin.objects.all(), source='medecin', write_only=True)
     rendez_vous_id = serializers.PrimaryKeyRelatedField(queryset=RendezVous.objects.all(), source='rendez_vous', write_only=True, required=False)
 
     class Meta:
@@ -46,24 +265,24 @@ class ConsultationSerializer(serializers.ModelSerializer):
                   'date_consultation', 'diagnostic', 'traitement', 'statut', 'notes_supplementaires']
         read_only_fields = ['date_consultation']
 
-class MedicamentSerializer(serializers.ModelSerializer):
+class MedicamentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Medicament
         fields = ['id', 'nom', 'description', 'prix', 'composition', 'dosage', 'fabricant', 'date_creation']
         read_only_fields = ['date_creation']
 
-class OrdonnanceMedicamentSerializer(serializers.ModelSerializer):
-    medicament = MedicamentSerializer(read_only=True)
-    medicament_id = serializers.PrimaryKeyRelatedField(queryset=Medicament.objects.all(), source='medicament', write_only=True)
+class OrdonnanceMedicamentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    medicament = ReferenceField(MedicamentSerializer, source='medicament_id')
+    medicament_id = CachedPrimaryKeyRelatedField(queryset=Medicament.objects.all(), source='medicament', write_only=True)
 
     class Meta:
         model = OrdonnanceMedicament
         fields = ['id', 'medicament', 'medicament_id', 'dosage', 'frequence', 'duree', 'notes']
 
-class OrdonnanceSerializer(serializers.ModelSerializer):
+class OrdonnanceSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     medicaments = OrdonnanceMedicamentSerializer(many=True, read_only=True)
     patient = PatientSerializer(read_only=True)
-    medecin = MedecinSerializer(read_only=True)
+    medecin = ReferenceField(MedecinSerializer, source='medecin_id')
     consultation_id = serializers.PrimaryKeyRelatedField(queryset=Consultation.objects.all(), source='consultation', write_only=True)
 
     class Meta:
@@ -72,7 +291,7 @@ class OrdonnanceSerializer(serializers.ModelSerializer):
                   'date_expiration', 'instructions', 'notes', 'medicaments']
         read_only_fields = ['date_ordonnance', 'patient', 'medecin']
 
-class FacturationSerializer(serializers.ModelSerializer):
+class FacturationSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     patient = PatientSerializer(read_only=True)
     patient_id = serializers.PrimaryKeyRelatedField(queryset=Patient.objects.all(), source='patient', write_only=True)
     solde = serializers.SerializerMethodField()
@@ -82,6 +301,8 @@ class FacturationSerializer(serializers.ModelSerializer):
         fields = ['id', 'patient', 'patient_id', 'montant', 'montant_paye', 'solde', 
                   'date_facturation', 'date_echeance', 'statut', 'description', 'notes']
         read_only_fields = ['date_facturation']
+        sparse_dependencies = {'solde': ['montant', 'montant_paye']}
+        sql_annotations = {'solde': solde_expression}
     
     def get_solde(self, obj):
         return obj.montant - obj.montant_paye
@@ -0,0 +1,152 @@
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import (authentication, availability, cache, metrics, overlaps, replicas, rollups, search, slowqueries,
+               versioning)
+from .models import (Patient, Medecin, RendezVous, Consultation, Medicament, Ordonnance,
+                     OrdonnanceMedicament, Facturation, PlageHoraire)
+
+# Envoyés par api/bulk.py, dont bulk_create/bulk_update n'envoient pas post_save.
+# post_bulk_create : instances ; post_bulk_update : instances, previous (versions relues sous verrou avant modification)
+post_bulk_create = Signal()
+post_bulk_update = Signal()
+
+
+@receiver(pre_save, sender=Facturation)
+def memoriser_facture(sender, instance, raw=False, **kwargs):
+    """Mémorise la version enregistrée de la facture pour calculer la différence.
+
+    La ligne est verrouillée jusqu'au commit (Facturation.save ouvre la transaction) : deux
+    modifications concurrentes de la même facture calculent leur différence l'une après l'autre.
+    """
+    instance._rollup_old = None
+    if raw or instance.pk is None:
+        return
+    old = (sender.objects.using(kwargs.get('using')).select_for_update().filter(pk=instance.pk)
+           .values(*rollups.Contribution._fields).first())
+    if old is not None:
+        instance._rollup_old = rollups.Contribution(**old)
+
+
+@receiver(post_save, sender=Facturation)
+def agreger_facture(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rollups.apply_change(old=getattr(instance, '_rollup_old', None), new=rollups.contribution_of(instance))
+    instance._rollup_old = None
+
+
+@receiver(post_delete, sender=Facturation)
+def retirer_facture(sender, instance, **kwargs):
+    rollups.apply_change(old=rollups.contribution_of(instance))
+
+
+@receiver(post_bulk_create, sender=Facturation)
+def agreger_factures_creees(sender, instances, **kwargs):
+    rollups.apply_changes((None, rollups.contribution_of(facture)) for facture in instances)
+
+
+@receiver(post_bulk_update, sender=Facturation)
+def agreger_factures_modifiees(sender, instances, previous, **kwargs):
+    rollups.apply_changes((rollups.contribution_of(old), rollups.contribution_of(new))
+                          for old, new in zip(previous, instances))
+
+
+# Tables servies par l'API dont les écritures changent les ETag (api/versioning.py)
+VERSIONED_MODELS = [Patient, Medecin, RendezVous, Consultation, Medicament, Ordonnance, OrdonnanceMedicament,
+                    Facturation, PlageHoraire]
+
+
+def versionner(sender, **kwargs):
+    versioning.changed(sender)
+
+
+for model in VERSIONED_MODELS:
+    for signal in (post_save, post_delete, post_bulk_create, post_bulk_update):
+        signal.connect(versionner, sender=model, dispatch_uid=f'versionner-{model._meta.label}')
+
+
+# Versions lues une seule fois par requête (api/versioning.py)
+request_started.connect(versioning.start_request, dispatch_uid='versions-start-request')
+request_finished.connect(versioning.end_request, dispatch_uid='versions-end-request')
+
+# Requêtes SQL comptées par endpoint (api/metrics.py)
+connection_created.connect(metrics.instrument, dispatch_uid='metrics-instrument')
+
+# Requêtes lentes et leur plan (api/slowqueries.py)
+connection_created.connect(slowqueries.instrument, dispatch_uid='slow-queries-instrument')
+
+
+@receiver(request_finished, dispatch_uid='slow-queries-flush')
+def enregistrer_requetes_lentes(sender, **kwargs):
+    if not settings.SLOW_QUERY_BACKGROUND:
+        slowqueries.flush()
+
+# Chaque requête commence sur la base principale (api/replicas.py)
+request_started.connect(replicas.reset, dispatch_uid='replicas-reset')
+request_finished.connect(replicas.reset, dispatch_uid='replicas-reset-end')
+
+
+def rafraichir_cache(sender, signal, instance=None, instances=None, created=False, **kwargs):
+    """Répercute les écritures sur le cache de référence de ce processus (api/cache.py)"""
+    created = created or signal is post_bulk_create
+    cache.invalidate(sender, [instance] if instances is None else instances, created=created)
+
+
+for model in cache.REFERENCE_MODELS:
+    for signal in (post_save, post_delete, post_bulk_create, post_bulk_update):
+        signal.connect(rafraichir_cache, sender=model, dispatch_uid=f'cache-{model._meta.label}')
+
+
+def rafraichir_plages(sender, **kwargs):
+    """Les plages horaires modifiées par ce processus sont relues à la recherche suivante (api/availability.py)"""
+    availability.invalidate()
+
+
+for signal in (post_save, post_delete, post_bulk_create, post_bulk_update):
+    signal.connect(rafraichir_plages, sender=PlageHoraire, dispatch_uid='plages-horaires')
+
+
+def oublier_utilisateur(sender, instance, update_fields=None, **kwargs):
+    """Utilisateur modifié ou supprimé : il est relu à sa requête suivante (api/authentication.py)"""
+    # La date de dernière connexion (UPDATE_LAST_LOGIN) ne change pas l'authentification
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    authentication.forget(instance.pk)
+
+
+def oublier_permissions(sender, instance, action, **kwargs):
+    """Groupes ou permissions modifiés : l'utilisateur concerné, ou tous depuis un groupe ou une permission"""
+    if action.startswith('post_'):
+        authentication.forget(instance.pk if isinstance(instance, User) else None)
+
+
+def oublier_utilisateurs(sender, **kwargs):
+    authentication.forget()
+
+
+post_save.connect(oublier_utilisateur, sender=User, dispatch_uid='auth-user-save')
+post_delete.connect(oublier_utilisateur, sender=User, dispatch_uid='auth-user-delete')
+for model in (Group, Permission):
+    post_delete.connect(oublier_utilisateurs, sender=model, dispatch_uid=f'auth-{model._meta.label}')
+for through in (User.groups.through, User.user_permissions.through, Group.permissions.through):
+    m2m_changed.connect(oublier_permissions, sender=through, dispatch_uid=f'auth-{through._meta.label}')
+
+
+@receiver(post_migrate, dispatch_uid='overlaps-install')
+def installer_chevauchements(sender, using='default', **kwargs):
+    """Recrée les triggers anti-chevauchement qu'une reconstruction de table SQLite a supprimés"""
+    if sender.name == 'api':
+        overlaps.install(connections[using])
+
+
+@receiver(post_migrate, dispatch_uid='search-repair')
+def reparer_recherche(sender, using='default', **kwargs):
+    """Recrée les index plein texte et triggers de recherche qu'une reconstruction de table SQLite a supprimés"""
+    if sender.name == 'api':
+        search.repair(connections[using])
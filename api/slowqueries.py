@@ -0,0 +1,227 @@
+"""Journal des requêtes SQL lentes, avec leur plan d'exécution.
+
+Toute requête qui dure au moins ``SLOW_QUERY_THRESHOLD_MS`` (0 : journal désactivé) est relevée par
+le wrapper d'exécution des connexions (``instrument``) : SQL, paramètres, base, vue de la requête
+HTTP en cours et pile d'appels du projet. Le relevé est mis en file ; un thread du processus lance
+``EXPLAIN`` (PostgreSQL : ``EXPLAIN (FORMAT JSON)``, SQLite : ``EXPLAIN QUERY PLAN``) sur la même
+base et l'enregistre, hors du chemin de la requête. Sans ``SLOW_QUERY_BACKGROUND``, la file est
+vidée à la fin de la requête HTTP (``flush``), jamais pendant l'exécution d'une requête SQL dont le
+curseur est encore ouvert.
+
+Les requêtes sont regroupées par empreinte (SQL dont les littéraux et les listes ``IN`` sont
+normalisés) dans RequeteLente, qui cumule occurrences et durées et garde la dernière occurrence. Le
+plan est calculé une fois par empreinte. Seules les ``SLOW_QUERY_MAX_ENTRIES`` empreintes les plus
+coûteuses (durée cumulée) sont gardées ; le rapport se consulte dans l'admin.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import metrics
+from .models import RequeteLente
+
+logger = logging.getLogger(__name__)
+
+# Relevés en attente d'EXPLAIN ; au-delà, les nouveaux relevés sont abandonnés
+_pending = queue.Queue(maxsize=1000)
+_worker = None
+_worker_lock = threading.Lock()
+
+# Vrai pendant l'enregistrement d'un relevé : ses propres requêtes ne sont pas relevées
+_recording = threading.local()
+
+# Contrôle de transaction : sans plan, et relevé hors transaction impossible au milieu d'un BEGIN
+SKIPPED = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+# Longueur maximale des paramètres et de la pile gardés
+MAX_TEXT = 4000
+STACK_DEPTH = 12
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.IGNORECASE), 'IN (...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """Empreinte du SQL, identique quels que soient les valeurs et le nombre d'éléments des listes IN"""
+    normalized = sql
+    for pattern, replacement in _LITERALS:
+        normalized = pattern.sub(replacement, normalized)
+    return hashlib.sha1(normalized.strip().encode()).hexdigest()
+
+
+def instrument(sender, connection, **kwargs):
+    """Ajoute le relevé des requêtes lentes à une connexion (signal connection_created)"""
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def _execute(execute, sql, params, many, context):
+    threshold = settings.SLOW_QUERY_THRESHOLD_MS
+    if not threshold or getattr(_recording, 'active', False):
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms >= threshold and not sql.lstrip().upper().startswith(SKIPPED):
+        capture(context['connection'].alias, sql, params, many, duration_ms)
+    return result
+
+
+def project_stack():
+    """Pile d'appels limitée au code du projet (hors Django et bibliothèques)"""
+    base = str(settings.BASE_DIR)
+    frames = [frame for frame in traceback.extract_stack()[:-3]
+              if frame.filename.startswith(base) and 'site-packages' not in frame.filename
+              and not frame.filename.endswith(os.path.join('api', 'slowqueries.py'))]
+    return ''.join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+
+def current_view():
+    request = metrics.current_request()
+    if request is None:
+        return ''
+    return f'{metrics.endpoint_of(request)} {request.method} {request.path}'[:255]
+
+
+def capture(alias, sql, params, many, duration_ms):
+    entry = {
+        'alias': alias, 'sql': sql, 'params': None if many else params, 'many': many,
+        'duration_ms': duration_ms, 'view': current_view(), 'stack': project_stack(), 'at': timezone.now(),
+    }
+    try:
+        _pending.put_nowait(entry)
+    except queue.Full:
+        return
+    if settings.SLOW_QUERY_BACKGROUND:
+        _ensure_worker()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or _worker.pid != os.getpid():
+            _worker = threading.Thread(target=_run, name='slow-query-recorder', daemon=True)
+            _worker.pid = os.getpid()
+            _worker.start()
+
+
+def _run():
+    global _worker
+    while True:
+        with _worker_lock:
+            if _pending.empty():
+                # Le thread s'arrête avec la file : capture() en relance un au relevé suivant
+                _worker = None
+                break
+        entry = _pending.get()
+        try:
+            record(entry)
+        except Exception:
+            logger.exception('Requête lente non enregistrée')
+        finally:
+            _pending.task_done()
+    # Pas de connexion gardée ouverte par le thread entre deux relevés
+    connections.close_all()
+
+
+def explain(alias, sql, params):
+    """Plan d'exécution de la requête, ou '' si la base ou l'instruction ne s'y prête pas"""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return ''
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN (FORMAT JSON) '
+    elif connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        return ''
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as exc:
+        return f'EXPLAIN impossible : {exc}'
+    if connection.vendor == 'postgresql':
+        plan = rows[0][0]
+        # psycopg décode déjà le JSON du plan
+        return plan if isinstance(plan, str) else json.dumps(plan, indent=2)
+    # SQLite : (id, parent, notused, detail)
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def record(entry):
+    """Cumule le relevé dans RequeteLente (plan calculé à la première occurrence)"""
+    _recording.active = True
+    try:
+        empreinte = fingerprint(entry['sql'])
+        known = RequeteLente.objects.filter(empreinte=empreinte).values_list('plan', flat=True).first()
+        fields = {
+            'sql': entry['sql'],
+            'parametres': repr(entry['params'])[:MAX_TEXT] if entry['params'] is not None else '',
+            'base': entry['alias'],
+            'vue': entry['view'],
+            'pile': entry['stack'][-MAX_TEXT:],
+            'date_derniere': entry['at'],
+        }
+        if not known and not entry['many']:
+            fields['plan'] = explain(entry['alias'], entry['sql'], entry['params'])
+        duration = entry['duration_ms']
+        rows = RequeteLente.objects.filter(empreinte=empreinte)
+        if rows.update(nombre=F('nombre') + 1, duree_totale_ms=F('duree_totale_ms') + duration,
+                       duree_max_ms=Greatest(F('duree_max_ms'), duration), **fields):
+            return
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                RequeteLente.objects.create(empreinte=empreinte, nombre=1, duree_totale_ms=duration,
+                                            duree_max_ms=duration, date_premiere=entry['at'], **fields)
+        except IntegrityError:
+            # Créée entre-temps par un autre processus
+            rows.update(nombre=F('nombre') + 1, duree_totale_ms=F('duree_totale_ms') + duration,
+                        duree_max_ms=Greatest(F('duree_max_ms'), duration), **fields)
+            return
+        trim()
+    finally:
+        _recording.active = False
+
+
+def trim():
+    """Ne garde que les SLOW_QUERY_MAX_ENTRIES empreintes à la plus forte durée cumulée"""
+    extra = list(RequeteLente.objects.order_by('-duree_totale_ms', '-date_derniere')
+                 .values_list('pk', flat=True)[settings.SLOW_QUERY_MAX_ENTRIES:])
+    if extra:
+        RequeteLente.objects.filter(pk__in=extra).delete()
+
+
+def flush():
+    """Enregistre dans le thread courant les relevés en file (sans SLOW_QUERY_BACKGROUND : fin de requête)"""
+    while True:
+        try:
+            entry = _pending.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            record(entry)
+        finally:
+            _pending.task_done()
+
+
+def wait():
+    """Attend l'enregistrement des relevés en file par le thread du processus"""
+    _pending.join()
@@ -1,10 +1,70 @@
-from django.contrib.auth.models import User
-from django.urls import reverse
-from rest_framework.test import APITestCase, APIClient
-from rest_framework import status
-from datetime import date, datetime, timedelta
+import asyncio
+import csv
+import importlib
+import json
+import os
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
 
-from .models import Patient, Medecin, RendezVous, Consultation, Medicament, Facturation, Ordonnance
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, Permission, User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, include, path, resolve, reverse
+from django.urls.resolvers import RegexPattern
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework import status, viewsets
+from rest_framework.request import Request
+from rest_framework.routers import DefaultRouter
+from rest_framework.validators import UniqueValidator
+from rest_framework_simplejwt.tokens import AccessToken
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from .models import (Patient, Medecin, RendezVous, Consultation, Medicament, Facturation, Ordonnance,
+                     OrdonnanceMedicament, Paiement, PlageHoraire, StatistiqueFacturation, JetonRevoque,
+                     RequeteLente)
+from . import (authentication, availability, benchmarks, blacklist, bulk, cache, compiled, metrics, overlaps,
+               replicas, rollups, signals, slowqueries, throttling, versioning)
+from .indexing import is_covered, propose_indexes
+from .mixins import CompiledListMixin
+from .routers import HospitalRouter
+from .seeding import seed_dataset
+from .serializers import FacturationSerializer, OrdonnanceSerializer, PatientSerializer
+from .urls import router
+from .views import MedicamentViewSet, OrdonnanceViewSet, PatientViewSet
+
+_throttle_dir = tempfile.TemporaryDirectory()
+# Throttle counters of this run only, not those left in the project's store by earlier runs
+_throttle_store = override_settings(THROTTLE_STORE={'BACKEND': 'api.throttling.SQLiteStore',
+                                                    'LOCATION': os.path.join(_throttle_dir.name, 'throttle.sqlite3')},
+                                   # Query budgets must not depend on how slow the test machine is
+                                   SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_BACKGROUND=False,
+                                   AUTH_USER_CHECK_SECONDS=3600)
+
+# The whole suite logs in from one address
+_token_rate = mock.patch.dict(throttling.ScopedThrottle.THROTTLE_RATES, {'token': '1000/minute'})
+
+
+def setUpModule():
+    _throttle_store.enable()
+    _token_rate.start()
+
+
+def tearDownModule():
+    _token_rate.stop()
+    _throttle_store.disable()
+    _throttle_dir.cleanup()
 
 
 class APISmokeTests(APITestCase):
@@ -168,7 +228,7 @@ class APISmokeTests(APITestCase):
             'motif': 'Another'
         }
         resp = self.client.post('/api/rendez-vous/', payload, format='json')
-        # Model enforces unique_together; DRF returns 400
+        # Overlap with the existing appointment (api/overlaps.py); DRF returns 400
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_ajouter_medicament_to_ordonnance(self):
@@ -188,3 +248,1697 @@ class APISmokeTests(APITestCase):
         add_payload = {'medicament_id': self.medicament.id, 'dosage': '10mg', 'frequence': '2x/jour', 'duree': '5 jours'}
         resp = self.client.post(f'/api/ordonnances/{ordonnance_id}/ajouter_medicament/', add_payload, format='json')
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+class EagerLoadingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='eager', password='eager123')
+        self.client.force_authenticate(self.user)
+        self.medicament = Medicament.objects.create(
+            nom='Paracetamol', description='Analgésique', prix=3, dosage='1000mg', fabricant='LabY'
+        )
+        self.counter = 0
+
+    def create_dossier(self):
+        # one patient/doctor pair with rdv, consultation, ordonnance and invoice
+        self.counter += 1
+        n = self.counter
+        patient = Patient.objects.create(
+            nom=f'Patient{n}', prenom='Test', date_naissance=date(1980, 1, 1),
+            adresse='Dakar', telephone='770000000', email=f'patient{n}@example.com'
+        )
+        medecin = Medecin.objects.create(
+            nom=f'Medecin{n}', prenom='Test', specialite='cardiologie', telephone='780000000',
+            email=f'medecin{n}@example.com', numero_licence=f'LIC-E{n}', adresse_cabinet='Cabinet'
+        )
+        rdv = RendezVous.objects.create(
+            patient=patient, medecin=medecin, date_heure=timezone.now() + timedelta(days=n), motif='Suivi'
+        )
+        consultation = Consultation.objects.create(
+            patient=patient, medecin=medecin, rendez_vous=rdv, diagnostic='RAS', traitement='Repos'
+        )
+        ordonnance = Ordonnance.objects.create(
+            consultation=consultation, patient=patient, medecin=medecin,
+            date_expiration=date.today(), instructions='Matin et soir'
+        )
+        OrdonnanceMedicament.objects.create(
+            ordonnance=ordonnance, medicament=self.medicament, dosage='1', frequence='2x/jour', duree='5 jours'
+        )
+        Facturation.objects.create(
+            patient=patient, consultation=consultation, montant=100, date_echeance=date.today(), description='Test'
+        )
+        return patient, medecin
+
+    def count_queries(self, url):
+        # Cache de référence chargé, comme en production après le préchargement de gunicorn
+        cache.warm()
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries)
+
+    def test_list_endpoints_run_constant_number_of_queries(self):
+        urls = ['/api/rendez-vous/', '/api/consultations/', '/api/facturations/', '/api/ordonnances/']
+        self.create_dossier()
+        baseline = {url: self.count_queries(url) for url in urls}
+        for _ in range(4):
+            self.create_dossier()
+        for url in urls:
+            self.assertEqual(self.count_queries(url), baseline[url], url)
+
+    def test_nested_actions_run_constant_number_of_queries(self):
+        patient, medecin = self.create_dossier()
+        urls = [f'/api/patients/{patient.id}/consultations/', f'/api/patients/{patient.id}/rendez_vous/',
+                f'/api/medecins/{medecin.id}/consultations/', f'/api/medecins/{medecin.id}/rendez_vous/']
+        baseline = {url: self.count_queries(url) for url in urls}
+        for _ in range(3):
+            other_patient, other_medecin = self.create_dossier()
+            RendezVous.objects.filter(patient=other_patient).update(patient=patient, medecin=medecin)
+            Consultation.objects.filter(patient=other_patient).update(patient=patient, medecin=medecin)
+        for url in urls:
+            self.assertEqual(self.count_queries(url), baseline[url], url)
+
+
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        seed_dataset(patients=30, doctors=3, medicaments=5, batch_size=10)
+        User.objects.create_user(username='budget', password='budget123')
+        benchmarks.authenticate(self.client, 'budget', 'budget123')
+
+    def test_every_endpoint_has_a_budget(self):
+        names = {endpoint.name for endpoint in benchmarks.iter_endpoints(router)}
+        self.assertEqual(names - set(benchmarks.QUERY_BUDGETS), set())
+
+    def test_endpoints_stay_within_query_budget(self):
+        for endpoint in benchmarks.iter_endpoints(router):
+            with self.subTest(endpoint=endpoint.name):
+                with CaptureQueriesContext(connection) as ctx:
+                    resp = benchmarks.call(self.client, endpoint)
+                self.assertLess(resp.status_code, 400)
+                self.assertLessEqual(benchmarks.count_queries(ctx.captured_queries),
+                                     benchmarks.QUERY_BUDGETS[endpoint.name])
+
+    def test_failed_call_raises_endpoint_error(self):
+        endpoint = next(benchmarks.iter_endpoints(router))
+        self.client.credentials()
+        with self.assertRaisesMessage(benchmarks.EndpointError, f'{endpoint.name}: HTTP 401'):
+            benchmarks.call(self.client, endpoint)
+
+    def test_compare_flags_regressions_beyond_threshold(self):
+        budget = benchmarks.QUERY_BUDGETS['patient-list']
+        baseline = {'patient-list': {'queries': budget, 'p50_ms': 10.0, 'p95_ms': 20.0, 'peak_kib': 100.0}}
+        ok = {'patient-list': {'queries': budget, 'p50_ms': 11.0, 'p95_ms': 21.0, 'peak_kib': 110.0}}
+        slow = {'patient-list': {'queries': budget + 1, 'p50_ms': 30.0, 'p95_ms': 21.0, 'peak_kib': 100.0}}
+        self.assertEqual(benchmarks.compare(ok, baseline, threshold=0.25), [])
+        self.assertEqual(len(benchmarks.compare(slow, baseline, threshold=0.25)), 3)
+
+
+class SeedDataScaleTests(APITestCase):
+    def test_scale_mode_bulk_inserts_consistent_dataset(self):
+        out = StringIO()
+        call_command('seed_data', patients=40, doctors=4, medications=5, years=0.5, batch_size=15, stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(Patient.objects.count(), 40)
+        self.assertEqual(Medecin.objects.count(), 4)
+        self.assertEqual(RendezVous.objects.count(), 120)
+        self.assertEqual(Facturation.objects.count(), Consultation.objects.filter(statut='complete').count())
+
+    def test_chunks_are_deterministic(self):
+        call_command('seed_data', patients=10, doctors=2, medications=3, batch_size=5, stdout=StringIO())
+        first = list(Patient.objects.order_by('id').values_list('nom', 'prenom', 'date_naissance'))
+        Patient.objects.all().delete()
+        Medecin.objects.all().delete()
+        call_command('seed_data', patients=10, doctors=2, medications=3, batch_size=5, stdout=StringIO())
+        second = list(Patient.objects.order_by('id').values_list('nom', 'prenom', 'date_naissance'))
+        self.assertEqual(first, second)
+
+    def test_rejects_calendar_overflow(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_data', patients=1000, doctors=1, years=0.01, stdout=StringIO())
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        # seeded patients all share the same date_enregistrement: the id tiebreaker is exercised
+        seed_dataset(patients=45, doctors=3, medicaments=3, batch_size=20)
+        self.client.force_authenticate(User.objects.create_user(username='keyset', password='keyset123'))
+
+    def walk(self, url):
+        pages = []
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.json()
+            self.assertNotIn('count', data)
+            pages.append(data)
+            url = data['next']
+        return pages
+
+    def test_cursor_walk_matches_ordering_without_duplicates(self):
+        for url, model, ordering in [('/api/patients/?cursor=', Patient, ['-date_enregistrement', '-id']),
+                                     ('/api/rendez-vous/?cursor=', RendezVous, ['-date_heure', '-id'])]:
+            pages = self.walk(url)
+            ids = [row['id'] for page in pages for row in page['results']]
+            self.assertEqual(ids, list(model.objects.order_by(*ordering).values_list('id', flat=True)))
+
+    def test_previous_cursor_returns_previous_page(self):
+        first = self.client.get('/api/patients/?cursor=').json()
+        second = self.client.get(first['next']).json()
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([r['id'] for r in back['results']], [r['id'] for r in first['results']])
+
+    def test_page_number_mode_unchanged_and_invalid_cursor(self):
+        resp = self.client.get('/api/patients/?page=2')
+        self.assertEqual(resp.json()['count'], 45)
+        resp = self.client.get('/api/patients/?cursor=not-a-cursor')
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # viewsets that do not opt in keep page number pagination
+        self.assertIn('count', self.client.get('/api/medicaments/?cursor=').json())
+
+
+class IndexAdvisorTests(APITestCase):
+    def test_current_viewsets_are_fully_indexed(self):
+        self.assertEqual(propose_indexes(router), [])
+        out = StringIO()
+        call_command('advise_indexes', stdout=out)
+        self.assertIn('covered', out.getvalue())
+
+    def test_proposes_filter_plus_ordering_composite(self):
+        class MotifViewSet(viewsets.ModelViewSet):
+            queryset = RendezVous.objects.all()
+            filterset_fields = ['motif', 'patient__nom']
+            ordering_fields = ['motif', 'date_heure']
+            ordering = ['-date_heure']
+
+        fake_router = DefaultRouter()
+        fake_router.register('motifs', MotifViewSet)
+        proposals = propose_indexes(fake_router)
+        # related lookups are ignored, ?ordering=motif is covered by the composite index
+        self.assertEqual([p.fields for p in proposals], [['motif', 'date_heure']])
+        self.assertTrue(proposals[0].as_index().name.startswith('api_rendezv_motif'))
+
+    def test_prefix_coverage(self):
+        self.assertTrue(is_covered(['statut'], [['statut', 'date_heure']]))
+        self.assertFalse(is_covered(['date_heure'], [['statut', 'date_heure']]))
+
+
+class FullTextSearchTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='search', password='search123'))
+        self.ndeye = Patient.objects.create(
+            nom='Diop', prenom='Ndèye', date_naissance=date(1990, 1, 1), adresse='Dakar',
+            telephone='771234567', email='ndeye.diop@example.com'
+        )
+        self.aissatou = Patient.objects.create(
+            nom='Bâ', prenom='Aïssatou', date_naissance=date(1985, 1, 1), adresse='Thiès',
+            telephone='772345678', email='aissatou.ba@example.com'
+        )
+
+    def search(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in resp.json()['results']]
+
+    def test_uses_fts_index_and_ignores_accents(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.search('/api/patients/?search=ndeye'), [self.ndeye.id])
+        self.assertTrue(any('api_patient_fts' in q['sql'] for q in ctx.captured_queries))
+        self.assertEqual(self.search('/api/patients/?search=AISSA'), [self.aissatou.id])
+        self.assertEqual(self.search('/api/patients/?search=ba aissatou'), [self.aissatou.id])
+
+    def test_substrings_match_like_ilike(self):
+        self.assertEqual(self.search('/api/patients/?search=1234'), [self.ndeye.id])
+        self.assertEqual(self.search('/api/patients/?search=iop'), [self.ndeye.id])
+        self.assertEqual(self.search('/api/patients/?search=DIOP@EXAMPLE'), [self.ndeye.id])
+        self.assertEqual(sorted(self.search('/api/patients/?search=23')), sorted([self.ndeye.id, self.aissatou.id]))
+        self.assertEqual(self.search('/api/patients/?search=iop 678'), [])
+
+    def test_triggers_dropped_by_a_table_rebuild_are_repaired_after_migrate(self):
+        with connection.cursor() as cursor:
+            for suffix in ('fts_ai', 'fts_trgm_ai'):
+                cursor.execute(f'DROP TRIGGER api_patient_{suffix}')
+        signals.reparer_recherche(sender=apps.get_app_config('api'), using='default')
+        sene = Patient.objects.create(nom='Sène', prenom='Awa', date_naissance=date(1990, 1, 1), adresse='Dakar',
+                                      telephone='780000000', email='awa.sene@example.com')
+        self.assertEqual(self.search('/api/patients/?search=sene'), [sene.id])
+        self.assertEqual(self.search('/api/patients/?search=8000'), [sene.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        Patient.objects.filter(pk=self.ndeye.pk).update(nom='Sène')
+        self.assertEqual(self.search('/api/patients/?search=sene'), [self.ndeye.id])
+        self.assertEqual(self.search('/api/patients/?search=diop'), [self.ndeye.id])  # still in the email
+        self.ndeye.delete()
+        self.assertEqual(self.search('/api/patients/?search=sene'), [])
+
+    def test_results_ranked_by_relevance(self):
+        Medicament.objects.create(nom='Doliprane', description='Paracétamol 1000mg', prix=2, dosage='1g', fabricant='Sanofi')
+        best = Medicament.objects.create(nom='Paracétamol', description='Paracétamol générique, paracétamol pur',
+                                         prix=1, dosage='500mg', fabricant='Pharma SN')
+        ids = self.search('/api/medicaments/?search=paracetamol')
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids[0], best.id)
+        # an explicit ?ordering= wins over relevance
+        self.assertEqual(self.search('/api/medicaments/?search=paracetamol&ordering=-prix')[0], ids[1])
+
+    def test_related_search_fields_keep_ilike(self):
+        medecin = Medecin.objects.create(nom='Fall', prenom='Awa', specialite='pediatrie', telephone='1',
+                                         email='awa.fall@example.com', numero_licence='LIC-S1', adresse_cabinet='X')
+        rdv = RendezVous.objects.create(patient=self.ndeye, medecin=medecin, date_heure=timezone.now(), motif='Suivi')
+        self.assertEqual(self.search('/api/rendez-vous/?search=Diop'), [rdv.id])
+
+
+class BillingRollupTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='compta', password='compta123')
+        self.client.force_authenticate(user=self.user)
+        self.patient = Patient.objects.create(nom='Sarr', prenom='Mariama', date_naissance=date(1985, 2, 2),
+                                              adresse='Dakar', telephone='1', email='mariama@example.com')
+        self.facture = Facturation.objects.create(patient=self.patient, montant=100, date_echeance=date.today(),
+                                                  description='Consultation')
+        Facturation.objects.create(patient=self.patient, montant=50, montant_paye=50, statut='paye',
+                                   date_echeance=date.today(), description='Analyses')
+
+    def expected(self):
+        factures = list(Facturation.objects.all())
+        total = sum(f.montant for f in factures)
+        paye = sum(f.montant_paye for f in factures)
+        return {
+            'total_facturation': float(total),
+            'total_paye': float(paye),
+            'total_impaye': float(total - paye),
+            'nombre_factures_impayees': sum(1 for f in factures if f.statut == 'impaye'),
+        }
+
+    def statistiques(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get('/api/facturations/statistiques/')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        return {key: float(value) if key != 'nombre_factures_impayees' else value
+                for key, value in resp.json().items()}
+
+    def test_statistics_follow_create_update_payment_and_delete(self):
+        self.assertEqual(self.statistiques(), self.expected())
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(f'/api/facturations/{self.facture.id}/enregistrer_paiement/', {'montant': '40'},
+                                    format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.statistiques(), self.expected())
+        self.client.patch(f'/api/facturations/{self.facture.id}/', {'montant': '120'}, format='json')
+        self.assertEqual(self.statistiques(), self.expected())
+        self.client.delete(f'/api/facturations/{self.facture.id}/')
+        self.assertEqual(self.statistiques(), self.expected())
+        self.assertEqual(self.statistiques()['total_facturation'], 50.0)
+
+    def test_bulk_update_computes_deltas_from_the_locked_row(self):
+        validate = bulk.validate
+
+        def racing(*args, **kwargs):
+            # A payment commits between the bulk PATCH's read and its update
+            Facturation.objects.filter(pk=self.facture.pk).update(montant_paye=40, statut='partiel')
+            old = rollups.contribution_of(self.facture)
+            rollups.apply_change(old=old, new=old._replace(montant_paye=Decimal('40'), statut='partiel'))
+            return validate(*args, **kwargs)
+        with mock.patch.object(bulk, 'validate', racing):
+            resp = self.client.patch('/api/facturations/', [{'id': self.facture.id, 'montant': '120'}],
+                                     format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()['results'][0]['montant_paye'], '40.00')
+        self.assertEqual(self.statistiques(), self.expected())
+        partiel, impaye = rollups.read(('statut', 'partiel'), ('statut', 'impaye'))
+        self.assertEqual((partiel.nombre, partiel.total_montant, partiel.total_paye), (1, 120, 40))
+        self.assertEqual((impaye.nombre, impaye.total_montant), (0, 0))
+
+    def test_per_patient_month_and_status_scopes(self):
+        mois = date.today().strftime('%Y-%m')
+        patient, month, impaye, paye = rollups.read(('patient', str(self.patient.pk)), ('mois', mois),
+                                                    ('statut', 'impaye'), ('statut', 'paye'))
+        self.assertEqual((patient.nombre, patient.total_montant, patient.total_paye), (2, 150, 50))
+        self.assertEqual((month.nombre, month.total_montant), (2, 150))
+        self.assertEqual((impaye.nombre, paye.nombre), (1, 1))
+        resp = self.client.get(f'/api/patients/{self.patient.id}/facturations/')
+        self.assertEqual((resp.json()['total'], resp.json()['solde']), (150.0, 100.0))
+
+    def test_rebuild_command_repairs_drift(self):
+        Facturation.objects.filter(pk=self.facture.pk).update(montant=300)  # bypasses the signals
+        StatistiqueFacturation.objects.create(portee='patient', cle='999', nombre=4, total_montant=10)
+        self.assertNotEqual(self.statistiques(), self.expected())
+        out = StringIO()
+        call_command('rebuild_billing_rollups', chunk_size=1, stdout=out)
+        self.assertIn('[OK]', out.getvalue())
+        self.assertEqual(self.statistiques(), self.expected())
+        self.assertFalse(StatistiqueFacturation.objects.filter(portee='patient', cle='999').exists())
+        self.assertEqual(rollups.read(('patient', str(self.patient.pk)))[0].total_montant, 350)
+
+
+class PaymentLedgerTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='caisse', password='caisse123')
+        self.client.force_authenticate(user=self.user)
+        patient = Patient.objects.create(nom='Kane', prenom='Ousmane', date_naissance=date(1970, 3, 3),
+                                         adresse='Thiès', telephone='1', email='ousmane@example.com')
+        self.facture = Facturation.objects.create(patient=patient, montant=100, date_echeance=date.today(),
+                                                  description='Hospitalisation')
+
+    def payer(self, montant):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/facturations/{self.facture.id}/enregistrer_paiement/',
+                                    {'montant': montant}, format='json')
+
+    def test_payments_are_appended_to_the_ledger(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.payer('30')
+        self.assertEqual(resp.json(), {'status': 'Paiement enregistré', 'montant_paye': 30.0, 'solde': 70.0})
+        update = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "api_facturation"'))
+        self.assertIn('"montant_paye" +', update)
+        self.assertEqual(self.payer('70').json()['solde'], 0.0)
+
+        self.facture.refresh_from_db()
+        self.assertEqual((self.facture.montant_paye, self.facture.statut), (100, 'paye'))
+        paiements = Paiement.objects.filter(facture=self.facture)
+        self.assertEqual(sorted(p.montant for p in paiements), [30, 70])
+        self.assertTrue(all(p.utilisateur == self.user for p in paiements))
+        with self.assertRaises(ValueError):
+            paiements[0].save()
+
+    def test_rollups_follow_status_changes(self):
+        self.payer('40')
+        paye, partiel, impaye, total = rollups.read(('statut', 'paye'), ('statut', 'partiel'),
+                                                    ('statut', 'impaye'), ('global', ''))
+        self.assertEqual((paye.nombre, partiel.nombre, impaye.nombre), (0, 1, 0))
+        self.assertEqual((partiel.total_paye, total.total_paye), (40, 40))
+        self.payer('60')
+        paye, partiel = rollups.read(('statut', 'paye'), ('statut', 'partiel'))
+        self.assertEqual((paye.nombre, paye.total_paye, partiel.nombre, partiel.total_paye), (1, 100, 0, 0))
+
+    def test_rollups_are_applied_after_the_payment_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as ctx:
+            self.client.post(f'/api/facturations/{self.facture.id}/enregistrer_paiement/', {'montant': '30'},
+                             format='json')
+        # The shared rollup rows are not locked by the payment's transaction
+        self.assertFalse([q for q in ctx.captured_queries if 'api_statistiquefacturation' in q['sql']])
+        self.assertEqual(rollups.read(('global', ''))[0].total_paye, 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(rollups.read(('global', ''))[0].total_paye, 30)
+
+    def test_invalid_amounts_are_rejected(self):
+        for montant in ('abc', 'NaN', '-5', '0'):
+            with self.subTest(montant=montant):
+                self.assertEqual(self.payer(montant).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Paiement.objects.exists())
+
+
+class BulkWriteTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sync', password='sync123')
+        self.client.force_authenticate(user=self.user)
+        self.existing = Patient.objects.create(nom='Sow', prenom='Awa', date_naissance=date(1990, 1, 1),
+                                               adresse='Dakar', telephone='1', email='awa@example.com')
+        self.medecin = Medecin.objects.create(nom='Ba', prenom='Cheikh', specialite='cardiologie', telephone='2',
+                                              email='cheikh@example.com', numero_licence='LIC-B1',
+                                              adresse_cabinet='Dakar')
+
+    @staticmethod
+    def patient(i, **extra):
+        return {'nom': f'Nom{i}', 'prenom': 'Lab', 'date_naissance': '1980-01-01', 'adresse': 'Dakar',
+                'telephone': str(i), 'email': f'lab{i}@example.com', **extra}
+
+    def test_integrity_errors_do_not_leak_database_details(self):
+        create = bulk.create
+
+        def racing(model, objects):
+            # Another request inserts the same email between validation and insertion
+            Patient.objects.create(nom='Rival', prenom='X', date_naissance=date(1990, 1, 1), adresse='Dakar',
+                                   telephone='9', email='lab1@example.com')
+            return create(model, objects)
+        with mock.patch.object(bulk, 'create', racing):
+            resp = self.client.post('/api/patients/', [self.patient(1)], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json(), {'error': bulk.INTEGRITY_MESSAGE, 'email': [UniqueValidator.message]})
+        with mock.patch.object(bulk, 'create', side_effect=IntegrityError('CHECK constraint failed: secret_col')):
+            resp = self.client.post('/api/patients/', [self.patient(2)], format='json')
+        self.assertEqual(resp.json(), {'error': bulk.INTEGRITY_MESSAGE})
+
+    def test_bulk_create_reports_errors_per_item(self):
+        payload = [self.patient(1), {'prenom': 'Sans nom'}, self.patient(2, email='awa@example.com'),
+                   self.patient(3), self.patient(4, email='lab3@example.com')]
+        resp = self.client.post('/api/patients/', payload, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        body = resp.json()
+        self.assertEqual([r and r['email'] for r in body['results']],
+                         ['lab1@example.com', None, None, 'lab3@example.com', None])
+        self.assertEqual([e['index'] for e in body['errors']], [1, 2, 4])
+        self.assertIn('nom', body['errors'][0]['errors'])
+        self.assertIn('email', body['errors'][1]['errors'])
+        self.assertEqual(Patient.objects.count(), 3)
+
+    def test_atomic_mode_rolls_back_on_any_error(self):
+        resp = self.client.post('/api/patients/?atomic=true', [self.patient(1), {'nom': 'X'}], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json()['results'], [None, None])
+        self.assertEqual(Patient.objects.count(), 1)
+        resp = self.client.post('/api/patients/?atomic=true', [self.patient(1), self.patient(2)], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def create(count, offset):
+            start = timezone.now() + timedelta(days=offset)
+            payload = [{'patient_id': self.existing.id, 'medecin_id': self.medecin.id, 'motif': 'Bilan',
+                        'date_heure': (start + timedelta(hours=i)).isoformat()} for i in range(count)]
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.post('/api/rendez-vous/', payload, format='json')
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            return len(ctx.captured_queries)
+
+        # The doctor created in setUp leaves the reference cache to be loaded by the first request
+        create(1, 20)
+        self.assertEqual(create(3, 1), create(60, 10))
+        self.assertEqual(RendezVous.objects.count(), 64)
+        # appointments of a doctor may not overlap, including within the batch
+        slot = RendezVous.objects.first()
+        resp = self.client.post('/api/rendez-vous/', [
+            {'patient_id': self.existing.id, 'medecin_id': self.medecin.id, 'motif': 'Doublon',
+             'date_heure': slot.date_heure.isoformat()},
+            {'patient_id': 999, 'medecin_id': self.medecin.id, 'motif': 'Inconnu',
+             'date_heure': timezone.now().isoformat()},
+        ], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = resp.json()['errors']
+        self.assertIn('non_field_errors', errors[0]['errors'])
+        self.assertIn('patient_id', errors[1]['errors'])
+
+    def test_bulk_patch_and_delete(self):
+        other = Patient.objects.create(nom='Fall', prenom='Moussa', date_naissance=date(1960, 5, 5),
+                                       adresse='Mbour', telephone='3', email='moussa@example.com')
+        resp = self.client.patch('/api/patients/', [
+            {'id': self.existing.id, 'statut': 'inactif'},
+            {'id': other.id, 'email': 'awa@example.com'},
+            {'id': 999, 'statut': 'inactif'},
+            {'statut': 'inactif'},
+        ], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(resp.json()['results'][0]['statut'], 'inactif')
+        self.assertEqual([e['index'] for e in resp.json()['errors']], [1, 2, 3])
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.statut, 'inactif')
+        self.assertGreater(self.existing.date_modification, self.existing.date_enregistrement)
+
+        resp = self.client.delete('/api/patients/', [self.existing.id, {'id': other.id}, 999], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(resp.json()['deleted'], 2)
+        self.assertFalse(Patient.objects.exists())
+
+    def test_bulk_writes_keep_billing_rollups_in_sync(self):
+        payload = [{'patient_id': self.existing.id, 'montant': str(10 * i), 'date_echeance': '2030-01-01',
+                    'description': 'Lot'} for i in range(1, 6)]
+        resp = self.client.post('/api/facturations/', payload, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        ids = [r['id'] for r in resp.json()['results']]
+        self.client.patch('/api/facturations/', [{'id': pk, 'montant_paye': '10', 'statut': 'partiel'}
+                                                 for pk in ids[:2]], format='json')
+        self.client.delete('/api/facturations/', ids[4:], format='json')
+        [total] = rollups.read(('global', ''))
+        self.assertEqual((total.nombre, total.total_montant, total.total_paye), (4, 100, 20))
+        [partiel] = rollups.read(('statut', 'partiel'))
+        self.assertEqual(partiel.nombre, 2)
+
+    def test_list_payload_required_for_bulk_routes(self):
+        resp = self.client.patch('/api/patients/', {'id': self.existing.id}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StreamingImportTests(APITestCase):
+    CSV = (
+        'nom,prenom,date_naissance,adresse,telephone,email,numero_secu\n'
+        'Diop,Ndèye,1990-04-01,Dakar,771,ndeye@example.com,SN1\n'
+        'Sans,Date,,Dakar,772,sans.date@example.com,\n'
+        'Fall,Awa,1985-02-02,Thiès,773,awa@example.com,\n'
+        'Doublon,Awa,1985-02-02,Thiès,774,awa@example.com,SN2\n'
+        'Ba,Moussa,1970-07-07,Mbour,775,moussa@example.com,SN1\n'
+        'Sarr,Khady,1999-09-09,Touba,776,khady@example.com,\n'
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='import', password='import123')
+        self.client.force_authenticate(user=self.user)
+        Patient.objects.create(nom='Existant', prenom='Khady', date_naissance=date(1999, 9, 9), adresse='Touba',
+                               telephone='1', email='khady@example.com')
+
+    def events(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_csv_upload_streams_progress_and_rejects(self):
+        upload = SimpleUploadedFile('patients.csv', self.CSV.encode('utf-8-sig'))
+        events = self.events(self.client.post('/api/patients/import/', {'file': upload}, format='multipart'))
+        rejets = [e for e in events if e['type'] == 'rejet']
+        self.assertEqual([r['ligne'] for r in rejets], [3, 5, 6, 7])
+        self.assertIn('date_naissance', rejets[0]['erreurs'])
+        self.assertIn('email', rejets[1]['erreurs'])
+        self.assertIn('numero_secu', rejets[2]['erreurs'])
+        self.assertIn('email', rejets[3]['erreurs'])  # already in the database
+        self.assertEqual(events[-1], {'type': 'resume', 'lignes': 6, 'creees': 2, 'rejetees': 4})
+        self.assertEqual(set(Patient.objects.values_list('email', flat=True)),
+                         {'khady@example.com', 'ndeye@example.com', 'awa@example.com'})
+        # accents survive the upload and the CSV default numero_secu stays NULL, not ''
+        self.assertIsNone(Patient.objects.get(email='awa@example.com').numero_secu)
+        self.assertEqual(Patient.objects.get(email='ndeye@example.com').prenom, 'Ndèye')
+
+    def test_ndjson_upload_in_small_chunks(self):
+        lines = [json.dumps({'nom': f'Med {i}', 'description': 'd', 'prix': str(i), 'dosage': '1g',
+                             'fabricant': 'SN'}) for i in range(1, 6)]
+        lines[2] = '{not json'
+        upload = SimpleUploadedFile('medicaments.ndjson', '\n'.join(lines).encode())
+        with mock.patch.object(MedicamentViewSet, 'import_chunk_size', 2):
+            events = self.events(self.client.post('/api/medicaments/import/', {'file': upload}, format='multipart'))
+        self.assertEqual([e['lignes'] for e in events if e['type'] == 'progression'], [2, 4, 5])
+        self.assertEqual(events[-1], {'type': 'resume', 'lignes': 5, 'creees': 4, 'rejetees': 1})
+        self.assertEqual(Medicament.objects.count(), 4)
+
+    def test_integrity_error_rejects_chunk_without_database_text(self):
+        upload = SimpleUploadedFile('patients.csv', self.CSV.encode())
+        with mock.patch.object(bulk, 'create', side_effect=IntegrityError(
+                'UNIQUE constraint failed: api_patient.email')):
+            events = self.events(self.client.post('/api/patients/import/', {'file': upload}, format='multipart'))
+        rejets = {e['ligne']: e['erreurs'] for e in events if e['type'] == 'rejet'}
+        self.assertEqual(rejets[2], {'non_field_errors': [bulk.INTEGRITY_MESSAGE],
+                                     'email': [UniqueValidator.message]})
+        self.assertNotIn('api_patient', json.dumps(rejets))
+        self.assertEqual(events[-1], {'type': 'resume', 'lignes': 6, 'creees': 0, 'rejetees': 6})
+
+    def test_import_command_writes_rejects_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'patients.csv')
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write(self.CSV)
+            out = StringIO()
+            call_command('import_data', 'patients', path, chunk_size=2, stdout=out)
+            self.assertIn('2 patients imported from 6 rows, 4 rejected', out.getvalue())
+            with open(f'{path}.rejects.csv', encoding='utf-8') as fh:
+                rejects = fh.read().splitlines()
+            self.assertEqual(len(rejects), 5)
+            self.assertTrue(rejects[1].startswith('3,'))
+        self.assertEqual(Patient.objects.count(), 3)
+
+
+class StreamingExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='export', password='export123')
+        self.client.force_authenticate(user=self.user)
+        seed_dataset(patients=20, doctors=2, medicaments=3, batch_size=7)
+
+    def content(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_honours_filters_and_ordering_without_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/facturations/?format=csv&statut=paye&ordering=montant')
+            lines = self.content(response).splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('filename="facturation.csv"', response['Content-Disposition'])
+        # table versions (ETag) + the export itself
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertNotIn('COUNT(', ctx.captured_queries[1]['sql'])
+        header = lines[0].split(',')
+        self.assertEqual(header[:3], ['id', 'patient.id', 'patient.nom'])
+        self.assertNotIn('patient_id', header)
+        rows = list(csv.DictReader(lines))
+        self.assertEqual({int(row['id']) for row in rows},
+                         set(Facturation.objects.filter(statut='paye').values_list('id', flat=True)))
+        montants = [float(row['montant']) for row in rows]
+        self.assertEqual(montants, sorted(montants))
+
+    def test_ndjson_export_streams_every_row_with_prefetch(self):
+        with mock.patch.object(OrdonnanceViewSet, 'export_chunk_size', 3):
+            lines = self.content(self.client.get('/api/ordonnances/?format=ndjson')).splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), Ordonnance.objects.count())
+        self.assertTrue(all(len(row['medicaments']) == 1 for row in rows))
+        self.assertEqual(rows[0]['patient']['id'], Ordonnance.objects.first().patient_id)
+
+    def test_csv_cells_cannot_run_as_formulas(self):
+        patient = Patient.objects.create(nom='=HYPERLINK("http://evil.example")', prenom='@SUM(A1)',
+                                         adresse='-2+3', telephone='+221770000000', email='formule@example.com',
+                                         date_naissance=date(1990, 1, 1))
+        rows = csv.DictReader(self.content(self.client.get('/api/patients/?format=csv')).splitlines())
+        row = next(row for row in rows if row['id'] == str(patient.id))
+        self.assertEqual((row['nom'], row['prenom'], row['adresse']),
+                         ('\'=HYPERLINK("http://evil.example")', "'@SUM(A1)", "'-2+3"))
+        # Plain numbers are not formulas
+        self.assertEqual(row['telephone'], '+221770000000')
+        # NDJSON keeps the values as they are
+        resp = self.client.get(f'/api/patients/{patient.id}/?format=ndjson')
+        self.assertEqual(json.loads(resp.content)['nom'], '=HYPERLINK("http://evil.example")')
+
+    def test_json_list_and_detail_unchanged(self):
+        resp = self.client.get('/api/facturations/')
+        self.assertIn('count', resp.json())
+        facture = Facturation.objects.first()
+        resp = self.client.get(f'/api/facturations/{facture.id}/?format=csv')
+        self.assertEqual(resp.content.decode().splitlines()[1].split(',')[0], str(facture.id))
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='front', password='front123')
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.medecin = Medecin.objects.create(nom='Diop', prenom='Awa', specialite='pediatrie', telephone='1',
+                                                  email='awa.diop@example.com', numero_licence='LIC-E1',
+                                                  adresse_cabinet='Dakar')
+            self.patient = Patient.objects.create(nom='Fall', prenom='Ibrahima', date_naissance=date(1980, 1, 1),
+                                                  adresse='Dakar', telephone='2', email='ibrahima@example.com')
+
+    def revalidate(self, url, response):
+        with CaptureQueriesContext(connection) as ctx:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        return again, len(ctx.captured_queries)
+
+    def test_list_returns_304_until_the_table_changes(self):
+        first = self.client.get('/api/medecins/')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertTrue(first['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', first)
+        again, queries = self.revalidate('/api/medecins/', first)
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(queries, 1)  # table versions only
+        self.assertEqual(again['ETag'], first['ETag'])
+        # other query strings and formats get their own ETag
+        self.assertNotEqual(self.client.get('/api/medecins/?specialite=pediatrie')['ETag'], first['ETag'])
+        self.assertNotEqual(self.client.get('/api/medecins/?format=csv')['ETag'], first['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/medecins/{self.medecin.id}/', {'telephone': '3'}, format='json')
+        self.assertEqual(self.revalidate('/api/medecins/', first)[0].status_code, status.HTTP_200_OK)
+
+    def test_nested_tables_are_part_of_the_etag(self):
+        RendezVous.objects.create(patient=self.patient, medecin=self.medecin, date_heure=timezone.now(), motif='Suivi')
+        first = self.client.get('/api/rendez-vous/')
+        self.assertEqual(self.revalidate('/api/rendez-vous/', first)[0].status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            Medecin.objects.get(pk=self.medecin.pk).save()
+        self.assertEqual(self.revalidate('/api/rendez-vous/', first)[0].status_code, status.HTTP_200_OK)
+
+    def test_patient_detail_uses_date_modification(self):
+        url = f'/api/patients/{self.patient.id}/'
+        first = self.client.get(url)
+        again, queries = self.revalidate(url, first)
+        self.assertEqual((again.status_code, queries), (status.HTTP_304_NOT_MODIFIED, 1))
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, status.HTTP_304_NOT_MODIFIED)
+        Patient.objects.filter(pk=self.patient.pk).update(date_modification=timezone.now() + timedelta(seconds=5))
+        self.assertEqual(self.revalidate(url, first)[0].status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/patients/999/', HTTP_IF_NONE_MATCH=first['ETag']).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_writes_and_payments_bump_versions(self):
+        facture = Facturation.objects.create(patient=self.patient, montant=10, date_echeance=date.today(),
+                                             description='Test')
+        first = self.client.get('/api/facturations/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/facturations/{facture.id}/enregistrer_paiement/', {'montant': '5'}, format='json')
+        second = self.revalidate('/api/facturations/', first)[0]
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/facturations/', [{'id': facture.id, 'notes': 'x'}], format='json')
+        self.assertEqual(self.revalidate('/api/facturations/', second)[0].status_code, status.HTTP_200_OK)
+
+
+class ReferenceCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cache', password='cache123')
+        self.client.force_authenticate(user=self.user)
+        self.medecin = Medecin.objects.create(nom='Diop', prenom='Awa', specialite='pediatrie', telephone='1',
+                                              email='awa.diop@example.com', numero_licence='LIC-C1',
+                                              adresse_cabinet='Dakar')
+        self.patient = Patient.objects.create(nom='Fall', prenom='Ibrahima', date_naissance=date(1980, 1, 1),
+                                              adresse='Dakar', telephone='2', email='ibrahima@example.com')
+        RendezVous.objects.create(patient=self.patient, medecin=self.medecin, date_heure=timezone.now(),
+                                  motif='Suivi')
+        cache.warm()
+
+    def medecin_names(self):
+        return [row['medecin']['nom'] for row in self.client.get('/api/rendez-vous/').json()['results']]
+
+    def test_nested_doctor_comes_from_cache_until_its_version_changes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get('/api/rendez-vous/')
+        self.assertEqual(resp.json()['results'][0]['medecin']['email'], 'awa.diop@example.com')
+        self.assertFalse([q for q in ctx.captured_queries if '"api_medecin".' in q['sql']])
+        # another worker writes the row: invisible here until the shared version is bumped
+        Medecin.objects.filter(pk=self.medecin.pk).update(nom='Sow')
+        self.assertEqual(self.medecin_names(), ['Diop'])
+        versioning.bump([versioning.table_of(Medecin)])
+        self.assertEqual(self.medecin_names(), ['Sow'])
+
+    def test_local_writes_are_visible_immediately(self):
+        self.client.patch(f'/api/medecins/{self.medecin.id}/', {'nom': 'Ndiaye'}, format='json')
+        self.assertEqual(self.medecin_names(), ['Ndiaye'])
+
+    def test_write_fields_resolve_through_cache(self):
+        payload = {'patient_id': self.patient.id, 'medecin_id': self.medecin.id, 'motif': 'Bilan',
+                   'date_heure': (timezone.now() + timedelta(days=1)).isoformat()}
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post('/api/rendez-vous/', payload, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.json()['medecin']['nom'], 'Diop')
+        self.assertFalse([q for q in ctx.captured_queries if '"api_medecin".' in q['sql']])
+        for value, code in ((999, 'does_not_exist'), ('abc', 'incorrect_type')):
+            resp = self.client.post('/api/rendez-vous/', {**payload, 'medecin_id': value}, format='json')
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('medecin_id', resp.json())
+
+    def test_rolled_back_creation_leaves_no_phantom(self):
+        self.assertTrue(cache.reference(Medecin).complete)
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                phantom = Medecin.objects.create(nom='Kane', prenom='Ali', specialite='autre', telephone='4',
+                                                 email='ali.kane@example.com', numero_licence='LIC-C3',
+                                                 adresse_cabinet='Dakar')
+                Medecin.objects.create(nom='Doublon', prenom='Ali', specialite='autre', telephone='5',
+                                       email='doublon@example.com', numero_licence='LIC-C3', adresse_cabinet='Dakar')
+        self.assertIsNone(cache.reference(Medecin).get(phantom.pk))
+        payload = {'patient_id': self.patient.id, 'medecin_id': phantom.pk, 'motif': 'Bilan',
+                   'date_heure': (timezone.now() + timedelta(days=1)).isoformat()}
+        resp = self.client.post('/api/rendez-vous/', payload, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('medecin_id', resp.json())
+
+    def test_committed_creation_is_added_without_reload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            created = Medecin.objects.create(nom='Ba', prenom='Moussa', specialite='autre', telephone='3',
+                                             email='moussa.ba@example.com', numero_licence='LIC-C2',
+                                             adresse_cabinet='Thies')
+        self.assertIn(created.pk, cache.reference(Medecin).entries)
+
+    def test_lru_evicts_least_recently_used(self):
+        other = Medecin.objects.create(nom='Ba', prenom='Moussa', specialite='autre', telephone='3',
+                                       email='moussa.ba@example.com', numero_licence='LIC-C2', adresse_cabinet='Thies')
+        lru = cache.ReferenceCache(Medecin, max_size=1)
+        lru.validate()
+        self.assertTrue(lru.oversized)
+        self.assertEqual(lru.get(self.medecin.pk).nom, 'Diop')
+        self.assertEqual(lru.get(other.pk).nom, 'Ba')
+        self.assertEqual(list(lru.entries), [other.pk])
+        self.assertIsNone(lru.get(999))
+
+    def test_csv_export_keeps_nested_columns(self):
+        resp = self.client.get('/api/rendez-vous/?format=csv')
+        header = b''.join(resp.streaming_content).decode().splitlines()[0].split(',')
+        self.assertIn('medecin.nom', header)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mobile', password='mobile123')
+        self.client.force_authenticate(user=self.user)
+        self.medecin = Medecin.objects.create(nom='Diop', prenom='Awa', specialite='pediatrie', telephone='1',
+                                              email='awa.diop@example.com', numero_licence='LIC-S1',
+                                              adresse_cabinet='Dakar')
+        self.patient = Patient.objects.create(nom='Fall', prenom='Ibrahima', date_naissance=date(1980, 1, 1),
+                                              adresse='Dakar', telephone='2', email='ibrahima@example.com')
+        self.rdv = RendezVous.objects.create(patient=self.patient, medecin=self.medecin, date_heure=timezone.now(),
+                                             motif='Suivi')
+        consultation = Consultation.objects.create(patient=self.patient, medecin=self.medecin, diagnostic='RAS',
+                                                   traitement='Repos')
+        self.ordonnance = Ordonnance.objects.create(consultation=consultation, patient=self.patient,
+                                                    medecin=self.medecin, date_expiration=date.today(),
+                                                    instructions='Matin')
+        medicament = Medicament.objects.create(nom='Paracetamol', description='Antalgique', prix=500, dosage='500mg',
+                                               fabricant='SN')
+        self.ligne = OrdonnanceMedicament.objects.create(ordonnance=self.ordonnance, medicament=medicament,
+                                                         dosage='1', frequence='3x/jour', duree='5 jours')
+        cache.warm()
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return resp.json(), [q['sql'] for q in ctx.captured_queries]
+
+    def test_fields_select_columns_and_nested_paths(self):
+        data, queries = self.get('/api/rendez-vous/?fields=id,date_heure,patient.nom')
+        self.assertEqual(data['results'], [{'id': self.rdv.id, 'patient': {'nom': 'Fall'},
+                                            'date_heure': data['results'][0]['date_heure']}])
+        page = next(sql for sql in queries if 'LIMIT' in sql)
+        self.assertNotIn('"api_patient"."adresse"', page)
+        self.assertNotIn('"api_rendezvous"."motif"', page)
+
+    def test_expand_renders_other_relations_as_ids(self):
+        data, queries = self.get('/api/rendez-vous/?expand=medecin')
+        row = data['results'][0]
+        self.assertEqual(row['patient'], self.patient.id)
+        self.assertEqual(row['medecin']['nom'], 'Diop')
+        self.assertFalse([sql for sql in queries if 'JOIN "api_patient"' in sql])
+        # without fields/expand the representation is unchanged
+        full = self.client.get('/api/rendez-vous/').json()['results'][0]
+        self.assertEqual(full['patient']['nom'], 'Fall')
+
+    def test_nested_lists_and_computed_fields(self):
+        data, queries = self.get('/api/ordonnances/?fields=id,medicaments')
+        self.assertEqual(data['results'], [{'id': self.ordonnance.id, 'medicaments': [self.ligne.id]}])
+        data, _ = self.get('/api/ordonnances/?fields=medicaments.dosage,medicaments.medicament.nom')
+        self.assertEqual(data['results'], [{'medicaments': [{'medicament': {'nom': 'Paracetamol'}, 'dosage': '1'}]}])
+        data, queries = self.get('/api/patients/?fields=id,age')
+        self.assertEqual(set(data['results'][0]), {'id', 'age'})
+        self.assertEqual(len(queries), 3)  # versions, count, page: no deferred column reload
+
+    def test_writes_and_exports(self):
+        payload = {'patient_id': self.patient.id, 'medecin_id': self.medecin.id, 'motif': 'Bilan',
+                   'date_heure': (timezone.now() + timedelta(days=1)).isoformat()}
+        resp = self.client.post('/api/rendez-vous/?fields=id', payload, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.json()['motif'], 'Bilan')
+        resp = self.client.get('/api/rendez-vous/?format=csv&fields=id,patient.nom')
+        header = b''.join(resp.streaming_content).decode().splitlines()[0]
+        self.assertEqual(header, 'id,patient.nom')
+
+
+class CompiledReadPathTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='reader123')
+        self.client.force_authenticate(user=self.user)
+        today = date.today()
+        births = [date(1980, 1, 1), date(1990, today.month, today.day), date(2000, 2, 29),
+                  (today + timedelta(days=1)).replace(year=1976)]
+        for n, birth in enumerate(births):
+            patient = Patient.objects.create(nom=f'Patient{n}', prenom='Test', date_naissance=birth, adresse='Dakar',
+                                             telephone='1', email=f'compiled{n}@example.com',
+                                             notes=None if n % 2 else 'RAS')
+            for montant, paye in (('100.10', '50.05'), ('10', '10'), ('0.30', '0.10')):
+                Facturation.objects.create(patient=patient, montant=Decimal(montant), montant_paye=Decimal(paye),
+                                           date_echeance=today, description='Test')
+
+    def both(self, url):
+        fast = self.client.get(url)
+        with mock.patch.object(CompiledListMixin, 'get_compiled_serializer', return_value=None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        read = lambda resp: b''.join(resp.streaming_content) if resp.streaming else resp.content
+        return read(fast), read(slow)
+
+    def test_output_is_byte_identical(self):
+        for url in ['/api/patients/', '/api/facturations/', '/api/facturations/?cursor=', '/api/patients/?fields=id,age',
+                    '/api/facturations/?format=csv', '/api/patients/?format=ndjson']:
+            with self.subTest(url=url):
+                fast, slow = self.both(url)
+                self.assertEqual(fast, slow)
+
+    def test_computed_fields_come_from_sql(self):
+        with mock.patch.object(PatientSerializer, 'get_age', side_effect=AssertionError), \
+                mock.patch.object(FacturationSerializer, 'get_solde', side_effect=AssertionError):
+            resp = self.client.get('/api/facturations/')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted({row['solde'] for row in resp.json()['results']}), [0.0, 0.2, 50.05])
+
+    def test_nested_lists_fall_back_to_serializers(self):
+        self.assertIsNone(compiled.compiled_for(OrdonnanceSerializer()))
+        self.assertEqual(self.client.get('/api/ordonnances/').status_code, status.HTTP_200_OK)
+
+    def test_sparse_field_variants_share_one_compiled_serializer(self):
+        factory = APIRequestFactory()
+
+        def compiled_for(query):
+            request = Request(factory.get('/api/patients/', query))
+            return compiled.compiled_for(PatientSerializer(context={'request': request}))
+        first = compiled_for({'fields': 'nom,id'})
+        entries = len(compiled._compiled)
+        for fields in ('id,nom', 'nom,id,nom', 'id,nom,inconnu', ' id , nom '):
+            with self.subTest(fields=fields):
+                self.assertIs(compiled_for({'fields': fields}), first)
+        self.assertEqual(len(compiled._compiled), entries)
+        self.assertIsNot(compiled_for({'fields': 'id,prenom'}), first)
+
+    def test_micro_benchmark_checks_identity(self):
+        result = benchmarks.compare_serialization(PatientSerializer(), Patient.objects.order_by('pk'), iterations=2)
+        self.assertEqual(result['rows'], 4)
+        self.assertIn('speedup', result)
+
+
+class AvailabilityTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='agenda', password='agenda123'))
+        today = timezone.localdate()
+        self.lundi = today + timedelta(days=7 - today.weekday())
+        self.patient = Patient.objects.create(nom='Sarr', prenom='Khady', date_naissance=date(1990, 5, 5),
+                                              adresse='Dakar', telephone='1', email='khady@example.com')
+        self.medecins = [
+            Medecin.objects.create(nom=nom, prenom='Test', specialite=specialite, telephone=str(i),
+                                   email=f'{nom.lower()}@example.com', numero_licence=f'LIC-A{i}',
+                                   adresse_cabinet='Dakar')
+            for i, (nom, specialite) in enumerate([('Diop', 'cardiologie'), ('Fall', 'cardiologie'),
+                                                   ('Kane', 'pediatrie')])
+        ]
+        for medecin, heure in zip(self.medecins, (9, 10, 8)):
+            PlageHoraire.objects.create(medecin=medecin, jour_semaine=0, heure_debut=time(heure),
+                                        heure_fin=time(heure + 2))
+
+    def moment(self, heure, minute=0, jours=0):
+        return timezone.make_aware(datetime.combine(self.lundi + timedelta(days=jours), time(heure, minute)))
+
+    def creneaux(self, url, **params):
+        params.setdefault('debut', self.lundi.isoformat())
+        resp = self.client.get(url, params)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.content)
+        return [(row['medecin'], timezone.localtime(datetime.fromisoformat(row['debut'])).strftime('%H:%M'))
+                for row in resp.json()]
+
+    def test_booked_slots_are_skipped_and_cancelled_ones_freed(self):
+        diop = self.medecins[0]
+        RendezVous.objects.create(patient=self.patient, medecin=diop, date_heure=self.moment(9, 30), motif='Suivi')
+        RendezVous.objects.create(patient=self.patient, medecin=diop, date_heure=self.moment(10), motif='Suivi',
+                                  statut='annule')
+        RendezVous.objects.create(patient=self.patient, medecin=diop, date_heure=self.moment(10, 45), motif='Suivi')
+        self.assertEqual(self.creneaux(f'/api/medecins/{diop.pk}/creneaux/'), [(diop.pk, '09:00'), (diop.pk, '10:00')])
+
+    def test_specialty_search_merges_doctors_chronologically(self):
+        diop, fall, _ = self.medecins
+        url = '/api/medecins/creneaux/'
+        self.assertEqual(self.creneaux(url, specialite='cardiologie', limite=5),
+                         [(diop.pk, '09:00'), (diop.pk, '09:30'), (diop.pk, '10:00'), (fall.pk, '10:00'),
+                          (diop.pk, '10:30')])
+        # the next week's Monday is reached when the first one is over
+        self.assertEqual(len(self.creneaux(url, specialite='cardiologie', debut=self.moment(12).isoformat(),
+                                           fin=self.moment(0, jours=8).isoformat())), 8)
+        with CaptureQueriesContext(connection) as ctx:
+            self.creneaux(url, specialite='cardiologie', fin=self.moment(0, jours=28).isoformat(), limite=500)
+        # version, plages, specialty doctors, one appointments query per Monday
+        self.assertLessEqual(len(ctx.captured_queries), 7)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'debut': 'demain'}, {'limite': '0'}, {'limite': 'x'}, {'specialite': 'magie'},
+                       {'debut': '2030-01-10', 'fin': '2030-01-01'}, {'fin': '2099-01-01'}):
+            with self.subTest(params=params):
+                resp = self.client.get('/api/medecins/creneaux/', params)
+                self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('error', resp.json())
+
+    def test_new_working_hours_are_searched_immediately(self):
+        kane = self.medecins[2]
+        self.assertEqual(len(self.creneaux(f'/api/medecins/{kane.pk}/creneaux/')), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post('/api/plages-horaires/', {
+                'medecin_id': kane.pk, 'jour_semaine': 1, 'heure_debut': '14:00', 'heure_fin': '15:00',
+                'duree_creneau': 60}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.json()['medecin']['nom'], 'Kane')
+        self.assertEqual(self.creneaux(f'/api/medecins/{kane.pk}/creneaux/')[-1], (kane.pk, '14:00'))
+        resp = self.client.post('/api/plages-horaires/', {
+            'medecin_id': kane.pk, 'jour_semaine': 1, 'heure_debut': '15:00', 'heure_fin': '14:00'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('heure_fin', resp.json())
+
+    def test_free_check_uses_sorted_intervals(self):
+        occupe = ([60, 120], [90, 150])
+        self.assertTrue(availability.est_libre(occupe, 30, 60))
+        self.assertFalse(availability.est_libre(occupe, 80, 110))
+        self.assertTrue(availability.est_libre(occupe, 90, 120))
+        self.assertTrue(availability.est_libre(occupe, 150, 180))
+
+
+class AppointmentOverlapTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='planning', password='planning123'))
+        self.patient = Patient.objects.create(nom='Ba', prenom='Awa', date_naissance=date(1985, 2, 2),
+                                              adresse='Dakar', telephone='1', email='awa.ba@example.com')
+        self.medecin = Medecin.objects.create(nom='Seck', prenom='Omar', specialite='cardiologie', telephone='2',
+                                              email='omar.seck@example.com', numero_licence='LIC-O1',
+                                              adresse_cabinet='Dakar')
+        self.debut = timezone.now().replace(microsecond=0) + timedelta(days=3)
+        self.rdv = RendezVous.objects.create(patient=self.patient, medecin=self.medecin, date_heure=self.debut,
+                                             duree=60, motif='Bilan')
+
+    def payload(self, minutes, **extra):
+        return {'patient_id': self.patient.id, 'medecin_id': self.medecin.id, 'motif': 'Suivi',
+                'date_heure': (self.debut + timedelta(minutes=minutes)).isoformat(), **extra}
+
+    def test_database_keeps_duration_and_end_consistent(self):
+        rows = RendezVous.objects.filter(pk=self.rdv.pk)
+        for changes in ({'duree': RendezVous.DUREE_MAX + 1}, {'date_heure': self.debut - timedelta(days=1)},
+                        {'date_fin': self.debut + timedelta(hours=12)}):
+            with self.subTest(changes=changes), self.assertRaises(IntegrityError), transaction.atomic():
+                rows.update(**changes)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RendezVous.objects.bulk_create([RendezVous(
+                patient=self.patient, medecin=self.medecin, date_heure=self.debut - timedelta(hours=9),
+                duree=600, date_fin=self.debut + timedelta(hours=1), motif='Trop long')])
+        # Consistent writes outside save() pass, fractions of a second included
+        debut = self.debut + timedelta(days=1, microseconds=123456)
+        rows.update(date_heure=debut, duree=45, date_fin=debut + timedelta(minutes=45))
+
+    def test_migration_resolves_overlaps_left_by_the_old_schema(self):
+        migration = importlib.import_module('api.migrations.0009_appointment_durations')
+        autre = Medecin.objects.create(nom='Faye', prenom='Issa', specialite='cardiologie', telephone='3',
+                                       email='issa.faye@example.com', numero_licence='LIC-O2', adresse_cabinet='Dakar')
+        # The old schema only rejected identical (medecin, date_heure) pairs
+        overlaps.uninstall(connection)
+        rdv = {minutes: RendezVous.objects.create(patient=self.patient, medecin=self.medecin, motif='Ancien',
+                                                  date_heure=self.debut + timedelta(minutes=minutes))
+               for minutes in (20, 22, 40, 120)}
+        voisin = RendezVous.objects.create(patient=self.patient, medecin=autre, motif='Autre médecin',
+                                           date_heure=self.debut + timedelta(minutes=10))
+        migration.resolve_overlaps(apps, mock.Mock(connection=connection))
+        overlaps.install(connection)
+
+        self.rdv.refresh_from_db()
+        self.assertEqual((self.rdv.duree, self.rdv.date_fin), (20, self.debut + timedelta(minutes=20)))
+        for minutes, (duree, statut) in {20: (20, 'confirme'), 22: (30, 'annule'), 40: (30, 'confirme'),
+                                         120: (30, 'confirme')}.items():
+            rdv[minutes].refresh_from_db()
+            self.assertEqual((rdv[minutes].duree, rdv[minutes].statut), (duree, statut), minutes)
+        self.assertIn(f'rendez-vous {rdv[20].id}', rdv[22].notes)
+        voisin.refresh_from_db()
+        self.assertEqual((voisin.duree, voisin.statut), (30, 'confirme'))
+        # Every remaining appointment passes the overlap triggers
+        for row in RendezVous.objects.all():
+            RendezVous.objects.filter(pk=row.pk).update(date_heure=row.date_heure)
+
+    def test_database_rejects_overlapping_appointments(self):
+        self.assertEqual(self.rdv.date_fin, self.debut + timedelta(hours=1))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RendezVous.objects.create(patient=self.patient, medecin=self.medecin,
+                                      date_heure=self.debut + timedelta(minutes=15), motif='Doublon')
+        suivant = RendezVous.objects.create(patient=self.patient, medecin=self.medecin,
+                                            date_heure=self.debut + timedelta(hours=1), motif='Suivant')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RendezVous.objects.filter(pk=suivant.pk).update(date_heure=self.debut + timedelta(minutes=30))
+        RendezVous.objects.create(patient=self.patient, medecin=self.medecin, statut='annule',
+                                  date_heure=self.debut + timedelta(minutes=15), motif='Annulé')
+
+    def test_api_reports_overlaps_and_frees_cancelled_slots(self):
+        resp = self.client.post('/api/rendez-vous/', self.payload(15), format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json()['non_field_errors'], [overlaps.MESSAGE])
+        resp = self.client.post('/api/rendez-vous/', self.payload(60, duree=45), format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.json()['duree'], 45)
+        suivant = resp.json()['id']
+        self.client.post(f'/api/rendez-vous/{self.rdv.id}/annuler/')
+        resp = self.client.post('/api/rendez-vous/', self.payload(0), format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.post(f'/api/rendez-vous/{self.rdv.id}/confirmer/')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        # an appointment is checked against its neighbours, not against itself
+        resp = self.client.patch(f'/api/rendez-vous/{suivant}/', {'duree': 90}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(RendezVous.objects.get(pk=suivant).date_fin, self.debut + timedelta(minutes=150))
+        resp = self.client.patch(f'/api/rendez-vous/{suivant}/', {'date_heure': self.payload(15)['date_heure']},
+                                 format='json')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_creation_checks_overlaps_within_and_against_database(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post('/api/rendez-vous/', [
+                self.payload(90), self.payload(100), self.payload(30), self.payload(120, duree=30),
+            ], format='json')
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        errors = {error['index']: error['errors'] for error in resp.json()['errors']}
+        self.assertEqual(sorted(errors), [1, 2])
+        self.assertEqual(len([q for q in ctx.captured_queries if 'date_fin' in q['sql']
+                              and q['sql'].startswith('SELECT')]), 1)
+
+    def test_overlap_lookup_uses_doctor_calendar_index(self):
+        queryset = overlaps.overlapping(self.medecin.id, self.debut, self.debut + timedelta(minutes=30))
+        self.assertIn('api_rdv_medecin_date_idx', queryset.explain())
+
+
+class AgendaFeedTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user(username='ical', password='ical123'))
+        self.patient = Patient.objects.create(nom='Gueye', prenom='Ndèye', date_naissance=date(1992, 3, 3),
+                                              adresse='Dakar', telephone='1', email='ndeye@example.com')
+        self.medecin = Medecin.objects.create(nom='Camara', prenom='Cheikh', specialite='neurologie', telephone='2',
+                                              email='cheikh@example.com', numero_licence='LIC-I1',
+                                              adresse_cabinet='Plateau, Dakar')
+        now = timezone.now().replace(microsecond=0)
+        self.rdv = [
+            RendezVous.objects.create(patient=self.patient, medecin=self.medecin, date_heure=now + timedelta(days=d),
+                                      duree=45, motif=motif, notes=notes, statut=statut)
+            for d, motif, notes, statut in [(2, 'Suivi; contrôle', 'Apporter IRM,\nscanner', 'confirme'),
+                                            (5, 'Bilan', None, 'annule'), (400, 'Lointain', None, 'confirme')]
+        ]
+
+    def agenda(self, url, **headers):
+        resp = self.client.get(url, **headers)
+        body = b''.join(resp.streaming_content).decode() if resp.streaming else resp.content.decode()
+        return resp, body
+
+    def test_doctor_feed_is_valid_icalendar(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp, body = self.agenda(f'/api/medecins/{self.medecin.id}/agenda.ics')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp['Content-Type'].startswith('text/calendar'))
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'))
+        self.assertTrue(body.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:rdv-{self.rdv[0].id}@syst-hopital', body)
+        self.assertIn('SUMMARY:Suivi\\; contrôle - Ndèye Gueye', body)
+        # Long lines are folded at 75 octets with CRLF + space
+        self.assertIn('Apporter IRM\\,\\nscanner', body.replace('\r\n ', ''))
+        self.assertIn('STATUS:CANCELLED', body)
+        self.assertIn(f"DTEND:{(self.rdv[0].date_fin).astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}", body)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in body.split('\r\n')))
+        self.assertEqual(len([q for q in ctx.captured_queries if 'api_rendezvous' in q['sql']
+                              and 'api_versiontable' not in q['sql']]), 1)
+
+    def test_patient_feed_window_and_conditional_requests(self):
+        url = f'/api/patients/{self.patient.id}/agenda.ics'
+        resp, body = self.agenda(url + '?fin=' + (timezone.now() + timedelta(days=500)).date().isoformat())
+        self.assertEqual(body.count('BEGIN:VEVENT'), 3)
+        self.assertIn('SUMMARY:Bilan - Dr Cheikh Camara', body)
+        first, _ = self.agenda(url)
+        self.assertEqual(self.agenda(url, HTTP_IF_NONE_MATCH=first['ETag'])[0].status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/rendez-vous/{self.rdv[0].id}/annuler/')
+        self.assertEqual(self.agenda(url, HTTP_IF_NONE_MATCH=first['ETag'])[0].status_code, status.HTTP_200_OK)
+        self.assertNotEqual(first['ETag'], self.agenda(f'/api/medecins/{self.medecin.id}/agenda.ics')[0]['ETag'])
+
+    def test_default_window_validators_change_with_the_day(self):
+        url = f'/api/medecins/{self.medecin.id}/agenda.ics'
+        first, _ = self.agenda(url)
+        self.assertGreaterEqual(parse_http_date(first['Last-Modified']),
+                                int(timezone.localtime().replace(hour=0, minute=0, second=0).timestamp()))
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            resp, _ = self.agenda(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp, _ = self.agenda(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # Explicit bounds do not depend on the day
+        fixed = url + '?debut=2030-01-01&fin=2030-02-01'
+        first, _ = self.agenda(fixed)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            self.assertEqual(self.agenda(fixed, HTTP_IF_NONE_MATCH=first['ETag'])[0].status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+
+    def test_invalid_window_and_unknown_object(self):
+        resp, _ = self.agenda(f'/api/medecins/{self.medecin.id}/agenda.ics?debut=2020-01-01&fin=2030-01-01')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.agenda('/api/medecins/999/agenda.ics')[0].status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AsyncReadTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Same routes as api/urls.py, built as under hospital_api/asgi.py
+        with override_settings(ASYNC_READS=True):
+            async_router = HospitalRouter()
+            for prefix, viewset, basename in router.registry:
+                async_router.register(prefix, viewset, basename=basename)
+            cls.resolver = URLResolver(RegexPattern(r'^/'), [path('api/', include(async_router.urls))])
+
+    def setUp(self):
+        seed_dataset(patients=25, doctors=2, medicaments=3, batch_size=10)
+        user = User.objects.create_user(username='async', password='async123')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+        self.client.credentials(**self.auth)
+        self.factory = AsyncRequestFactory()
+        self.patient = Patient.objects.filter(facturations__isnull=False, consultations__isnull=False).first()
+
+    async def call(self, method, url, auth=True, headers=None, **extra):
+        headers = {**({'Authorization': self.auth['HTTP_AUTHORIZATION']} if auth else {}), **(headers or {})}
+        request = getattr(self.factory, method)(url, headers=headers, **extra)
+        match = self.resolver.resolve(request.path_info)
+        response = await match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    async def content(self, response):
+        if response.streaming:
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return response.content
+
+    def test_views_are_async_only_in_asgi_mode(self):
+        sync_view = resolve('/api/patients/').func
+        async_view = self.resolver.resolve('/api/patients/').func
+        self.assertFalse(asyncio.iscoroutinefunction(sync_view))
+        self.assertTrue(asyncio.iscoroutinefunction(async_view))
+        self.assertIs(async_view.cls, PatientViewSet)
+        self.assertTrue(async_view.csrf_exempt)
+
+    async def test_reads_match_sync_views(self):
+        pk = self.patient.pk
+        urls = ['/api/patients/', '/api/patients/?page=2', '/api/patients/?cursor=', '/api/patients/?fields=id,nom',
+                f'/api/facturations/?patient={pk}', '/api/rendez-vous/', f'/api/patients/{pk}/',
+                f'/api/patients/{pk}/consultations/', f'/api/patients/{pk}/facturations/',
+                f'/api/patients/{pk}/rendez_vous/', '/api/ordonnances/', '/api/patients/?format=csv']
+        for url in urls:
+            with self.subTest(url=url):
+                expected = await sync_to_async(self.client.get)(url)
+                expected_content = await sync_to_async(self.content_of)(expected)
+                response = await self.call('get', url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(await self.content(response), expected_content)
+                self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+    def content_of(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    async def test_conditional_requests_and_errors(self):
+        first = await self.call('get', '/api/medecins/')
+        again = await self.call('get', '/api/medecins/', headers={'If-None-Match': first['ETag']})
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual((await self.call('get', '/api/patients/99999/')).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual((await self.call('get', '/api/patients/?page=99')).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual((await self.call('get', '/api/patients/', auth=False)).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    async def test_export_streams_asynchronously(self):
+        response = await self.call('get', '/api/patients/?format=ndjson')
+        self.assertTrue(response.is_async)
+        self.assertEqual(len((await self.content(response)).splitlines()), 25)
+
+    async def test_writes_use_the_sync_view(self):
+        response = await self.call('post', '/api/medicaments/', data={
+            'nom': 'Async', 'description': 'Test', 'prix': '10', 'dosage': '1g', 'fabricant': 'SN'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(await Medicament.objects.filter(nom='Async').aexists())
+
+    def test_list_stays_within_query_budget(self):
+        # The user is cached by the first request, as in benchmarks.authenticate()
+        async_to_sync(self.call)('get', '/api/patients/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = async_to_sync(self.call)('get', '/api/patients/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(benchmarks.count_queries(ctx.captured_queries), benchmarks.QUERY_BUDGETS['patient-list'])
+
+    def test_throughput_counts_requests_and_errors(self):
+        result = benchmarks.throughput(lambda path: 500 if path == '/b/' else 200, ['/a/', '/b/'], clients=2,
+                                       duration=0.05)
+        self.assertGreater(result['requests'], 2)
+        self.assertGreater(result['errors'], 0)
+        self.assertLess(result['errors'], result['requests'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTests(APITransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        replicas.forget()
+        self.addCleanup(replicas.forget)
+        self.addCleanup(replicas.reset)
+        self.addCleanup(caches['default'].clear)
+        throttling.get_store().clear()
+        self.addCleanup(throttling.get_store().clear)
+        self.user = User.objects.create_user(username='replica', password='replica123')
+        self.other = User.objects.create_user(username='other', password='other123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.patient = Patient.objects.create(nom='Rep', prenom='Lica', date_naissance=date(1990, 1, 1),
+                                              adresse='1 rue Test', telephone='0600000001',
+                                              email='rep.lica@example.com')
+
+    def get(self, url):
+        """(réponse, requêtes sur default, requêtes sur le réplica)"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url)
+        return response, len(primary.captured_queries), len(replica.captured_queries)
+
+    def test_reads_go_to_replica_after_authentication(self):
+        response, primary, replica = self.get(f'/api/patients/{self.patient.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['nom'], 'Rep')
+        # Authentication and the lag check on the primary, the view's reads on the replica
+        self.assertGreater(replica, 0)
+        self.assertLessEqual(primary, 2)
+        self.assertIsNone(replicas.current())
+
+    def test_writer_is_pinned_to_primary(self):
+        payload = {'nom': 'New', 'prenom': 'Patient', 'date_naissance': '1985-05-05', 'adresse': 'Adresse 2',
+                   'telephone': '0600000002', 'email': 'new.replica@example.com'}
+        self.assertEqual(self.client.post('/api/patients/', payload, format='json').status_code,
+                         status.HTTP_201_CREATED)
+        _, _, replica = self.get('/api/patients/')
+        self.assertEqual(replica, 0)
+        # The pin is visible to the other workers sharing the store
+        other_worker = throttling.SQLiteStore(settings.THROTTLE_STORE['LOCATION'])
+        self.assertTrue(other_worker.is_marked(f'replicas:pin:{self.user.pk}'))
+        # Other users keep reading from the replica
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.other)}')
+        _, _, replica = self.get('/api/patients/')
+        self.assertGreater(replica, 0)
+
+    def test_failed_write_does_not_pin(self):
+        self.assertEqual(self.client.post('/api/patients/', {}, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        _, _, replica = self.get('/api/patients/')
+        self.assertGreater(replica, 0)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        date_modification = timezone.now() - timedelta(minutes=1)
+        primary = {'api_patient': (5, date_modification)}
+        lagging = {'api_patient': (4, date_modification)}
+        with mock.patch.object(replicas, 'versions', side_effect=lambda alias: primary if alias == 'default'
+                               else lagging):
+            self.assertGreater(replicas.lag('replica'), 50)
+            _, _, replica = self.get('/api/patients/')
+        self.assertEqual(replica, 0)
+        # A replica that received a write moments ago is tolerated up to REPLICA_MAX_LAG_SECONDS
+        replicas.forget()
+        recent = {'api_patient': (5, timezone.now())}
+        catching_up = {'api_patient': (4, timezone.now() - timedelta(seconds=1))}
+        with mock.patch.object(replicas, 'versions', side_effect=lambda alias: recent if alias == 'default'
+                               else catching_up):
+            self.assertTrue(replicas.is_healthy('replica'))
+
+    def test_stalled_replica_is_detected_on_a_busy_table(self):
+        # The primary keeps writing, the replica stopped an hour ago
+        busy = {'api_patient': (500, timezone.now())}
+        stalled = {'api_patient': (20, timezone.now() - timedelta(hours=1))}
+        with mock.patch.object(replicas, 'versions', side_effect=lambda alias: busy if alias == 'default'
+                               else stalled):
+            self.assertGreater(replicas.lag('replica'), 3500)
+            self.assertFalse(replicas.is_healthy('replica'))
+
+    def test_router_keeps_writes_and_migrations_on_primary(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_write(Patient), 'default')
+        self.assertIsNone(router.db_for_read(Patient))
+        self.assertFalse(router.allow_migrate('replica', 'api'))
+        self.assertIsNone(router.allow_migrate('default', 'api'))
+
+
+class SlidingWindowThrottleTests(APITestCase):
+    def setUp(self):
+        throttling.get_store().clear()
+        self.addCleanup(throttling.get_store().clear)
+        self.factory = APIRequestFactory()
+
+    def throttle(self, rate, at):
+        throttle = throttling.AnonThrottle()
+        throttle.rate = rate
+        throttle.num_requests, throttle.duration = throttle.parse_rate(rate)
+        throttle.timer = lambda: at
+        return throttle
+
+    def hit(self, rate, at):
+        throttle = self.throttle(rate, at)
+        request = self.factory.get('/api/patients/', REMOTE_ADDR='10.0.0.1')
+        request.user = AnonymousUser()
+        return throttle.allow_request(request, None), throttle
+
+    def test_store_is_shared_between_workers(self):
+        path = os.path.join(_throttle_dir.name, 'shared.sqlite3')
+        first, second = throttling.SQLiteStore(path), throttling.SQLiteStore(path)
+        self.assertEqual(first.hit('k', 10, 60), (0, 1))
+        self.assertEqual(second.hit('k', 10, 60), (0, 2))
+        self.assertEqual(first.hit('k', 11, 60), (2, 1))
+        self.assertEqual(second.hit('other', 11, 60), (0, 1))
+
+    def test_cache_store(self):
+        store = throttling.CacheStore('default')
+        self.addCleanup(caches['default'].clear)
+        self.assertEqual(store.hit('k', 10, 60), (0, 1))
+        self.assertEqual(store.hit('k', 10, 60), (0, 2))
+        self.assertEqual(store.hit('k', 11, 60), (2, 1))
+
+    def test_previous_bucket_weighs_by_overlap(self):
+        start = 600 * 60
+        for _ in range(10):
+            self.assertTrue(self.hit('10/min', start + 59)[0])
+        allowed, throttle = self.hit('10/min', start + 59.5)
+        self.assertFalse(allowed)
+        self.assertGreater(throttle.wait(), 0)
+        # Half-way through the next bucket, the 11 counted requests weigh 5.5
+        results = [self.hit('10/min', start + 90)[0] for _ in range(5)]
+        self.assertEqual(results, [True, True, True, True, False])
+        allowed, throttle = self.hit('10/min', start + 90)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(throttle.estimate(), 11.5)
+        self.assertTrue(self.hit('10/min', start + 180)[0])
+
+    def test_token_endpoint_has_tighter_scope(self):
+        User.objects.create_user(username='throttled', password='throttled123')
+        with mock.patch.dict(throttling.ScopedThrottle.THROTTLE_RATES, {'token': '3/minute'}):
+            codes = [self.client.post('/api/token/', {'username': 'throttled', 'password': 'wrong'},
+                                      format='json').status_code for _ in range(3)]
+            self.assertNotIn(status.HTTP_429_TOO_MANY_REQUESTS, codes)
+            resp = self.client.post('/api/token/', {'username': 'throttled', 'password': 'throttled123'},
+                                    format='json')
+            self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', resp)
+            # Other endpoints keep the anon and user rates
+            self.assertEqual(self.client.get('/api/patients/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        authentication.reset()
+        self.user = User.objects.create_user(username='cached', password='cached123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def user_queries(self, url='/api/patients/'):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        return resp, [q['sql'] for q in ctx.captured_queries if '"auth_user".' in q['sql']]
+
+    def test_authenticated_reads_skip_user_lookup(self):
+        resp, queries = self.user_queries()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        resp, queries = self.user_queries()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(queries, [])
+
+    def test_deactivated_user_is_rejected_at_once(self):
+        self.user_queries()
+        self.user.is_active = False
+        self.user.save()
+        resp, queries = self.user_queries()
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(len(queries), 1)
+
+    def test_permission_changes_reload_user(self):
+        self.user_queries()
+        group = Group.objects.create(name='secretariat')
+        self.user.groups.add(group)
+        self.assertEqual(len(self.user_queries()[1]), 1)
+        self.assertEqual(self.user_queries()[1], [])
+        # A group's permissions apply to all its members
+        group.permissions.add(Permission.objects.get(codename='view_patient'))
+        self.assertEqual(len(self.user_queries()[1]), 1)
+
+    def test_other_workers_drop_user_changed_elsewhere(self):
+        with override_settings(AUTH_USER_CHECK_SECONDS=0):
+            self.user_queries()
+            # Change committed by another worker: only the auth_user version in the database reaches this one
+            versioning.bump(['auth_user'])
+            self.assertEqual(len(self.user_queries()[1]), 1)
+            self.assertEqual(self.user_queries()[1], [])
+
+    def test_user_changes_bump_the_shared_version_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(versioning.read(['auth_user'])['auth_user'][0], 1)
+        # Recording the login date does not evict anyone
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(versioning.read(['auth_user'])['auth_user'][0], 1)
+
+    def test_entries_expire(self):
+        with override_settings(AUTH_USER_CACHE_SECONDS=0):
+            self.user_queries()
+            self.assertEqual(len(self.user_queries()[1]), 1)
+
+
+class RefreshTokenBlacklistTests(APITestCase):
+    def setUp(self):
+        blacklist.forget()
+        self.addCleanup(blacklist.forget)
+        caches['default'].clear()
+        User.objects.create_user(username='rotation', password='rotation123')
+
+    def refresh(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': token}, format='json')
+
+    def test_rotated_refresh_token_cannot_be_reused(self):
+        resp = self.client.post('/api/token/', {'username': 'rotation', 'password': 'rotation123'}, format='json')
+        first = resp.json()['refresh']
+        resp = self.refresh(first)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        second = resp.json()['refresh']
+        self.assertEqual(self.refresh(first).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh(second).status_code, status.HTTP_200_OK)
+        self.assertEqual(JetonRevoque.objects.count(), 2)
+
+    def test_unrevoked_tokens_are_checked_without_database(self):
+        blacklist.revoke('revoked', timezone.now() + timedelta(days=1))
+        with self.assertNumQueries(0):
+            self.assertFalse(blacklist.is_revoked('not-revoked'))
+        with self.assertNumQueries(1):
+            self.assertTrue(blacklist.is_revoked('revoked'))
+
+    def test_revocations_from_other_workers_are_picked_up(self):
+        self.assertFalse(blacklist.is_revoked('elsewhere'))
+        JetonRevoque.objects.create(jti='elsewhere', date_expiration=timezone.now() + timedelta(days=1))
+        with override_settings(BLACKLIST_CHECK_SECONDS=0):
+            self.assertTrue(blacklist.is_revoked('elsewhere'))
+        # A worker starting in the same period reuses the shared filter
+        blacklist.forget()
+        with self.assertNumQueries(1):
+            self.assertFalse(blacklist.is_revoked('never'))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = blacklist.BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f'jti-{i}')
+        copy = blacklist.BloomFilter.from_bytes(bloom.to_bytes())
+        self.assertTrue(all(f'jti-{i}' in copy for i in range(1000)))
+        false_positives = sum(f'other-{i}' in copy for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_purge_command_deletes_expired_entries_in_batches(self):
+        now = timezone.now()
+        JetonRevoque.objects.bulk_create([JetonRevoque(jti=f'old-{i}', date_expiration=now - timedelta(hours=1))
+                                          for i in range(5)])
+        JetonRevoque.objects.create(jti='live', date_expiration=now + timedelta(hours=1))
+        out = StringIO()
+        call_command('purge_revoked_tokens', '--batch-size', '2', stdout=out)
+        self.assertIn('5 expired', out.getvalue())
+        self.assertEqual(list(JetonRevoque.objects.values_list('jti', flat=True)), ['live'])
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        seed_dataset(patients=5, doctors=1, medicaments=2, batch_size=10)
+        user = User.objects.create_user(username='metrics', password='metrics123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.patient = Patient.objects.order_by('pk').first()
+
+    def sample(self, text, name, endpoint, status_code='200', method='GET'):
+        prefix = f'{name}{{endpoint="{endpoint}",method="{method}",status="{status_code}"}} '
+        values = [line[len(prefix):] for line in text.splitlines() if line.startswith(prefix)]
+        self.assertEqual(len(values), 1, prefix)
+        return float(values[0])
+
+    def test_records_latency_sql_serialization_and_size_per_action(self):
+        self.client.get('/api/facturations/statistiques/')
+        self.client.get(f'/api/patients/{self.patient.pk}/consultations/')
+        self.client.get(f'/api/patients/{self.patient.pk}/consultations/')
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = resp.content.decode()
+        self.assertEqual(self.sample(text, 'hospital_http_request_duration_seconds_count',
+                                     'patient-consultations'), 2)
+        self.assertEqual(self.sample(text, 'hospital_http_request_duration_seconds_count',
+                                     'facturation-statistiques'), 1)
+        self.assertIn('hospital_http_request_duration_seconds_bucket{endpoint="patient-consultations",'
+                      'method="GET",status="200",le="+Inf"} 2', text)
+        self.assertGreater(self.sample(text, 'hospital_db_queries_total', 'patient-consultations'), 0)
+        self.assertGreater(self.sample(text, 'hospital_db_query_seconds_total', 'patient-consultations'), 0)
+        self.assertGreater(self.sample(text, 'hospital_serialization_seconds_total', 'patient-consultations'), 0)
+        self.assertGreater(self.sample(text, 'hospital_response_bytes_total', 'facturation-statistiques'), 0)
+
+    def test_workers_are_aggregated_through_metrics_dir(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            # Another worker's figures, written to its own file
+            other = metrics.Registry()
+            other.name = 'other-worker.json'
+            other.record(('patient-list', 'GET', '200'), 0.02, metrics.RequestStats(), 100)
+            other.flush(force=True)
+            self.client.get('/api/patients/')
+            series = metrics.collect()
+            self.assertEqual(series[('patient-list', 'GET', '200')]['count'], 2)
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_unknown_routes_share_one_series(self):
+        self.client.get('/does-not-exist/')
+        self.client.get('/neither/')
+        self.assertEqual(metrics.collect()[('unmatched', 'GET', '404')]['count'], 2)
+
+    def test_healthz_needs_no_authentication(self):
+        self.client.credentials()
+        resp = self.client.get('/healthz')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), {'status': 'ok'})
+        with mock.patch.object(connection, 'cursor', side_effect=OperationalError('down')):
+            self.assertEqual(self.client.get('/healthz').status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    async def test_async_requests_are_recorded(self):
+        resp = await self.async_client.get('/healthz')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(metrics.registry.series[('healthz', 'GET', '200')]['count'], 1)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0.000001, SLOW_QUERY_MAX_ENTRIES=100)
+class SlowQueryTests(APITestCase):
+    def setUp(self):
+        seed_dataset(patients=3, doctors=1, medicaments=2, batch_size=10)
+        self.user = User.objects.create_user(username='slow', password='slow123')
+        slowqueries.flush()
+        RequeteLente.objects.all().delete()
+
+    def test_fingerprint_ignores_literals_and_in_list_length(self):
+        self.assertEqual(slowqueries.fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND nom = 'a'"),
+                         slowqueries.fingerprint("SELECT *  FROM t WHERE id IN (%s) AND nom = 'b''c'"))
+        self.assertNotEqual(slowqueries.fingerprint('SELECT * FROM t1 WHERE id = %s'),
+                            slowqueries.fingerprint('SELECT * FROM t2 WHERE id = %s'))
+
+    def test_repeated_queries_are_deduplicated_with_plan(self):
+        for pk in Patient.objects.values_list('pk', flat=True):
+            list(Patient.objects.filter(pk=pk))
+        slowqueries.flush()
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            entries = [entry for entry in RequeteLente.objects.all() if 'FROM "api_patient"' in entry.sql
+                       and '"api_patient"."id" = %s' in entry.sql and 'LIMIT' not in entry.sql]
+            self.assertEqual(len(entries), 1)
+            entry = entries[0]
+            self.assertEqual(entry.nombre, 3)
+            self.assertEqual(entry.base, 'default')
+            self.assertIn('SEARCH', entry.plan)
+            self.assertGreaterEqual(entry.duree_totale_ms, entry.duree_max_ms)
+            self.assertIn('api/tests.py', entry.pile)
+            self.assertEqual(entry.vue, '')
+
+    def test_records_originating_view(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.client.get('/api/patients/').status_code, status.HTTP_200_OK)
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            self.assertTrue(RequeteLente.objects.filter(vue='patient-list GET /api/patients/',
+                                                        sql__contains='"api_patient"').exists())
+
+    def test_keeps_only_the_costliest_fingerprints(self):
+        with override_settings(SLOW_QUERY_MAX_ENTRIES=2):
+            for i in range(4):
+                slowqueries.record({'alias': 'default', 'sql': f'SELECT * FROM t{i}', 'params': (), 'many': False,
+                                    'duration_ms': 10.0 * (i + 1), 'view': '', 'stack': '',
+                                    'at': timezone.now()})
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            self.assertEqual(sorted(RequeteLente.objects.values_list('sql', flat=True))[-2:],
+                             ['SELECT * FROM t2', 'SELECT * FROM t3'])
+            self.assertIn('EXPLAIN impossible', RequeteLente.objects.get(sql='SELECT * FROM t3').plan)
+
+    def test_background_recording(self):
+        threads = []
+        with override_settings(SLOW_QUERY_BACKGROUND=True, SLOW_QUERY_THRESHOLD_MS=0), \
+                mock.patch.object(slowqueries, 'record', lambda entry: threads.append(threading.current_thread())):
+            slowqueries.capture('default', 'SELECT 1', (), False, 500.0)
+            slowqueries.wait()
+        self.assertTrue(threads)
+        self.assertEqual({thread.name for thread in threads}, {'slow-query-recorder'})
+
+    def test_admin_report(self):
+        admin = User.objects.create_superuser(username='slowadmin', password='admin123')
+        list(Patient.objects.all())
+        slowqueries.flush()
+        self.client.force_login(admin)
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0):
+            resp = self.client.get(reverse('admin:api_requetelente_changelist'))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertContains(resp, 'api_patient')
+            entry = RequeteLente.objects.first()
+            resp = self.client.get(reverse('admin:api_requetelente_change', args=[entry.pk]))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
@@ -0,0 +1,184 @@
+"""Limitation de débit partagée entre workers, par fenêtre glissante à compteurs fixes.
+
+Le temps est découpé en tranches de la durée du taux (``1000/hour`` : tranches d'une heure). Pour
+chaque clé, le magasin garde un compteur par tranche ; le nombre de requêtes de la dernière fenêtre
+est estimé par ``précédente × (1 − écoulé / durée) + courante``. Une requête coûte un incrément et
+une lecture, quel que soit le taux, au lieu de la liste d'horodatages réécrite à chaque appel par les
+throttles de DRF.
+
+Les compteurs vivent dans le magasin de ``settings.THROTTLE_STORE`` :
+
+- ``SQLiteStore`` : fichier SQLite partagé par les workers d'un même hôte ;
+- ``CacheStore`` : alias de CACHES (Redis, Memcached...) dont ``incr`` est atomique, pour plusieurs
+  hôtes.
+
+La requête refusée est comptée : un client qui insiste reste limité. Les vues déclarent leur
+portée avec ``throttle_scope`` (ScopedThrottle), par exemple ``token`` sur ``/api/token/``.
+
+Le magasin garde aussi des repères à durée de vie (``mark``/``is_marked``) que tous les workers
+doivent voir, comme l'épinglage sur la base principale après une écriture (api/replicas.py).
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+from rest_framework import throttling
+
+# Une requête sur PURGE_EVERY supprime les tranches expirées du magasin SQLite
+PURGE_EVERY = 1000
+
+
+class SQLiteStore:
+    """Compteurs dans un fichier SQLite (mode WAL), une connexion par thread et par processus"""
+
+    def __init__(self, location, timeout=5):
+        self.location = str(location)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connect(self):
+        # Connexion ouverte dans le processus courant : celles héritées d'un fork ne sont pas réutilisées
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.location, timeout=self.timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Des compteurs perdus sur une panne de courant n'ont pas d'importance
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS compteurs (cle TEXT NOT NULL, tranche INTEGER NOT NULL, '
+                         'nombre INTEGER NOT NULL, expire REAL NOT NULL, PRIMARY KEY (cle, tranche)) '
+                         'WITHOUT ROWID')
+            conn.execute('CREATE INDEX IF NOT EXISTS compteurs_expire ON compteurs (expire)')
+            conn.execute('CREATE TABLE IF NOT EXISTS reperes (cle TEXT PRIMARY KEY, expire REAL NOT NULL) '
+                         'WITHOUT ROWID')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def hit(self, key, bucket, duration):
+        """Incrémente le compteur de la tranche ; renvoie (compteur de la tranche précédente, compteur courant)"""
+        conn = self.connect()
+        # La tranche sert encore de précédente pendant la tranche suivante
+        current = conn.execute(
+            'INSERT INTO compteurs (cle, tranche, nombre, expire) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT (cle, tranche) DO UPDATE SET nombre = nombre + 1 RETURNING nombre',
+            (key, bucket, (bucket + 2) * duration)).fetchone()[0]
+        row = conn.execute('SELECT nombre FROM compteurs WHERE cle = ? AND tranche = ?',
+                           (key, bucket - 1)).fetchone()
+        if random.randrange(PURGE_EVERY) == 0:
+            self.purge(bucket * duration)
+        return (row[0] if row else 0), current
+
+    def purge(self, now):
+        """Supprime les tranches qui ne servent plus à l'instant ``now`` (horloge du throttle)"""
+        self.connect().execute('DELETE FROM compteurs WHERE expire < ?', (now,))
+
+    def mark(self, key, seconds):
+        """Pose (ou prolonge) le repère ``key`` pour ``seconds`` secondes"""
+        conn, now = self.connect(), time.time()
+        conn.execute('INSERT INTO reperes (cle, expire) VALUES (?, ?) '
+                     'ON CONFLICT (cle) DO UPDATE SET expire = excluded.expire', (key, now + seconds))
+        if random.randrange(PURGE_EVERY) == 0:
+            conn.execute('DELETE FROM reperes WHERE expire < ?', (now,))
+
+    def is_marked(self, key):
+        return self.connect().execute('SELECT 1 FROM reperes WHERE cle = ? AND expire > ?',
+                                      (key, time.time())).fetchone() is not None
+
+    def clear(self):
+        conn = self.connect()
+        conn.execute('DELETE FROM compteurs')
+        conn.execute('DELETE FROM reperes')
+
+
+class CacheStore:
+    """Compteurs dans un cache Django partagé (``location`` : alias de CACHES)"""
+
+    def __init__(self, location='default'):
+        self.cache = caches[location]
+
+    def hit(self, key, bucket, duration):
+        current_key, previous_key = f'{key}:{bucket}', f'{key}:{bucket - 1}'
+        # Deux tranches de durée de vie : la tranche courante sert encore de précédente
+        timeout = 2 * duration
+        self.cache.add(current_key, 0, timeout)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Clé expirée entre add() et incr()
+            self.cache.set(current_key, 1, timeout)
+            current = 1
+        return self.cache.get(previous_key, 0), current
+
+    def mark(self, key, seconds):
+        self.cache.set(key, True, seconds)
+
+    def is_marked(self, key):
+        return self.cache.get(key) is not None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                options = dict(settings.THROTTLE_STORE)
+                _store = import_string(options.pop('BACKEND'))(**{k.lower(): v for k, v in options.items()})
+    return _store
+
+
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting == 'THROTTLE_STORE':
+        _store = None
+
+
+setting_changed.connect(_reset_store, dispatch_uid='throttling-reset-store')
+
+
+class SlidingWindowThrottle(throttling.SimpleRateThrottle):
+    """Throttle DRF dont le décompte est une fenêtre glissante à deux compteurs dans le magasin partagé"""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        bucket, self.elapsed = divmod(self.timer(), self.duration)
+        self.previous, self.current = get_store().hit(f'{self.key}:{self.duration}', int(bucket), self.duration)
+        return self.estimate() <= self.num_requests
+
+    def estimate(self):
+        return self.previous * (1 - self.elapsed / self.duration) + self.current
+
+    def wait(self):
+        """Secondes avant que la requête suivante passe"""
+        remaining = self.duration - self.elapsed
+        if self.current >= self.num_requests:
+            # La tranche courante est pleine : elle devient la précédente et doit perdre assez de poids
+            return remaining + self.duration * max(0, 1 - (self.num_requests - 1) / self.current)
+        if not self.previous:
+            return None
+        return max(0, self.duration * (1 - (self.num_requests - self.current - 1) / self.previous) - self.elapsed)
+
+
+class AnonThrottle(throttling.AnonRateThrottle, SlidingWindowThrottle):
+    pass
+
+
+class UserThrottle(throttling.UserRateThrottle, SlidingWindowThrottle):
+    pass
+
+
+class ScopedThrottle(throttling.ScopedRateThrottle, SlidingWindowThrottle):
+    """Portée ``throttle_scope`` de la vue, en plus des portées ``anon`` et ``user``"""
@@ -0,0 +1,103 @@
+"""Versions par table : chaque écriture sur une table incrémente son compteur.
+
+Les ETag et Last-Modified des réponses sont calculés à partir des versions des tables lues par le
+serializer, ce qui permet de répondre 304 sans exécuter la requête principale (voir
+api.mixins.ConditionalGetMixin). Les compteurs sont incrémentés après le commit, une fois par table
+et par transaction ; les écritures qui contournent save()/delete() et les signaux post_bulk_*
+doivent appeler changed() elles-mêmes.
+
+Pendant une requête HTTP, les versions lues sont mémorisées jusqu'à la fin de la requête (ou jusqu'au
+prochain incrément) : l'ETag et le cache des données de référence (api/cache.py) partagent une
+seule lecture.
+"""
+import functools
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import VersionTable
+
+_pending = threading.local()
+_request = threading.local()
+
+
+def table_of(model):
+    return model._meta.db_table
+
+
+def changed(*models):
+    """Signale une modification des tables des modèles ; le compteur est incrémenté au commit"""
+    tables = _pending.__dict__.setdefault('tables', set())
+    tables.update(table_of(model) for model in models)
+    transaction.on_commit(_flush)
+
+
+def _flush():
+    tables = _pending.__dict__.pop('tables', set())
+    if tables:
+        bump(tables)
+
+
+def start_request(**kwargs):
+    _request.versions = {}
+
+
+def end_request(**kwargs):
+    _request.__dict__.pop('versions', None)
+
+
+def bump(tables):
+    now = timezone.now()
+    versions = getattr(_request, 'versions', None)
+    if versions is not None:
+        versions.clear()
+    for table in sorted(tables):
+        rows = VersionTable.objects.filter(table=table)
+        if rows.update(version=F('version') + 1, date_modification=now):
+            continue
+        try:
+            with transaction.atomic():
+                VersionTable.objects.create(table=table, version=1, date_modification=now)
+        except IntegrityError:
+            rows.update(version=F('version') + 1, date_modification=now)
+
+
+def read(tables, also=()):
+    """{table: (version, date_modification)} en une requête ; une table jamais modifiée vaut (0, None).
+
+    Pendant une requête HTTP, les tables ``also`` sont lues en même temps et mémorisées.
+    """
+    versions = getattr(_request, 'versions', None)
+    missing = [table for table in tables if versions is None or table not in versions]
+    if missing and versions is not None:
+        missing += [table for table in also if table not in versions and table not in missing]
+    found = {table: (0, None) for table in missing}
+    if missing:
+        found.update((v.table, (v.version, v.date_modification))
+                     for v in VersionTable.objects.filter(table__in=missing))
+    if versions is None:
+        return found
+    versions.update(found)
+    return {table: versions[table] for table in tables}
+
+
+@functools.lru_cache(maxsize=None)
+def serializer_models(serializer_class):
+    """Modèles dont les données apparaissent dans la représentation du serializer"""
+    found = [serializer_class.Meta.model]
+    for field in serializer_class().fields.values():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.ListSerializer):
+            field = field.child
+        if isinstance(field, serializers.ModelSerializer):
+            nested = type(field)
+        else:
+            # Objet de référence servi par le cache (api.cache.ReferenceField)
+            nested = getattr(field, 'serializer_class', None)
+        if nested is not None:
+            found.extend(model for model in serializer_models(nested) if model not in found)
+    return tuple(found)
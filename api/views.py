@@ -1,17 +1,27 @@
-from rest_framework import viewsets, status, filters
+from rest_framework import serializers, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal, InvalidOperation
 from .models import (Patient, Medecin, Consultation, Medicament, Facturation,
-                     RendezVous, Ordonnance, OrdonnanceMedicament)
+                     RendezVous, Ordonnance, OrdonnanceMedicament, Paiement, PlageHoraire)
 from .serializers import (PatientSerializer, MedecinSerializer, ConsultationSerializer,
                          MedicamentSerializer, FacturationSerializer, RendezVousSerializer,
-                         OrdonnanceSerializer, OrdonnanceMedicamentSerializer)
+                         OrdonnanceSerializer, OrdonnanceMedicamentSerializer, PlageHoraireSerializer)
+from .mixins import (AgendaViewSetMixin, AsyncReadViewSetMixin, BulkWriteViewSetMixin, CompiledListMixin,
+                     ConditionalGetMixin, EagerLoadingViewSetMixin, ExportViewSetMixin, ImportViewSetMixin,
+                     ReplicaReadViewSetMixin)
+from .search import FullTextSearchFilter, RankedOrderingFilter
+from . import availability, blacklist, cache, overlaps, rollups, versioning
+from .calendars import parse_moment
 
 # JWT Token personnalisé
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -24,86 +34,178 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
+    throttle_scope = 'token'
+
+# Refresh token révoqué après rotation dans la liste noire de api/blacklist.py
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = blacklist.RefreshToken
+
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = CustomTokenRefreshSerializer
+
+# Recherche de créneaux : période par défaut et maximale (jours), nombre de créneaux renvoyés
+CRENEAUX_PERIODE = 7
+CRENEAUX_PERIODE_MAX = 62
+CRENEAUX_LIMITE = 20
+CRENEAUX_LIMITE_MAX = 500
+
 
 # ViewSets
-class PatientViewSet(viewsets.ModelViewSet):
+class HospitalModelViewSet(AsyncReadViewSetMixin, ReplicaReadViewSetMixin, EagerLoadingViewSetMixin, ConditionalGetMixin,
+                           ExportViewSetMixin, CompiledListMixin, BulkWriteViewSetMixin, viewsets.ModelViewSet):
+    """Base commune des ViewSets de l'API"""
+
+
+class PatientViewSet(AgendaViewSetMixin, ImportViewSetMixin, HospitalModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ['statut', 'genre']
     search_fields = ['nom', 'prenom', 'email', 'telephone']
     ordering_fields = ['date_enregistrement', 'nom', 'prenom']
     ordering = ['-date_enregistrement']
-    
+    cursor_pagination = True
+    last_modified_field = 'date_modification'
+    agenda_field = 'patient'
+    async_actions = (*HospitalModelViewSet.async_actions, 'consultations', 'facturations', 'rendez_vous')
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def consultations(self, request, pk=None):
         patient = self.get_object()
-        consultations = patient.consultations.all()
+        consultations = ConsultationSerializer.setup_eager_loading(patient.consultations.all())
         serializer = ConsultationSerializer(consultations, many=True)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def facturations(self, request, pk=None):
         patient = self.get_object()
-        facturations = patient.facturations.all()
+        facturations = FacturationSerializer.setup_eager_loading(patient.facturations.all())
         serializer = FacturationSerializer(facturations, many=True)
-        total = facturations.aggregate(Sum('montant'))['montant__sum'] or 0
-        paye = facturations.aggregate(Sum('montant_paye'))['montant_paye__sum'] or 0
+        [agregat] = rollups.read(('patient', str(patient.pk)))
         return Response({
             'facturations': serializer.data,
-            'total': total,
-            'paye': paye,
-            'solde': total - paye
+            'total': agregat.total_montant,
+            'paye': agregat.total_paye,
+            'solde': agregat.total_montant - agregat.total_paye
         })
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def rendez_vous(self, request, pk=None):
         patient = self.get_object()
-        rdv = patient.rendez_vous.all()
+        rdv = RendezVousSerializer.setup_eager_loading(patient.rendez_vous.all())
         serializer = RendezVousSerializer(rdv, many=True)
         return Response(serializer.data)
 
-class MedecinViewSet(viewsets.ModelViewSet):
+    # Variantes asynchrones des sous-ressources (mode ASGI, AsyncReadViewSetMixin)
+    async def aconsultations(self, request, pk=None):
+        patient = await self.aget_object()
+        consultations = ConsultationSerializer.setup_eager_loading(patient.consultations.all())
+        return Response(await self.aserialize(ConsultationSerializer, consultations, many=True))
+
+    async def afacturations(self, request, pk=None):
+        patient = await self.aget_object()
+        facturations = FacturationSerializer.setup_eager_loading(patient.facturations.all())
+        data = await self.aserialize(FacturationSerializer, facturations, many=True)
+        [agregat] = await rollups.aread(('patient', str(patient.pk)))
+        return Response({
+            'facturations': data,
+            'total': agregat.total_montant,
+            'paye': agregat.total_paye,
+            'solde': agregat.total_montant - agregat.total_paye
+        })
+
+    async def arendez_vous(self, request, pk=None):
+        patient = await self.aget_object()
+        rdv = RendezVousSerializer.setup_eager_loading(patient.rendez_vous.all())
+        return Response(await self.aserialize(RendezVousSerializer, rdv, many=True))
+
+class MedecinViewSet(AgendaViewSetMixin, HospitalModelViewSet):
     queryset = Medecin.objects.all()
     serializer_class = MedecinSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ['specialite']
     search_fields = ['nom', 'prenom', 'email', 'specialite']
     ordering_fields = ['nom', 'prenom', 'specialite']
     ordering = ['nom', 'prenom']
+    agenda_field = 'medecin'
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def consultations(self, request, pk=None):
         medecin = self.get_object()
-        consultations = medecin.consultations.all()
+        consultations = ConsultationSerializer.setup_eager_loading(medecin.consultations.all())
         serializer = ConsultationSerializer(consultations, many=True)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def rendez_vous(self, request, pk=None):
         medecin = self.get_object()
-        rdv = medecin.rendez_vous.filter(statut='confirme')
+        rdv = RendezVousSerializer.setup_eager_loading(medecin.rendez_vous.filter(statut='confirme'))
         serializer = RendezVousSerializer(rdv, many=True)
         return Response(serializer.data)
 
-class RendezVousViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def creneaux(self, request, pk=None):
+        medecin = self.get_object()
+        return self.rechercher_creneaux(request, medecin_id=medecin.pk)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], url_path='creneaux',
+            url_name='creneaux-specialite')
+    def creneaux_specialite(self, request):
+        specialite = request.query_params.get('specialite')
+        if specialite is not None and specialite not in dict(Medecin.SPECIALITES_CHOICES):
+            return Response({'error': f'Spécialité inconnue : {specialite}'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.rechercher_creneaux(request, specialite=specialite)
+
+    def rechercher_creneaux(self, request, **criteres):
+        """Premiers créneaux libres entre ``debut`` (maintenant) et ``fin`` (une semaine plus tard)"""
+        try:
+            debut = parse_moment(request.query_params.get('debut')) or timezone.now()
+            fin = parse_moment(request.query_params.get('fin')) or debut + timedelta(days=CRENEAUX_PERIODE)
+            limite = int(request.query_params.get('limite', CRENEAUX_LIMITE))
+        except ValueError:
+            return Response({'error': 'Paramètres de recherche invalides'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < limite <= CRENEAUX_LIMITE_MAX:
+            return Response({'error': f'La limite doit être comprise entre 1 et {CRENEAUX_LIMITE_MAX}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if fin <= debut or fin - debut > timedelta(days=CRENEAUX_PERIODE_MAX):
+            return Response({'error': f'La période doit durer au plus {CRENEAUX_PERIODE_MAX} jours'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        moment = serializers.DateTimeField().to_representation
+        return Response([
+            {'medecin': creneau.medecin_id, 'debut': moment(creneau.debut), 'fin': moment(creneau.fin)}
+            for creneau in availability.rechercher(debut, fin, limite, **criteres)
+        ])
+
+class PlageHoraireViewSet(HospitalModelViewSet):
+    queryset = PlageHoraire.objects.all()
+    serializer_class = PlageHoraireSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['medecin']
+
+class RendezVousViewSet(HospitalModelViewSet):
     queryset = RendezVous.objects.all()
     serializer_class = RendezVousSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ['statut', 'medecin']
     search_fields = ['patient__nom', 'patient__prenom', 'medecin__nom']
     ordering_fields = ['date_heure', 'date_creation']
     ordering = ['-date_heure']
+    cursor_pagination = True
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def confirmer(self, request, pk=None):
         rdv = self.get_object()
         rdv.statut = 'confirme'
-        rdv.save()
+        try:
+            with transaction.atomic():
+                rdv.save()
+        except IntegrityError:
+            # Rendez-vous annulé dont le créneau a été repris (contrainte de api/overlaps.py)
+            return Response({'error': overlaps.MESSAGE}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'status': 'rendez-vous confirmé'})
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
@@ -113,38 +215,42 @@ class RendezVousViewSet(viewsets.ModelViewSet):
         rdv.save()
         return Response({'status': 'rendez-vous annulé'})
 
-class ConsultationViewSet(viewsets.ModelViewSet):
+class ConsultationViewSet(HospitalModelViewSet):
     queryset = Consultation.objects.all()
     serializer_class = ConsultationSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ['statut', 'medecin', 'patient']
     search_fields = ['patient__nom', 'patient__prenom', 'medecin__nom']
     ordering_fields = ['date_consultation', 'statut']
     ordering = ['-date_consultation']
+    cursor_pagination = True
 
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def ordonnance(self, request, pk=None):
         consultation = self.get_object()
-        if hasattr(consultation, 'ordonnance'):
-            serializer = OrdonnanceSerializer(consultation.ordonnance)
+        ordonnance = OrdonnanceSerializer.setup_eager_loading(
+            Ordonnance.objects.filter(consultation=consultation)
+        ).first()
+        if ordonnance is not None:
+            serializer = OrdonnanceSerializer(ordonnance)
             return Response(serializer.data)
         return Response({'detail': 'Pas d\'ordonnance pour cette consultation'}, status=status.HTTP_404_NOT_FOUND)
 
-class MedicamentViewSet(viewsets.ModelViewSet):
+class MedicamentViewSet(ImportViewSetMixin, HospitalModelViewSet):
     queryset = Medicament.objects.all()
     serializer_class = MedicamentSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [FullTextSearchFilter, RankedOrderingFilter]
     search_fields = ['nom', 'description', 'fabricant']
     ordering_fields = ['nom', 'prix']
     ordering = ['nom']
 
-class OrdonnanceViewSet(viewsets.ModelViewSet):
+class OrdonnanceViewSet(HospitalModelViewSet):
     queryset = Ordonnance.objects.all()
     serializer_class = OrdonnanceSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RankedOrderingFilter]
     filterset_fields = ['patient', 'medecin']
     ordering_fields = ['date_ordonnance']
     ordering = ['-date_ordonnance']
@@ -157,28 +263,28 @@ class OrdonnanceViewSet(viewsets.ModelViewSet):
         frequence = request.data.get('frequence')
         duree = request.data.get('duree')
 
-        try:
-            medicament = Medicament.objects.get(id=medicament_id)
-            OrdonnanceMedicament.objects.create(
-                ordonnance=ordonnance,
-                medicament=medicament,
-                dosage=dosage,
-                frequence=frequence,
-                duree=duree
-            )
-            return Response({'status': 'Médicament ajouté'})
-        except Medicament.DoesNotExist:
+        medicament = cache.reference(Medicament).get(medicament_id)
+        if medicament is None:
             return Response({'error': 'Médicament non trouvé'}, status=status.HTTP_404_NOT_FOUND)
+        OrdonnanceMedicament.objects.create(
+            ordonnance=ordonnance,
+            medicament=medicament,
+            dosage=dosage,
+            frequence=frequence,
+            duree=duree
+        )
+        return Response({'status': 'Médicament ajouté'})
 
-class FacturationViewSet(viewsets.ModelViewSet):
+class FacturationViewSet(HospitalModelViewSet):
     queryset = Facturation.objects.all()
     serializer_class = FacturationSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ['statut', 'patient']
     search_fields = ['patient__nom', 'patient__prenom']
     ordering_fields = ['date_facturation', 'montant', 'statut']
     ordering = ['-date_facturation']
+    cursor_pagination = True
 
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def enregistrer_paiement(self, request, pk=None):
@@ -190,31 +296,50 @@ class FacturationViewSet(viewsets.ModelViewSet):
         except (InvalidOperation, TypeError):
             return Response({'error': 'Montant invalide'}, status=status.HTTP_400_BAD_REQUEST)
 
+        if not montant.is_finite():
+            return Response({'error': 'Montant invalide'}, status=status.HTTP_400_BAD_REQUEST)
+
         if montant <= 0:
             return Response({'error': 'Le montant doit être positif'}, status=status.HTTP_400_BAD_REQUEST)
 
-        facture.montant_paye = facture.montant_paye + montant
-        if facture.montant_paye >= facture.montant:
-            facture.statut = 'paye'
-        else:
-            facture.statut = 'partiel'
-        facture.save()
+        def relire():
+            values = Facturation.objects.filter(pk=facture.pk).values(*rollups.Contribution._fields).first()
+            if values is None:
+                raise NotFound()
+            return rollups.Contribution(**values)
+
+        with transaction.atomic():
+            Paiement.objects.create(facture=facture, montant=montant, utilisateur=request.user)
+            # Incrément fait par la base, sans lecture-modification-écriture de la ligne. La condition
+            # sur le statut lu ne rejoue l'UPDATE que si un autre paiement l'a changé entre-temps.
+            statut = facture.statut
+            while not Facturation.objects.filter(pk=facture.pk, statut=statut).update(
+                    montant_paye=F('montant_paye') + montant,
+                    statut=Case(When(montant__lte=F('montant_paye') + montant, then=Value('paye')),
+                                default=Value('partiel'))):
+                statut = relire().statut
+            versioning.changed(Facturation)
+            # La ligne reste verrouillée jusqu'au commit : seul ce paiement la distingue de l'ancienne
+            nouvelle = relire()
+            ancienne = nouvelle._replace(montant_paye=nouvelle.montant_paye - montant, statut=statut)
+            # Agrégats mis à jour après le commit, dans leur propre courte transaction : les paiements
+            # de factures différentes n'attendent pas le verrou de la ligne globale pendant le leur
+            transaction.on_commit(lambda: rollups.apply_change(old=ancienne, new=nouvelle))
 
         return Response({
             'status': 'Paiement enregistré',
-            'montant_paye': float(facture.montant_paye),
-            'solde': float(facture.montant - facture.montant_paye)
+            'montant_paye': float(nouvelle.montant_paye),
+            'solde': float(nouvelle.montant - nouvelle.montant_paye)
         })
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def statistiques(self, request):
-        total_facture = Facturation.objects.aggregate(Sum('montant'))['montant__sum'] or 0
-        total_paye = Facturation.objects.aggregate(Sum('montant_paye'))['montant_paye__sum'] or 0
-        impaye = Facturation.objects.filter(statut='impaye').count()
-        
+        # Lecture des agrégats maintenus à chaque écriture (api/rollups.py)
+        total, impaye = rollups.read(('global', ''), ('statut', 'impaye'))
+
         return Response({
-            'total_facturation': total_facture,
-            'total_paye': total_paye,
-            'total_impaye': total_facture - total_paye,
-            'nombre_factures_impayees': impaye
+            'total_facturation': total.total_montant,
+            'total_paye': total.total_paye,
+            'total_impaye': total.total_montant - total.total_paye,
+            'nombre_factures_impayees': impaye.nombre
         })
@@ -0,0 +1,49 @@
+"""Configuration gunicorn : ``gunicorn hospital_api.wsgi:application -c gunicorn.conf.py``.
+
+L'application est chargée une fois dans le processus maître (``preload_app``), qui précharge le cache
+des données de référence (api/cache.py) ; les workers en héritent au fork et le tiennent à jour
+grâce aux versions des tables partagées en base.
+
+Mode ASGI : ``GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn hospital_api.asgi:application
+-c gunicorn.conf.py`` ; les lectures sont alors servies par des vues asynchrones
+(api.mixins.AsyncReadViewSetMixin) et une requête lente n'immobilise plus un worker entier.
+
+Les mesures de chaque worker (api/metrics.py) sont écrites dans ``METRICS_DIR`` et additionnées par
+``/metrics`` ; le répertoire est vidé au démarrage du maître.
+"""
+import os
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+timeout = 60
+preload_app = True
+
+# Lu par les settings, chargés après ce fichier (preload_app)
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'hospital-metrics'))
+
+
+def when_ready(server):
+    from django.db import connections
+
+    from api import cache, metrics
+
+    metrics.reset_directory()
+    try:
+        cache.warm()
+    except Exception as exc:
+        # Base indisponible ou non migrée : les workers chargeront le cache à la demande
+        server.log.warning('Reference cache not warmed: %s', exc)
+    else:
+        server.log.info('Reference cache warmed')
+    finally:
+        # Les connexions du maître ne doivent pas être partagées par les workers forkés
+        connections.close_all()
+
+
+def worker_exit(server, worker):
+    from api import metrics
+
+    # Mesures des dernières requêtes, pas encore écrites
+    metrics.registry.flush(force=True)
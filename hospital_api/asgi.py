@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_api.settings')
+# Listes et détails servis par les vues asynchrones de l'API (api.mixins.AsyncReadViewSetMixin)
+os.environ.setdefault('DJANGO_ASYNC_READS', 'True')
 
 application = get_asgi_application()
@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # En premier : la durée mesurée couvre les autres middlewares
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -85,11 +87,19 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'hospital_api.wsgi.application'
 
+# Lectures (listes, détails, sous-ressources des patients) servies par des vues asynchrones ;
+# activé par hospital_api/asgi.py, sans effet sous WSGI où chaque vue asynchrone coûterait une boucle
+ASYNC_READS = config('DJANGO_ASYNC_READS', default=False, cast=bool)
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 # Database - support sqlite (default) or postgres via env vars
+# Réplicas en lecture (api/replicas.py) : DATABASE_REPLICAS=replica1,replica2 ; l'hôte PostgreSQL de
+# chaque alias est lu dans SQL_HOST_<ALIAS>
+DATABASE_REPLICAS = config('DATABASE_REPLICAS', default='', cast=Csv())
+
 if os.environ.get('DATABASE', '') == 'postgres':
     DATABASES = {
         'default': {
@@ -101,6 +111,12 @@ if os.environ.get('DATABASE', '') == 'postgres':
             'PORT': os.environ.get('SQL_PORT', '5432'),
         }
     }
+    for alias in DATABASE_REPLICAS:
+        DATABASES[alias] = {
+            **DATABASES['default'],
+            'HOST': os.environ.get(f'SQL_HOST_{alias.upper()}', DATABASES['default']['HOST']),
+            'TEST': {'MIRROR': 'default'},
+        }
 else:
     DATABASES = {
         'default': {
@@ -108,6 +124,18 @@ else:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+    # En local, les réplicas ouvrent le même fichier (deuxième connexion) : l'alias ``replica`` existe
+    # toujours pour essayer le routage avec DATABASE_REPLICAS=replica
+    for alias in DATABASE_REPLICAS or ['replica']:
+        DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+# Fenêtre (s) pendant laquelle un utilisateur qui vient d'écrire lit la base principale
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=15, cast=int)
+# Retard toléré d'un réplica (s) et intervalle (s) entre deux vérifications par processus
+REPLICA_MAX_LAG_SECONDS = config('REPLICA_MAX_LAG_SECONDS', default=5, cast=int)
+REPLICA_CHECK_SECONDS = config('REPLICA_CHECK_SECONDS', default=2, cast=int)
 
 
 # Password validation
@@ -154,29 +182,48 @@ from datetime import timedelta
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Utilisateur gardé par chaque worker (api/authentication.py)
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
-        'rest_framework.filters.SearchFilter',
-        'rest_framework.filters.OrderingFilter',
+        'api.search.FullTextSearchFilter',
+        'api.search.RankedOrderingFilter',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.HospitalPagination',
     'PAGE_SIZE': 20,
+    # Fenêtres glissantes partagées par les workers (api/throttling.py)
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'api.throttling.AnonThrottle',
+        'api.throttling.UserThrottle',
+        'api.throttling.ScopedThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
-        'anon': '100/hour',
-        'user': '1000/hour'
+        # Relevés pour les bancs de charge (manage.py benchmark_concurrency)
+        'anon': config('THROTTLE_ANON_RATE', default='100/hour'),
+        'user': config('THROTTLE_USER_RATE', default='1000/hour'),
+        # Obtention de jetons, par adresse IP
+        'token': config('THROTTLE_TOKEN_RATE', default='10/minute'),
     },
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Magasin des compteurs de throttling : fichier SQLite partagé par les workers de l'hôte, ou
+# THROTTLE_STORE_BACKEND=api.throttling.CacheStore et THROTTLE_STORE_LOCATION=<alias de CACHES>
+THROTTLE_STORE = {
+    'BACKEND': config('THROTTLE_STORE_BACKEND', default='api.throttling.SQLiteStore'),
+    'LOCATION': config('THROTTLE_STORE_LOCATION', default=str(BASE_DIR / 'throttle.sqlite3')),
+}
+
+# Durée (s) pendant laquelle un worker garde l'utilisateur authentifié ; 0 le relit à chaque requête
+AUTH_USER_CACHE_SECONDS = config('AUTH_USER_CACHE_SECONDS', default=60, cast=int)
+# Intervalle (s) entre deux lectures de la version de auth_user par worker : délai maximal avant
+# qu'un utilisateur désactivé ou modifié par un autre worker soit relu
+AUTH_USER_CHECK_SECONDS = config('AUTH_USER_CHECK_SECONDS', default=2, cast=int)
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
@@ -188,6 +235,12 @@ SIMPLE_JWT = {
     'SIGNING_KEY': SECRET_KEY,
 }
 
+# Liste noire des refresh tokens (api/blacklist.py) : taux de faux positifs du filtre de Bloom,
+# période (s) de reconstruction partagée et délai (s) avant de voir les révocations des autres workers
+BLACKLIST_BLOOM_ERROR_RATE = config('BLACKLIST_BLOOM_ERROR_RATE', default=0.001, cast=float)
+BLACKLIST_REBUILD_SECONDS = config('BLACKLIST_REBUILD_SECONDS', default=3600, cast=int)
+BLACKLIST_CHECK_SECONDS = config('BLACKLIST_CHECK_SECONDS', default=2, cast=int)
+
 # Security Settings for Production
 if not DEBUG:
     # HTTPS settings
@@ -207,6 +260,17 @@ if not DEBUG:
         "style-src": ("'self'", "'unsafe-inline'"),
     }
 
+# Mesures par endpoint (api/metrics.py, /metrics) : répertoire partagé par les workers (vide : mesures
+# du seul processus qui répond) et intervalle (s) d'écriture du fichier de chaque worker
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=int)
+
+# Requêtes lentes (api/slowqueries.py, admin) : seuil en ms (0 : désactivé), nombre d'empreintes
+# gardées et EXPLAIN dans un thread du worker plutôt que pendant la requête
+SLOW_QUERY_THRESHOLD_MS = config('SLOW_QUERY_THRESHOLD_MS', default=200, cast=float)
+SLOW_QUERY_MAX_ENTRIES = config('SLOW_QUERY_MAX_ENTRIES', default=100, cast=int)
+SLOW_QUERY_BACKGROUND = config('SLOW_QUERY_BACKGROUND', default=True, cast=bool)
+
 # Logging configuration
 import logging.handlers
 import os as _os
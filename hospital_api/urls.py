@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
+from api.metrics import healthz_view, metrics_view
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularRedocView,
@@ -30,6 +31,8 @@ def home(request):
 urlpatterns = [
     path('', home),
     path('admin/', admin.site.urls),
+    path('healthz', healthz_view, name='healthz'),
+    path('metrics', metrics_view, name='metrics'),
     
     # OpenAPI 3.0 Schema and Documentation
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),